@@ -1,11 +1,11 @@
+import os
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 from flask_bootstrap import Bootstrap
-from flask_mail import Mail
-from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from config import config   # 导入配置
 from flask_login import LoginManager
-from flask_pagedown import PageDown
+from .lazy import LazyExtension, load_mail, load_moment, load_pagedown
 
 # 初始化flask-login
 login_manager = LoginManager()
@@ -15,10 +15,40 @@ login_manager.session_protection = 'strong'
 login_manager.login_view = 'auth.login'
 
 bootstrap = Bootstrap()
-mail = Mail()
-moment = Moment()
+# 邮件、Moment 和 PageDown 在第一次使用时才导入
+mail = LazyExtension('mail', load_mail)
+moment = LazyExtension('moment', load_moment, template_global=True)
 db = SQLAlchemy()
-pagedown = PageDown()
+pagedown = LazyExtension('pagedown', load_pagedown, template_global=True)
+
+from .follow_cache import FollowGraphCache
+from .metrics import Metrics
+from .slow_queries import SlowQueryLog
+from .profiler import RequestProfiler
+from .assets import StaticAssets
+from .stream import Broker
+from .cache import Cache
+from .hot import HotScores
+from .counts import CountProvider
+from .snapshots import PostCache
+from .group_commit import GroupCommitter
+from .scheduler import Scheduler
+from .pages import PageCache
+from .admission import AdmissionControl
+follow_graph = FollowGraphCache()   # 关注关系缓存
+metrics = Metrics()     # 请求性能统计
+slow_queries = SlowQueryLog()   # 慢查询日志
+profiler = RequestProfiler()    # 按需性能剖析
+assets = StaticAssets()     # 带指纹的静态文件
+broker = Broker()   # 新文章和新评论的实时推送
+cache = Cache()     # 应用缓存，后端由 FLASKY_CACHE_TYPE 选择
+hot = HotScores()   # 热门文章的分数
+counts = CountProvider()    # 分页总数的缓存
+post_cache = PostCache()    # 文章快照的缓存
+group_commit = GroupCommitter()     # 新评论和 API 新文章的分组提交
+scheduler = Scheduler()     # 后台任务调度
+page_cache = PageCache()    # 匿名访客的整页缓存
+admission = AdmissionControl()  # 并发数和速率限制
 
 
 # 程序的工厂函数，用于在不同的环境中显示调用创建程序，提高测试覆盖率
@@ -27,6 +57,13 @@ def create_app(config_name):
     app.config.from_object(config[config_name]) # Flask app.config提供的函数，从类中直接导入配置
     config[config_name].init_app(app)
 
+    # 模板编译结果缓存在文件中，多个工作进程共享
+    if app.config.get('FLASKY_TEMPLATE_CACHE_DIR'):
+        cache_dir = app.config['FLASKY_TEMPLATE_CACHE_DIR']
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
     # 配置各种拓展
     bootstrap.init_app(app)
     mail.init_app(app)
@@ -34,6 +71,20 @@ def create_app(config_name):
     db.init_app(app)    # 初始化数据库
     login_manager.init_app(app)
     pagedown.init_app(app)
+    follow_graph.init_app(app)
+    metrics.init_app(app)
+    admission.init_app(app)     # 在其他请求钩子之前检查，超出限制的请求尽早返回
+    slow_queries.init_app(app)
+    profiler.init_app(app)
+    assets.init_app(app)
+    broker.init_app(app)
+    cache.init_app(app)
+    hot.init_app(app)
+    counts.init_app(app)
+    post_cache.init_app(app)
+    group_commit.init_app(app)
+    scheduler.init_app(app)
+    page_cache.init_app(app)
 
     # 注册蓝图
     from .main import main as main_blueprint
@@ -0,0 +1,191 @@
+# 准入控制
+# 请求进入视图之前按规则检查并发数和速率，超出限制时立即返回，不占用工作线程：
+#     rate、burst          每个客户端的令牌桶，每秒补充 rate 个令牌，最多积累 burst 个，超出时返回 429
+#     client_concurrency   每个客户端同时处理的请求数，超出时返回 429
+#     concurrency          本进程同时处理的请求数，满了之后最多排队 queue_timeout 秒，仍然没有空位时返回 503
+# FLASKY_ADMISSION_LIMITS 的键是端点（'api.get_posts'）或蓝图（'api'），一个请求同时受两者限制，
+# 给昂贵的端点单独设置较小的并发数，它们就不会占满整个蓝图的并发数。
+# 检查在认证之前进行，客户端是 IP 地址（request.remote_addr），请求中未经验证的用户名不能用来
+# 换一个新的令牌桶。部署在反向代理之后时 remote_addr 是代理的地址，所有客户端共用同一个桶，
+# 需要用 werkzeug 的 ProxyFix 从 X-Forwarded-For 取得真实地址。API 认证成功之后，
+# authenticated() 再按用户 id 检查一次速率，同一个用户换 IP 地址也受限制。
+# 令牌桶和并发数默认保存在进程内；FLASKY_ADMISSION_SHARED 为 True 时速率限制改用应用缓存中的计数器，
+# 缓存后端为 sqlite 或 redis 时在进程之间共享，按长度为 burst / rate 秒的固定窗口计数。
+# 并发数保护的是本进程的工作线程，始终在进程内统计
+import math
+import time
+from threading import BoundedSemaphore, Lock
+from flask import g, request, jsonify, Response
+
+
+class Rule(object):
+    def __init__(self, name, concurrency=None, client_concurrency=None,
+                 rate=None, burst=None, queue_timeout=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.client_concurrency = client_concurrency
+        self.rate = rate
+        self.burst = burst or rate
+        self.queue_timeout = queue_timeout
+        self.semaphore = BoundedSemaphore(concurrency) if concurrency else None
+
+
+class AdmissionControl(object):
+    def __init__(self, app=None):
+        self.enabled = False
+        self.shared = False
+        self.queue_timeout = 0.05
+        self.max_clients = 10000
+        self.rules = {}
+        self.cache = None
+        self.metrics = None
+        self._buckets = {}      # (规则, 客户端) -> (令牌数, 更新时间)
+        self._clients = {}      # (规则, 客户端) -> 处理中的请求数
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from . import cache, metrics
+        self.cache = cache
+        self.metrics = metrics
+        self.enabled = app.config.get('FLASKY_ADMISSION', False)
+        self.shared = app.config.get('FLASKY_ADMISSION_SHARED', False)
+        self.queue_timeout = app.config.get('FLASKY_ADMISSION_QUEUE_TIMEOUT',
+                                            0.05)
+        self.max_clients = app.config.get('FLASKY_ADMISSION_MAX_CLIENTS', 10000)
+        self.rules = dict(
+            (name, Rule(name, **limits)) for name, limits in
+            (app.config.get('FLASKY_ADMISSION_LIMITS') or {}).items())
+        self._buckets = {}
+        self._clients = {}
+        metrics.describe('flasky_admission_queue_seconds', 'histogram',
+                         'Time requests waited for a concurrency slot.')
+        metrics.describe('flasky_admission_shed_total', 'counter',
+                         'Requests rejected by admission control by reason.')
+        if self.enabled:
+            app.before_request(self._before_request)
+            app.teardown_request(self._teardown_request)
+
+    @staticmethod
+    def client():
+        return 'ip:%s' % request.remote_addr
+
+    def authenticated(self, user_id):
+        """认证成功之后按用户检查速率，超出限制时返回响应，否则返回 None"""
+        if not self.enabled:
+            return
+        for rule in self._rules():
+            if rule.rate:
+                retry_after = self._take(rule, 'user:%s' % user_id)
+                if retry_after:
+                    return self._shed(request.endpoint, 'rate', 429,
+                                      retry_after)
+
+    def _rules(self):
+        names = [request.endpoint, request.blueprint]
+        return [self.rules[name] for name in names
+                if name is not None and name in self.rules]
+
+    def _before_request(self):
+        rules = self._rules()
+        if not rules:
+            return
+        client = self.client()
+        held = g._admission = []
+        endpoint = request.endpoint
+        for rule in rules:
+            if rule.rate:
+                retry_after = self._take(rule, client)
+                if retry_after:
+                    return self._shed(endpoint, 'rate', 429, retry_after)
+            if rule.client_concurrency:
+                if not self._enter(rule, client):
+                    return self._shed(endpoint, 'client_concurrency', 429, 1)
+                held.append(lambda rule=rule: self._leave(rule, client))
+            if rule.semaphore is not None:
+                if not rule.semaphore.acquire(blocking=False):
+                    timeout = rule.queue_timeout if rule.queue_timeout \
+                        is not None else self.queue_timeout
+                    start = time.perf_counter()
+                    acquired = timeout > 0 and \
+                        rule.semaphore.acquire(timeout=timeout)
+                    self.metrics.observe('flasky_admission_queue_seconds',
+                                         time.perf_counter() - start,
+                                         endpoint=endpoint)
+                    if not acquired:
+                        return self._shed(endpoint, 'concurrency', 503, 1)
+                held.append(rule.semaphore.release)
+
+    def _teardown_request(self, exc):
+        for release in reversed(g.pop('_admission', [])):
+            release()
+
+    def _shed(self, endpoint, reason, status, retry_after):
+        self.metrics.inc('flasky_admission_shed_total', endpoint=endpoint,
+                         reason=reason)
+        retry_after = str(int(math.ceil(retry_after)))
+        message = 'Too many requests' if status == 429 else \
+            'Server is busy'
+        if request.blueprint == 'api' or (
+                request.accept_mimetypes.accept_json and
+                not request.accept_mimetypes.accept_html):
+            response = jsonify({'error': message.lower(),
+                                'message': 'Retry after %s seconds' %
+                                           retry_after})
+            response.status_code = status
+        else:
+            response = Response(message + '\n', status=status,
+                                mimetype='text/plain')
+        response.headers['Retry-After'] = retry_after
+        return response
+
+    # 取一个令牌，成功时返回 0，否则返回需要等待的秒数
+    def _take(self, rule, client):
+        now = time.time()
+        if self.shared:
+            window = rule.burst / float(rule.rate)
+            index = int(now // window)
+            count = self.cache.incr(
+                'admission:%s:%s:%d' % (rule.name, client, index),
+                timeout=int(window * 2) + 1)
+            return 0 if count <= rule.burst else (index + 1) * window - now
+        key = (rule.name, client)
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (rule.burst, now))
+            tokens = min(rule.burst, tokens + (now - updated) * rule.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                retry_after = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                retry_after = (1 - tokens) / rule.rate
+            if len(self._buckets) > self.max_clients:
+                self._prune(now)
+        return retry_after
+
+    # 删除已经补满的令牌桶，它们和不存在的桶相同
+    def _prune(self, now):
+        for key, (tokens, updated) in list(self._buckets.items()):
+            rule = self.rules.get(key[0])
+            if rule is None or \
+                    tokens + (now - updated) * rule.rate >= rule.burst:
+                del self._buckets[key]
+
+    def _enter(self, rule, client):
+        key = (rule.name, client)
+        with self._lock:
+            count = self._clients.get(key, 0)
+            if count >= rule.client_concurrency:
+                return False
+            self._clients[key] = count + 1
+            return True
+
+    def _leave(self, rule, client):
+        key = (rule.name, client)
+        with self._lock:
+            count = self._clients.get(key, 0) - 1
+            if count > 0:
+                self._clients[key] = count
+            else:
+                self._clients.pop(key, None)
@@ -1,3 +1,3 @@
 from flask import Blueprint
 api = Blueprint('api', __name__)
-from . import authentication, posts, users, comments, errors
+from . import authentication, posts, users, comments, follows, errors
@@ -2,6 +2,7 @@ from flask_httpauth import HTTPBasicAuth
 from flask import g, jsonify
 from ..models import User, AnonymousUser
 from .errors import unauthorized, forbidden
+from .. import admission
 from . import api
 auth = HTTPBasicAuth()
 
@@ -37,6 +38,9 @@ def before_request():
     if not g.current_user.is_anonymous and \
             not g.current_user.confirmed:
         return forbidden('Unconfirmed account')
+    # 准入控制在认证之前只能按 IP 地址限制，这里再按验证过的用户限制
+    if not g.current_user.is_anonymous:
+        return admission.authenticated(g.current_user.id)
 
 
 # 生成认证令牌，g.token_used用于避免使用就令牌请求新令牌
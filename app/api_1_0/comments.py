@@ -0,0 +1,31 @@
+from flask import jsonify, request, url_for, current_app
+from . import api
+from .authentication import auth
+from ..models import Post
+
+
+# 文章的评论，总数取自文章的 comment_count
+@api.route('/posts/<int:id>/comments/')
+@auth.login_required
+def get_post_comments(id):
+    post = Post.query.get_or_404(id)
+    page = request.args.get('page', 1, type=int)
+    pagination = post.paginate_comments(
+        page, current_app.config['FLASKY_COMMENTS_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before'))
+    prev = None
+    if pagination.has_prev:
+        prev = url_for('api.get_post_comments', id=id,
+                       page=pagination.page - 1,
+                       before=pagination.prev_anchor, _external=True)
+    next = None
+    if pagination.has_next:
+        next = url_for('api.get_post_comments', id=id,
+                       page=pagination.page + 1,
+                       after=pagination.next_anchor, _external=True)
+    return jsonify({
+        'comments': [comment.to_json() for comment in pagination.items],
+        'prev': prev,
+        'next': next,
+        'count': pagination.total
+    })
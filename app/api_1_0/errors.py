@@ -1,6 +1,6 @@
 from flask import jsonify
 from . import api
-from ..exceptions import ValidationError
+from ..exceptions import ValidationError, CommitTimeout
 
 
 def bad_request(message):
@@ -15,6 +15,12 @@ def forbidden(message):
     return response
 
 
+def conflict(message):
+    response = jsonify({'error': 'conflict', 'message': message})
+    response.status_code = 409
+    return response
+
+
 def unauthorized(message):
     response = jsonify({'error': 'forbidden', 'message': message})
     response.status_code = 401
@@ -24,3 +30,12 @@ def unauthorized(message):
 @api.errorhandler(ValidationError)
 def validation_error(e):
     return bad_request(e.args[0])
+
+
+# 分组提交超时，新对象没有写入，客户端可以重试
+@api.errorhandler(CommitTimeout)
+def commit_timeout(e):
+    response = jsonify({'error': 'service unavailable', 'message': e.args[0]})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
@@ -0,0 +1,56 @@
+# 批量关注和取消关注，也用于导入关注列表
+# 请求体为 {"follow": [...], "unfollow": [...]}，列表中是用户名或用户 id。
+# 用户名和 id 用一条查询解析，和已有的关注关系用一条查询比较，插入和删除在同一个事务中提交
+from flask import jsonify, request, url_for, g, current_app
+from sqlalchemy.exc import IntegrityError
+from . import api
+from .decorators import permission_required
+from .errors import conflict
+from ..models import User, Permission
+from ..exceptions import ValidationError
+from .. import db
+
+
+def _users(data, key):
+    values = data.get(key) or []
+    if not isinstance(values, list):
+        raise ValidationError('%s must be a list' % key)
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (str, int)):
+            raise ValidationError('%s must contain usernames or user ids' % key)
+    return values
+
+
+@api.route('/follows/', methods=['POST'])
+@permission_required(Permission.FOLLOW)
+def update_follows():
+    data = request.json
+    if not isinstance(data, dict):
+        raise ValidationError('request does not have a JSON object')
+    follow = _users(data, 'follow')
+    unfollow = _users(data, 'unfollow')
+    if len(follow) + len(unfollow) > \
+            current_app.config['FLASKY_BULK_FOLLOW_MAX']:
+        raise ValidationError('too many users, at most %d' %
+                              current_app.config['FLASKY_BULK_FOLLOW_MAX'])
+    resolved, not_found = User.resolve(follow + unfollow)
+    follow_ids = set(resolved[v] for v in follow if v in resolved)
+    unfollow_ids = set(resolved[v] for v in unfollow if v in resolved)
+    if follow_ids & unfollow_ids:
+        raise ValidationError('a user cannot be both followed and unfollowed')
+    user = g.current_user
+    try:
+        added, removed = user.update_follows(follow_ids, unfollow_ids)
+        db.session.commit()
+    except IntegrityError:
+        # 其他请求同时关注了同一个用户
+        db.session.rollback()
+        return conflict('follows changed concurrently, please retry')
+    return jsonify({
+        'followed': [url_for('api.get_user', id=id, _external=True)
+                     for id in added],
+        'unfollowed': [url_for('api.get_user', id=id, _external=True)
+                       for id in removed],
+        'not_found': not_found,
+        'followed_count': user.followed_count() - 1
+    })
@@ -1,10 +1,11 @@
 from . import api
 from .authentication import auth
 from ..models import Post, Permission
-from flask import jsonify, request, url_for
+from flask import jsonify, request, url_for, g
 from .decorators import permission_required
-from .. import db
+from .. import db, post_cache, group_commit
 from .errors import forbidden
+from .users import posts_page
 
 
 @api.route('/posts/')
@@ -14,20 +15,32 @@ def get_posts():
     return jsonify({'posts': [post.to_json() for post in posts]})
 
 
+# 热门文章
+@api.route('/posts/hot/')
+@auth.login_required
+def get_hot_posts():
+    return posts_page(Post.query, 'api.get_hot_posts',
+                      order=(Post.hot_score.desc(), Post.id.desc()),
+                      count_key='posts')
+
+
 @api.route('/posts/<int:id>')
 @auth.login_required
 def get_post(id):
-    post = Post.query.get_or_404(id)
-    return jsonify(post.to_json)
+    return jsonify(post_cache.get_or_404(id).to_json())
 
 
 @api.route('/posts/',methods=['POST'])
 @permission_required(Permission.WRITE_ARTICLES)
 def new_post():
     post = Post.from_json(request.json)
-    post.author = g.current_user
-    db.session.add(post)
-    db.session.commit()
+    if group_commit.enabled:
+        post.author_id = g.current_user.id
+        post = Post.query.get(group_commit.add(post))
+    else:
+        post.author = g.current_user
+        db.session.add(post)
+        db.session.commit()
     # 响应包括新建的资源，这样客户端无需再创建资源后在立即发起一个 GET 请求以获取资源
     return jsonify(post.to_json()), 201, \
         {'Location': url_for('api.get_post', id=post.id, _external=True)}
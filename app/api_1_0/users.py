@@ -0,0 +1,63 @@
+from flask import jsonify, url_for, current_app, request
+from . import api
+from .authentication import auth
+from ..models import User, Post
+from .. import counts
+
+
+@api.route('/users/<int:id>')
+@auth.login_required
+def get_user(id):
+    user = User.query.get_or_404(id)
+    return jsonify(user.to_json())
+
+
+# 分页返回文章，prev 和 next 为上一页和下一页的地址，默认按时间倒序
+def posts_page(query, endpoint, order=None, count_key=None, **kwargs):
+    page = request.args.get('page', 1, type=int)
+    if order is None:
+        order = (Post.timestamp.desc(),)
+    pagination = counts.paginate(
+        query.order_by(*order), page,
+        current_app.config['FLASKY_POSTS_PER_PAGE'], count_key)
+    prev = None
+    if pagination.has_prev:
+        prev = url_for(endpoint, page=page - 1, _external=True, **kwargs)
+    next = None
+    if pagination.has_next:
+        next = url_for(endpoint, page=page + 1, _external=True, **kwargs)
+    return jsonify({
+        'posts': [post.to_json() for post in pagination.items],
+        'prev': prev,
+        'next': next,
+        'count': pagination.total
+    })
+
+
+@api.route('/users/<int:id>/posts/')
+@auth.login_required
+def get_user_posts(id):
+    user = User.query.get_or_404(id)
+    return posts_page(user.posts, 'api.get_user_posts',
+                      count_key='posts:author:%d' % id, id=id)
+
+
+@api.route('/users/<int:id>/timeline/')
+@auth.login_required
+def get_user_followed_posts(id):
+    user = User.query.get_or_404(id)
+    return posts_page(user.followed_posts, 'api.get_user_followed_posts',
+                      id=id)
+
+
+# 推荐关注的用户
+@api.route('/users/<int:id>/recommendations')
+@auth.login_required
+def get_user_recommendations(id):
+    user = User.query.get_or_404(id)
+    users = user.recommended_users(
+        current_app.config['FLASKY_RECOMMENDATIONS_SHOWN'])
+    return jsonify({'recommendations': [
+        {'username': u.username,
+         'url': url_for('main.user', username=u.username, _external=True)}
+        for u in users]})
@@ -0,0 +1,134 @@
+# 冷数据归档
+# 文章本身和所有评论都早于截止时间的文章，连同评论一起移入 archived_posts 和 archived_comments 表，
+# 按 id 分块处理。每一块先写入归档库并提交，再从在线的表中删除；中途失败时重新运行即可，
+# 已经写入归档库的行会先删除再重新写入。id 最大的文章不归档，避免 SQLite 复用它的 id。
+# 复制和删除之间可能有新评论：删除时只删除已经复制的评论 id，并在同一个事务中重新检查文章
+# 仍然是冷数据、没有复制之外的评论，检查不通过的文章留在在线的表中，并从归档库中删除它的副本
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from . import db, cache, counts
+from .models import Post, Comment, ArchivedPost, ArchivedComment
+
+
+def cold_post_ids(before, after_id, limit):
+    posts = Post.__table__
+    comments = Comment.__table__
+    active = db.select([comments.c.id]).where(
+        comments.c.post_id == posts.c.id).where(comments.c.timestamp >= before)
+    latest = db.select([db.func.max(posts.c.id)]).as_scalar()
+    query = db.select([posts.c.id]).where(posts.c.timestamp < before) \
+        .where(~db.exists(active)).where(posts.c.id < latest) \
+        .where(posts.c.id > after_id).order_by(posts.c.id).limit(limit)
+    return [row[0] for row in db.session.execute(query)]
+
+
+def _copy(rows, table):
+    columns = set(table.c.keys())
+    return [dict((key, value) for key, value in row.items() if key in columns)
+            for row in rows]
+
+
+def _chunks(ids, size=500):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+# 在删除的事务中重新检查，返回仍然可以删除的文章 id。
+# 锁住文章行（SQLite 不支持 FOR UPDATE，检查和删除在同一个写事务中，并发的写入会使其中一方失败）
+def _still_cold(post_ids, comment_ids, before):
+    posts = Post.__table__
+    comments = Comment.__table__
+    ids = set(post_ids)
+    for chunk in _chunks(post_ids):
+        rows = db.session.execute(
+            db.select([posts.c.id]).where(posts.c.id.in_(chunk))
+            .where(posts.c.timestamp < before).with_for_update())
+        found = set(row[0] for row in rows)
+        ids -= set(chunk) - found
+    copied = set(comment_ids)
+    for chunk in _chunks(sorted(ids)):
+        for id, post_id in db.session.execute(
+                db.select([comments.c.id, comments.c.post_id])
+                .where(comments.c.post_id.in_(chunk))):
+            if id not in copied:
+                ids.discard(post_id)
+    return ids
+
+
+def archive_posts(before, chunk_size=500, progress=None):
+    """归档 before 之前的文章和评论，返回 (文章数, 评论数)"""
+    posts = Post.__table__
+    comments = Comment.__table__
+    archived_posts = ArchivedPost.__table__
+    archived_comments = ArchivedComment.__table__
+    engine = db.get_engine(bind='archive')
+    db.session.commit()
+    moved_posts = moved_comments = 0
+    last_id = 0
+    while True:
+        post_ids = cold_post_ids(before, last_id, chunk_size)
+        if not post_ids:
+            break
+        last_id = post_ids[-1]
+        post_rows = db.session.execute(
+            db.select([posts]).where(posts.c.id.in_(post_ids))).fetchall()
+        comment_rows = db.session.execute(
+            db.select([comments]).where(comments.c.post_id.in_(post_ids))
+        ).fetchall()
+        db.session.commit()
+        with engine.begin() as connection:
+            connection.execute(archived_comments.delete().where(
+                archived_comments.c.post_id.in_(post_ids)))
+            connection.execute(archived_posts.delete().where(
+                archived_posts.c.id.in_(post_ids)))
+            connection.execute(archived_posts.insert(),
+                               _copy(post_rows, archived_posts))
+            if comment_rows:
+                connection.execute(archived_comments.insert(),
+                                   _copy(comment_rows, archived_comments))
+        moved = _still_cold(post_ids, [row['id'] for row in comment_rows],
+                            before)
+        post_rows = [row for row in post_rows if row['id'] in moved]
+        comment_rows = [row for row in comment_rows if row['post_id'] in moved]
+        for chunk in _chunks(row['id'] for row in comment_rows):
+            db.session.execute(comments.delete().where(comments.c.id.in_(chunk)))
+        for chunk in _chunks(sorted(moved)):
+            db.session.execute(posts.delete().where(posts.c.id.in_(chunk)))
+        db.session.commit()
+        skipped = sorted(set(post_ids) - moved)
+        if skipped:
+            with engine.begin() as connection:
+                connection.execute(archived_comments.delete().where(
+                    archived_comments.c.post_id.in_(skipped)))
+                connection.execute(archived_posts.delete().where(
+                    archived_posts.c.id.in_(skipped)))
+        if not post_rows:
+            continue
+        # 批量删除不会触发模型事件，直接失效受影响的缓存
+        cache.invalidate('posts', *sorted(
+            set('post:%s' % row['id'] for row in post_rows) |
+            set('user:%s' % row['author_id'] for row in post_rows)))
+        deltas = Counter()
+        for row in post_rows:
+            deltas['posts'] -= 1
+            deltas['posts:author:%s' % row['author_id']] -= 1
+        for row in comment_rows:
+            for key in counts.comment_keys(row):
+                deltas[key] -= 1
+        for key, delta in sorted(deltas.items()):
+            counts.adjust(key, delta)
+        moved_posts += len(post_rows)
+        moved_comments += len(comment_rows)
+        if progress is not None:
+            progress(moved_posts, moved_comments)
+    return moved_posts, moved_comments
+
+
+def archive_older_than(days, chunk_size=500, progress=None):
+    """归档 days 天之前的数据，返回 (文章数, 评论数, 耗时)"""
+    start = time.time()
+    moved_posts, moved_comments = archive_posts(
+        datetime.utcnow() - timedelta(days=days), chunk_size, progress)
+    return moved_posts, moved_comments, time.time() - start
@@ -0,0 +1,142 @@
+# 静态文件指纹
+# manage.py build_assets 把 static 目录中的文件按内容 hash 复制为 dist/<名称>.<hash>.<扩展名>，
+# 文本文件同时生成 gzip 压缩版本，并写入 manifest.json。程序启动时读取 manifest，
+# url_for('static', filename='styles.css') 自动生成带指纹的地址，带指纹的文件内容永远不会改变，
+# 因此响应头设置为缓存一年且 immutable，浏览器再次访问页面时不再请求静态文件。
+# 重新生成时保留旧的带指纹文件：仍在使用旧 manifest 的工作进程和已缓存的页面会继续引用它们，
+# 由 manage.py prune_assets 删除不在当前 manifest 中、并且超过一定天数的文件
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import time
+from flask import request, send_from_directory
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+# 只压缩文本类型，图片等二进制文件压缩效果很差
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ico', '.txt', '.json', '.map')
+MAX_AGE = 365 * 24 * 60 * 60
+
+
+def build(static_folder, dist_dir=DIST_DIR):
+    """生成带指纹的文件和 manifest，返回 manifest（原文件名 -> 带指纹的文件名）"""
+    output = os.path.join(static_folder, dist_dir)
+    if not os.path.exists(output):
+        os.makedirs(output)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        # 跳过输出目录本身
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) !=
+                   os.path.abspath(output)]
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            base, ext = os.path.splitext(filename)
+            fingerprinted = '%s/%s.%s%s' % (dist_dir, base, digest, ext)
+            target = os.path.join(static_folder, fingerprinted)
+            targets = [target]
+            if ext.lower() in COMPRESSIBLE:
+                targets.append(target + '.gz')
+            # 文件名由内容决定，已经存在的文件不用重写，只更新修改时间，避免被 prune 删除
+            if all(os.path.exists(t) for t in targets):
+                for t in targets:
+                    os.utime(t, None)
+            else:
+                if not os.path.exists(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                with open(target, 'wb') as f:
+                    f.write(data)
+                if len(targets) > 1:
+                    with gzip.open(target + '.gz', 'wb', 9) as f:
+                        f.write(data)
+            manifest[filename] = fingerprinted
+    # 先写临时文件再改名，启动中的工作进程不会读到写了一半的 manifest
+    path = os.path.join(output, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+
+def prune(static_folder, days=7, dist_dir=DIST_DIR):
+    """删除不在当前 manifest 中并且超过 days 天没有生成过的带指纹文件，返回删除的文件名"""
+    output = os.path.join(static_folder, dist_dir)
+    path = os.path.join(output, MANIFEST)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        current = set(json.load(f).values())
+    current |= set(name + '.gz' for name in current)
+    cutoff = time.time() - days * 24 * 60 * 60
+    removed = []
+    for root, dirs, files in os.walk(output):
+        for name in files:
+            target = os.path.join(root, name)
+            filename = os.path.relpath(target, static_folder).replace(
+                os.sep, '/')
+            if target == path or filename in current or \
+                    os.path.getmtime(target) > cutoff:
+                continue
+            os.remove(target)
+            removed.append(filename)
+    return sorted(removed)
+
+
+class StaticAssets(object):
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.fingerprinted = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.manifest = {}
+        path = os.path.join(app.static_folder, DIST_DIR, MANIFEST)
+        if app.config.get('FLASKY_FINGERPRINT_ASSETS', True) and \
+                os.path.exists(path):
+            with open(path) as f:
+                self.manifest = json.load(f)
+        self.fingerprinted = set(self.manifest.values())
+        app.url_defaults(self._url_defaults)
+        self._send_static_file = app.view_functions['static']
+        app.view_functions['static'] = self.send_static_file
+
+    # 替换 url_for('static') 中的文件名
+    def _url_defaults(self, endpoint, values):
+        if endpoint == 'static':
+            filename = values.get('filename')
+            if filename in self.manifest:
+                values['filename'] = self.manifest[filename]
+
+    # dist 目录中旧的带指纹文件不在当前 manifest 中，内容同样不会改变
+    def is_fingerprinted(self, filename):
+        return filename in self.fingerprinted or (
+            filename.startswith(DIST_DIR + '/') and
+            not filename.endswith(('/' + MANIFEST, '.gz')))
+
+    def send_static_file(self, filename):
+        if not self.is_fingerprinted(filename):
+            return self._send_static_file(filename=filename)
+        mimetype = mimetypes.guess_type(filename)[0] or \
+            'application/octet-stream'
+        compressed = os.path.join(self.static_folder, filename + '.gz')
+        if 'gzip' in request.headers.get('Accept-Encoding', '') and \
+                os.path.exists(compressed):
+            response = send_from_directory(self.static_folder,
+                                           filename + '.gz',
+                                           mimetype=mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_from_directory(self.static_folder, filename,
+                                           mimetype=mimetype)
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = \
+            'public, max-age=%d, immutable' % MAX_AGE
+        response.headers.pop('Expires', None)
+        return response
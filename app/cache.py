@@ -0,0 +1,352 @@
+# 可替换后端的缓存
+# 三种后端：进程内的 LRU（simple）、多个本地工作进程共享的 SQLite 文件（sqlite）、
+# Redis 或兼容 Redis 协议的服务（redis）。由 FLASKY_CACHE_TYPE 选择，create_app 中初始化。
+#
+# 缓存项可以带标签（例如 'post:1'、'user:2'、'posts'），每个标签在后端中保存一个版本号，
+# 缓存项记录写入时各标签的版本号，读取时版本号不一致即视为未命中。
+# invalidate(tag) 只需把标签的版本号加一，所有进程中带这个标签的缓存项都会失效。
+# 标签的版本号和缓存项保存在同一个后端中，可能被 LRU 或 Redis 的内存策略淘汰，
+# 因此不存在的标签以随机数作为初始版本号创建：淘汰后重新创建的版本号不会和旧缓存项记录的版本号相同。
+# 模型的插入、修改、删除事件把需要失效的标签记在会话中，提交之后再失效，回滚时丢弃。
+import itertools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.orm import object_session
+from .signals import comments_changed
+
+
+class LRUBackend(object):
+    """进程内缓存，值直接保存对象，不做序列化"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    # 调用方持有锁
+    def _store(self, key, expires, value):
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout else None
+        with self._lock:
+            self._store(key, expires, value)
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and (item[0] is None or item[0] >= time.time()):
+                return False
+            self._store(key, time.time() + timeout if timeout else None,
+                        value)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, delta=1, create=True):
+        with self._lock:
+            expires, value = self._data.get(key, (None, None))
+            if expires is not None and expires < time.time():
+                expires, value = None, None
+            if value is None and not create:
+                return None
+            value = (value or 0) + delta
+            self._store(key, expires, value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteBackend(object):
+    """保存在 SQLite 文件中的缓存，同一台机器上的多个工作进程共享，重启后仍然有效"""
+
+    def __init__(self, path, max_entries=100000, prune_every=1000):
+        self.path = path
+        self.max_entries = max_entries
+        # 每写入 prune_every 次清理一次，表中最多超出上限这么多项
+        self.prune_every = prune_every
+        self._writes = itertools.count(1)
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                         '(key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+
+    # 每个线程一个连接，WAL 模式下读写互不阻塞
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        conn = self._connection()
+        rows = conn.execute(
+            'SELECT key, value, expires FROM cache WHERE key IN (%s)' %
+            ','.join('?' * len(keys)), list(keys)).fetchall()
+        now = time.time()
+        found = dict((key, pickle.loads(value)) for key, value, expires in rows
+                     if expires is None or expires >= now)
+        return [found.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout else None
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                         (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                          expires))
+        if self.max_entries and next(self._writes) % self.prune_every == 0:
+            self._prune()
+
+    def add(self, key, value, timeout=None):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ? AND expires < ?',
+                         (key, now))
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO cache VALUES (?, ?, ?)',
+                (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                 now + timeout if timeout else None))
+            return cursor.rowcount == 1
+
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def incr(self, key, delta=1, create=True):
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT value, expires FROM cache WHERE key = ?',
+                               (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] < time.time():
+                row = None
+            if row is None and not create:
+                return None
+            value = (pickle.loads(row[0]) if row else 0) + delta
+            conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                         (key, pickle.dumps(value), row[1] if row else None))
+        return value
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache')
+
+    # 删除过期的缓存项，数量仍然超过上限时删除最早过期的
+    def _prune(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+            conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                         'WHERE expires IS NOT NULL ORDER BY expires LIMIT '
+                         'max(0, (SELECT count(*) FROM cache) - ?))',
+                         (self.max_entries,))
+
+
+class RedisBackend(object):
+    """Redis 后端，client 可以是 redis.StrictRedis 或任何实现了相同方法的对象"""
+
+    def __init__(self, client, prefix='flasky:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, prefix='flasky:'):
+        import redis
+        return cls(redis.StrictRedis.from_url(url), prefix)
+
+    # incrby 写入的计数器是十进制整数，其他值是 pickle（以 0x80 开头）
+    @staticmethod
+    def _loads(value):
+        if value is None:
+            return None
+        if value[:1] == b'\x80':
+            return pickle.loads(value)
+        return int(value)
+
+    def get(self, key):
+        return self._loads(self.client.get(self.prefix + key))
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        values = self.client.mget([self.prefix + key for key in keys])
+        return [self._loads(value) for value in values]
+
+    # 整数按十进制保存，可以直接用 incrby 修改
+    @staticmethod
+    def _dumps(value):
+        if type(value) is int:
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def set(self, key, value, timeout=None):
+        self.client.set(self.prefix + key, self._dumps(value),
+                        ex=int(timeout) if timeout else None)
+
+    def add(self, key, value, timeout=None):
+        return bool(self.client.set(self.prefix + key, self._dumps(value),
+                                    ex=int(timeout) if timeout else None,
+                                    nx=True))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key, delta=1, create=True):
+        if not create and not self.client.exists(self.prefix + key):
+            return None
+        return self.client.incrby(self.prefix + key, delta)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class Cache(object):
+    def __init__(self, app=None):
+        self.backend = LRUBackend()
+        self.default_timeout = 300
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache_type = app.config.get('FLASKY_CACHE_TYPE', 'simple')
+        if cache_type == 'sqlite':
+            self.backend = SQLiteBackend(app.config['FLASKY_CACHE_SQLITE_PATH'])
+        elif cache_type == 'redis':
+            self.backend = RedisBackend.from_url(
+                app.config['FLASKY_CACHE_REDIS_URL'],
+                app.config.get('FLASKY_CACHE_KEY_PREFIX', 'flasky:'))
+        else:
+            self.backend = LRUBackend(
+                app.config.get('FLASKY_CACHE_MAX_ENTRIES', 10000))
+        self.default_timeout = app.config.get('FLASKY_CACHE_DEFAULT_TIMEOUT', 300)
+        comments_changed.connect(self._on_comments_changed, app)
+
+    def _tag_versions(self, tags):
+        keys = ['tag:' + tag for tag in tags]
+        versions = self.backend.get_many(keys)
+        for i, version in enumerate(versions):
+            if version is None:
+                # 其他进程可能同时创建，以后端中保存的值为准
+                self.backend.add(keys[i], _new_version())
+                versions[i] = self.backend.get(keys[i]) or _new_version()
+        return tuple(versions)
+
+    def versions(self, tags):
+        """返回标签当前的版本号，在读取数据之前调用，再传给 set()，
+        读取数据和写入缓存之间发生的失效不会被遗漏"""
+        return dict(zip(tags, self._tag_versions(tags)))
+
+    def get(self, key):
+        item = self.backend.get(key)
+        if item is None:
+            return None
+        tags, versions, value = item
+        if tags and self._tag_versions(tags) != versions:
+            return None
+        return value
+
+    def set(self, key, value, timeout=None, tags=(), versions=None):
+        tags = tuple(tags)
+        current = self._tag_versions(tags)
+        if versions:
+            current = tuple(versions.get(tag, v) for tag, v in zip(tags, current))
+        self.backend.set(key, (tags, current, value),
+                         timeout or self.default_timeout)
+
+    def add(self, key, value, timeout=None):
+        return self.backend.add(key, ((), (), value),
+                                timeout or self.default_timeout)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    # 计数器，不支持标签。create 为 False 时只修改已经存在的计数器，不存在时返回 None；
+    # timeout 为新建的计数器的过期时间，不指定时不过期
+    def incr(self, key, delta=1, create=True, timeout=None):
+        if create and timeout:
+            self.backend.add('counter:' + key, 0, timeout)
+        return self.backend.incr('counter:' + key, delta, create)
+
+    def get_counter(self, key):
+        return self.backend.get('counter:' + key)
+
+    def set_counter(self, key, value, timeout=None):
+        self.backend.set('counter:' + key, int(value),
+                         timeout or self.default_timeout)
+
+    def delete_counter(self, key):
+        self.backend.delete('counter:' + key)
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            if self.backend.incr('tag:' + tag, create=False) is None:
+                self.backend.set('tag:' + tag, _new_version())
+
+    def clear(self):
+        self.backend.clear()
+
+    # 返回 SQLAlchemy 映射事件的监听函数，tags(target) 返回模型变化后需要失效的标签，提交后再失效
+    def invalidator(self, tags):
+        def listener(mapper, connection, target):
+            session = object_session(target)
+            if session is not None:
+                self.invalidate_on_commit(session, tags(target))
+        return listener
+
+    # 批量修改绕过了映射事件时，直接登记提交后要失效的标签
+    def invalidate_on_commit(self, session, tags):
+        session.info.setdefault('cache_tags', set()).update(tags)
+
+    def on_commit(self, session):
+        tags = session.info.pop('cache_tags', None)
+        if tags:
+            self.invalidate(*sorted(tags))
+
+    def on_rollback(self, session):
+        session.info.pop('cache_tags', None)
+
+    def _on_comments_changed(self, sender, post_ids=(), **extra):
+        self.invalidate(*['post:%s' % post_id for post_id in post_ids])
+
+
+# 标签的初始版本号，62 位随机数，Redis 的 incrby 仍然可以在它上面加一
+def _new_version():
+    return int.from_bytes(os.urandom(8), 'big') >> 2
@@ -0,0 +1,124 @@
+# 分页的总数
+# Flask-SQLAlchemy 的 paginate() 每次都执行 COUNT(*)，大表上和查询本页数据一样慢。
+# CountProvider.paginate() 从缓存中读取总数，未缓存时才执行 COUNT 并保存。
+# 可以缓存的总数：
+#     posts                   全部文章
+#     posts:author:<id>       某个用户的文章
+#     comments                全部评论
+#     comments:enabled        未禁用的评论（评论管理页）
+#     comments:disabled       已禁用的评论
+#     comments:author:<id>    某个用户的评论
+# 文章、评论的插入和删除在提交后增减已缓存的总数，批量修改评论状态时删除按状态的总数。
+# 缓存的总数可能和实际略有出入，FLASKY_APPROXIMATE_PAGES 为 True 时分页控件显示“约 N 页”，
+# FLASKY_EXACT_COUNTS 为 True 时不使用缓存
+from flask_sqlalchemy import Pagination
+from sqlalchemy.orm import object_session
+from . import db
+from .signals import comments_changed
+
+
+class CountedPagination(Pagination):
+    """approximate 为 True 表示总数来自缓存"""
+    approximate = False
+
+
+class CountProvider(object):
+    def __init__(self, app=None):
+        self.cache = None
+        self.timeout = 3600
+        self.exact = False
+        self.approximate = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # 导入 app/__init__.py 中的缓存实例，它和模块 app.cache 同名，只能在创建之后导入
+        from . import cache
+        self.cache = cache
+        self.timeout = app.config.get('FLASKY_COUNT_CACHE_TIMEOUT', 3600)
+        self.exact = app.config.get('FLASKY_EXACT_COUNTS', False)
+        self.approximate = app.config.get('FLASKY_APPROXIMATE_PAGES', False)
+        comments_changed.connect(self._on_comments_changed, app)
+
+    def count(self, key, query):
+        """返回 query 的总数，key 为 None 时不缓存"""
+        if key is None or self.exact:
+            return query.order_by(None).count()
+        total = self.cache.get_counter('count:' + key)
+        if total is None:
+            total = query.order_by(None).count()
+            self.cache.set_counter('count:' + key, total, self.timeout)
+        return total
+
+    def paginate(self, query, page, per_page, key=None, total=None,
+                 load=None):
+        """分页，key 为缓存总数的键名，total 为已知的总数；超出范围的页返回空列表。
+        load(query) 返回本页的数据，默认为 query.all()，可以传入只读模型的 load()"""
+        page = max(page, 1)
+        page_query = query.limit(per_page).offset((page - 1) * per_page)
+        items = load(page_query) if load is not None else page_query.all()
+        cached = False
+        if total is None:
+            if page == 1 and len(items) < per_page:
+                # 第一页没有取满，不需要计数
+                total = len(items)
+            else:
+                cached = key is not None and not self.exact
+                total = self.count(key, query)
+        # 缓存的总数偏小时至少要包含当前页
+        total = max(total, (page - 1) * per_page + len(items))
+        pagination = CountedPagination(query, page, per_page, total, items)
+        pagination.approximate = cached and self.approximate
+        return pagination
+
+    def adjust(self, key, delta):
+        """增减已缓存的总数，没有缓存时不处理"""
+        if delta:
+            self.cache.incr('count:' + key, delta, create=False)
+
+    # SQLAlchemy 事件：在会话中累计增量，提交后更新缓存，回滚时丢弃
+    def _pending(self, target, deltas):
+        session = object_session(target)
+        if session is None:
+            return
+        pending = session.info.setdefault('count_deltas', {})
+        for key, delta in deltas:
+            pending[key] = pending.get(key, 0) + delta
+
+    def on_post_inserted(self, mapper, connection, target):
+        self._pending(target, [('posts', 1),
+                               ('posts:author:%s' % target.author_id, 1)])
+
+    def on_post_deleted(self, mapper, connection, target):
+        self._pending(target, [('posts', -1),
+                               ('posts:author:%s' % target.author_id, -1)])
+
+    @staticmethod
+    def comment_keys(comment):
+        return ['comments', 'comments:author:%s' % comment.author_id,
+                'comments:disabled' if comment.disabled else 'comments:enabled']
+
+    def on_comment_inserted(self, mapper, connection, target):
+        self._pending(target, [(key, 1) for key in self.comment_keys(target)])
+
+    def on_comment_deleted(self, mapper, connection, target):
+        self._pending(target, [(key, -1) for key in self.comment_keys(target)])
+
+    # 单条评论启用或禁用时在两个按状态的总数之间移动
+    def on_comment_updated(self, mapper, connection, target):
+        history = db.inspect(target).attrs.disabled.history
+        if history.deleted and bool(history.deleted[0]) != bool(target.disabled):
+            moved = 1 if target.disabled else -1
+            self._pending(target, [('comments:disabled', moved),
+                                   ('comments:enabled', -moved)])
+
+    def on_commit(self, session):
+        for key, delta in sorted(session.info.pop('count_deltas', {}).items()):
+            self.adjust(key, delta)
+
+    def on_rollback(self, session):
+        session.info.pop('count_deltas', None)
+
+    def _on_comments_changed(self, sender, **extra):
+        self.cache.delete_counter('count:comments:enabled')
+        self.cache.delete_counter('count:comments:disabled')
@@ -1,21 +1,25 @@
 from threading import Thread
 from flask import current_app, render_template
-from flask_mail import Message
-from . import mail
+from . import mail, metrics
 
 
 def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+    try:
+        with app.app_context():
+            mail.send(msg)
+    finally:
+        metrics.inc('flasky_mail_queue_depth', -1)
 
 
 def send_email(to, subject, template, **kwargs):
     # 收件人地址、主题、渲染邮件正文的模板和关键字参数列表
+    from flask_mail import Message
     app = current_app._get_current_object()
     msg = Message(app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
                   sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
+    metrics.inc('flasky_mail_queue_depth')   # 等待发送的邮件数
     thr = Thread(target=send_async_email, args=[app, msg])
     thr.start()
     return thr
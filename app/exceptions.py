@@ -1,2 +1,7 @@
 class ValidationError(ValueError):
     pass
+
+
+# 分组提交等待超时，对象已经从队列中取消，没有写入数据库，可以重试
+class CommitTimeout(Exception):
+    pass
@@ -0,0 +1,105 @@
+# 关注关系图的进程内缓存
+# 每个用户缓存一个有序的 int 数组（关注的人 / 关注者的 id），第一次使用时从数据库加载，
+# 按 LRU 淘汰。Follow 的插入和删除事件会直接更新已缓存的数组，事务回滚时清空缓存。
+# 缓存只在本进程内有效，其他进程的修改要等条目过期（ttl 秒）后才能看到，
+# 因此写操作（User.follow）在缓存返回“未关注”时仍会再查一次数据库。
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from threading import Lock
+import time
+from . import db
+
+
+class FollowGraphCache(object):
+    def __init__(self, max_users=10000, ttl=60):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = Lock()
+        self._followed = OrderedDict()     # user_id -> (加载时间, 关注的人的 id 数组)
+        self._followers = OrderedDict()    # user_id -> (加载时间, 关注者的 id 数组)
+
+    def init_app(self, app):
+        self.max_users = app.config.get('FLASKY_FOLLOW_CACHE_SIZE', 10000)
+        self.ttl = app.config.get('FLASKY_FOLLOW_CACHE_TTL', 60)
+        self.clear()
+
+    def _get(self, table, user_id, column, key_column):
+        now = time.time()
+        with self._lock:
+            entry = table.get(user_id)
+            if entry is not None and now - entry[0] < self.ttl:
+                table.move_to_end(user_id)
+                return entry[1]
+        # 在锁外查询数据库，查询结果已按 id 排序
+        rows = db.session.query(column).filter(key_column == user_id) \
+            .order_by(column).all()
+        ids = array('l', (row[0] for row in rows))
+        with self._lock:
+            table[user_id] = (now, ids)
+            table.move_to_end(user_id)
+            while len(table) > self.max_users:
+                table.popitem(last=False)
+        return ids
+
+    def followed_ids(self, user_id):
+        from .models import Follow
+        return self._get(self._followed, user_id,
+                         Follow.followed_id, Follow.follower_id)
+
+    def follower_ids(self, user_id):
+        from .models import Follow
+        return self._get(self._followers, user_id,
+                         Follow.follower_id, Follow.followed_id)
+
+    @staticmethod
+    def _contains(ids, value):
+        i = bisect_left(ids, value)
+        return i < len(ids) and ids[i] == value
+
+    def is_following(self, follower_id, followed_id):
+        return self._contains(self.followed_ids(follower_id), followed_id)
+
+    def followed_count(self, user_id):
+        return len(self.followed_ids(user_id))
+
+    def followers_count(self, user_id):
+        return len(self.follower_ids(user_id))
+
+    # 新增关注关系时更新已缓存的数组，未缓存的用户不做处理
+    def add(self, follower_id, followed_id):
+        with self._lock:
+            for table, key, value in ((self._followed, follower_id, followed_id),
+                                      (self._followers, followed_id, follower_id)):
+                entry = table.get(key)
+                if entry is not None and not self._contains(entry[1], value):
+                    insort(entry[1], value)
+
+    def remove(self, follower_id, followed_id):
+        with self._lock:
+            for table, key, value in ((self._followed, follower_id, followed_id),
+                                      (self._followers, followed_id, follower_id)):
+                entry = table.get(key)
+                if entry is not None and self._contains(entry[1], value):
+                    entry[1].pop(bisect_left(entry[1], value))
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._followed.pop(user_id, None)
+                self._followers.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._followed.clear()
+            self._followers.clear()
+
+    # SQLAlchemy 事件监听函数
+    def on_follow_inserted(self, mapper, connection, target):
+        self.add(target.follower_id, target.followed_id)
+
+    def on_follow_deleted(self, mapper, connection, target):
+        self.remove(target.follower_id, target.followed_id)
+
+    def on_rollback(self, session):
+        self.clear()
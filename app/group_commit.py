@@ -0,0 +1,123 @@
+# 新评论和 API 新文章的分组提交
+# SQLite 每次提交都要 fsync 并持有全局写锁，写入集中时吞吐量受限于每秒能提交的次数。
+# 打开 FLASKY_GROUP_COMMIT 后，这些对象不在请求的会话中提交，而是放入队列，
+# 由后台的写线程每隔 FLASKY_GROUP_COMMIT_INTERVAL 秒（或攒够 FLASKY_GROUP_COMMIT_MAX_BATCH 个）
+# 在一个事务中插入并提交。请求等到所在的一组提交之后才返回，返回时数据已经写入数据库。
+# 一组中有一行插入失败时整组回滚再逐行重试，只有出错的那一行的请求收到异常。
+# 等待超过 FLASKY_GROUP_COMMIT_TIMEOUT 秒时，还在队列中的对象被取消，请求收到 CommitTimeout，
+# 重试不会产生重复的行；写线程已经开始写入的对象再多等一个超时时间，仍未提交时同样抛出
+# CommitTimeout，这时对象可能稍后仍被写入。
+# 对象在请求线程中创建（Markdown 在请求线程中渲染），只能通过 id 引用其他对象，不能关联请求会话中的对象
+import time
+from concurrent.futures import Future, TimeoutError
+from queue import Queue, Empty
+from threading import Thread, Lock
+from . import db
+from .exceptions import CommitTimeout
+
+
+class GroupCommitter(object):
+    def __init__(self, app=None):
+        self.enabled = False
+        self.interval = 0.005
+        self.max_batch = 100
+        self.timeout = 5
+        self.metrics = None
+        self._queue = Queue()
+        self._thread = None
+        self._lock = Lock()
+        self._app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from . import metrics
+        self.metrics = metrics
+        self.enabled = app.config.get('FLASKY_GROUP_COMMIT', False)
+        self.interval = app.config.get('FLASKY_GROUP_COMMIT_INTERVAL', 0.005)
+        self.max_batch = app.config.get('FLASKY_GROUP_COMMIT_MAX_BATCH', 100)
+        self.timeout = app.config.get('FLASKY_GROUP_COMMIT_TIMEOUT', 5)
+        self._app = app
+        metrics.describe('flasky_group_commits_total', 'counter',
+                         'Transactions committed by the group commit writer.')
+        metrics.describe('flasky_group_commit_rows_total', 'counter',
+                         'Rows inserted by the group commit writer.')
+
+    def submit(self, obj):
+        """把新对象放入队列，返回 Future，提交之后的结果是对象的 id"""
+        future = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run,
+                                      args=(self._app,), name='group-commit')
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put((obj, future))
+        return future
+
+    def add(self, obj):
+        """放入队列并等待提交，返回对象的 id，插入失败时抛出相应的异常，
+        超时时抛出 CommitTimeout"""
+        future = self.submit(obj)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise CommitTimeout('Timed out waiting for the group commit')
+        # 已经在写入的一组中，再等待一个超时时间让这一组提交
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise CommitTimeout('Timed out waiting for the group commit')
+
+    def _run(self, app):
+        with app.app_context():
+            while True:
+                batch = [self._queue.get()]
+                deadline = time.time() + self.interval
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except Empty:
+                        break
+                # 跳过等待超时、已经取消的对象
+                batch = [(obj, future) for obj, future in batch
+                         if future.set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    # 意外的错误不能让写线程退出、请求一直等待
+                    app.logger.exception('Group commit failed')
+                    for obj, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def _commit(self, batch):
+        assigned = [obj for obj, future in batch if obj.id is None]
+        try:
+            db.session.add_all([obj for obj, future in batch])
+            db.session.flush()
+            ids = [obj.id for obj, future in batch]
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                # 回滚后对象恢复为临时状态，清除 flush 时分配的 id 后逐个重试
+                for obj in assigned:
+                    obj.id = None
+                for item in batch:
+                    self._commit([item])
+            return
+        finally:
+            db.session.remove()
+        self.metrics.inc('flasky_group_commits_total')
+        self.metrics.inc('flasky_group_commit_rows_total', len(batch))
+        for (obj, future), id in zip(batch, ids):
+            future.set_result(id)
@@ -0,0 +1,164 @@
+# 热门文章
+# 文章的热度是文章本身、评论和浏览的权重按时间指数衰减之后的总和：
+#     Σ weight * exp(-(now - t) / tau)
+# 所有文章的衰减因子 exp(-now / tau) 相同，排序时可以去掉，因此保存的是对数形式
+#     hot_score = ln Σ weight * exp((t - EPOCH) / tau)
+# 新的评论或浏览只需要 hot_score = logaddexp(hot_score, ln(weight) + (t - EPOCH) / tau)，
+# 分数不需要随时间更新，hot_score 上的索引可以直接读出前 K 篇文章。
+# 浏览先在进程内累计，由后台线程定时合并写入 hot_score，同时累加到单独的 view_score；
+# rebalance 按文章、评论和 view_score 重新计算最近文章的分数，
+# 修正并发更新丢失的增量以及批量导入、删除评论等绕过模型事件的修改
+import math
+import time
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+from . import db
+
+EPOCH = datetime(2017, 1, 1)
+
+
+def logaddexp(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+class HotScores(object):
+    def __init__(self, app=None):
+        self.tau = 12 * 3600 / math.log(2)
+        self.post_weight = 1.0
+        self.comment_weight = 1.0
+        self.view_weight = 0.1
+        self.flush_interval = 30
+        self.metrics = None
+        self._views = {}
+        self._lock = Lock()
+        self._thread = None
+        self._app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # 半衰期换算成时间常数
+        self.tau = app.config.get('FLASKY_HOT_HALF_LIFE', 12 * 3600) / math.log(2)
+        self.post_weight = app.config.get('FLASKY_HOT_POST_WEIGHT', 1.0)
+        self.comment_weight = app.config.get('FLASKY_HOT_COMMENT_WEIGHT', 1.0)
+        self.view_weight = app.config.get('FLASKY_HOT_VIEW_WEIGHT', 0.1)
+        self.flush_interval = app.config.get('FLASKY_HOT_VIEW_FLUSH_INTERVAL', 30)
+        self._app = app
+        from . import metrics
+        self.metrics = metrics
+        metrics.describe('flasky_hot_score_dropped_total', 'counter',
+                         'Hot score increments dropped after repeated '
+                         'conflicting updates.')
+
+    def term(self, weight, timestamp=None):
+        timestamp = timestamp or datetime.utcnow()
+        if not isinstance(timestamp, datetime):     # generate_fake 生成的是 date
+            timestamp = datetime(timestamp.year, timestamp.month, timestamp.day)
+        return math.log(weight) + \
+            (timestamp - EPOCH).total_seconds() / self.tau
+
+    def add(self, connection, post_id, term, view=False):
+        """把一项增量合并到文章的分数，用比较并交换避免覆盖并发的更新。
+        view 为真时同时累加到 view_score。连续三次冲突时放弃这项增量，由 rebalance 修正"""
+        from .models import Post
+        posts = Post.__table__
+        columns = [posts.c.hot_score] + ([posts.c.view_score] if view else [])
+        for i in range(3):
+            current = connection.execute(
+                db.select(columns).where(posts.c.id == post_id)).first()
+            if current is None:     # 文章已删除或归档
+                return False
+            update = posts.update().where(posts.c.id == post_id)
+            for column, value in zip(columns, current):
+                update = update.where(column.is_(None) if value is None
+                                      else column == value)
+            result = connection.execute(update.values(dict(
+                (column.name, logaddexp(value, term))
+                for column, value in zip(columns, current))))
+            if result.rowcount:
+                return True
+        self.metrics.inc('flasky_hot_score_dropped_total')
+        return False
+
+    # SQLAlchemy 事件：新文章的初始分数，新评论增加文章的分数
+    def on_post_before_insert(self, mapper, connection, target):
+        if target.hot_score is None:
+            target.hot_score = self.term(self.post_weight, target.timestamp)
+
+    def on_comment_inserted(self, mapper, connection, target):
+        if target.post_id is not None:
+            self.add(connection, target.post_id,
+                     self.term(self.comment_weight, target.timestamp))
+
+    def record_view(self, post_id):
+        """只在进程内累计，不访问数据库；第一次调用时启动定时写入的后台线程"""
+        with self._lock:
+            self._views[post_id] = self._views.get(post_id, 0) + 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, args=(self._app,),
+                                      name='hot-views')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self, app):
+        # 进程退出时最多丢失最近 flush_interval 秒内的浏览
+        with app.app_context():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception('Flushing post views failed')
+
+    def flush(self):
+        """把本进程累计的浏览次数在单独的事务中写入数据库，返回更新的文章数"""
+        with self._lock:
+            views, self._views = self._views, {}
+        if not views:
+            return 0
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            for post_id, count in sorted(views.items()):
+                self.add(connection, post_id,
+                         self.term(self.view_weight * count, now), view=True)
+        return len(views)
+
+    def rebalance(self, days=7, chunk_size=500):
+        """按文章、评论和累计的浏览重新计算最近 days 天内发表或有评论的文章的分数，
+        返回更新的文章数"""
+        from .models import Post, Comment
+        posts = Post.__table__
+        comments = Comment.__table__
+        since = datetime.utcnow() - timedelta(days=days)
+        active = db.union(
+            db.select([posts.c.id]).where(posts.c.timestamp >= since),
+            db.select([comments.c.post_id]).where(comments.c.timestamp >= since))
+        post_ids = sorted(row[0] for row in db.session.execute(active)
+                          if row[0] is not None)
+        for start in range(0, len(post_ids), chunk_size):
+            chunk = post_ids[start:start + chunk_size]
+            scores = dict(
+                (post_id, logaddexp(self.term(self.post_weight, timestamp),
+                                    view_score))
+                for post_id, timestamp, view_score in db.session.execute(
+                    db.select([posts.c.id, posts.c.timestamp,
+                               posts.c.view_score])
+                    .where(posts.c.id.in_(chunk))))
+            for post_id, timestamp in db.session.execute(
+                    db.select([comments.c.post_id, comments.c.timestamp])
+                    .where(comments.c.post_id.in_(chunk))):
+                scores[post_id] = logaddexp(
+                    scores.get(post_id),
+                    self.term(self.comment_weight, timestamp))
+            db.session.execute(
+                posts.update().where(posts.c.id == db.bindparam('_id'))
+                .values(hot_score=db.bindparam('_score')),
+                [{'_id': post_id, '_score': score}
+                 for post_id, score in scores.items()])
+            db.session.commit()
+        return len(post_ids)
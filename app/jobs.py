@@ -0,0 +1,54 @@
+# 由调度器执行的维护任务
+# interval 为默认周期，单位为秒，可以用 FLASKY_SCHEDULER_INTERVALS 修改；
+# 为 None 的任务默认不周期执行，可以用 scheduler.schedule() 加入一次性任务
+from flask import current_app
+from . import db, scheduler, cache, hot, post_cache
+
+
+@scheduler.task('reconcile_counts', interval=24 * 3600)
+def reconcile_counts():
+    """重新计算文章的评论数，丢弃缓存的全站总数，下次使用时重新计数"""
+    from .models import Post, Comment
+    # 旧数据库中 disabled 为空的评论不会出现在按状态过滤的结果中，先补上状态
+    Comment.fill_disabled()
+    Post.reconcile_comment_counts()
+    for key in ('posts', 'comments', 'comments:enabled', 'comments:disabled'):
+        cache.delete_counter('count:' + key)
+
+
+@scheduler.task('refresh_recommendations', interval=600)
+def refresh_recommendations():
+    from .recommend import refresh_recommendations
+    refresh_recommendations(
+        top_k=current_app.config['FLASKY_RECOMMENDATIONS_TOP_K'])
+
+
+@scheduler.task('build_recommendations')
+def build_recommendations(processes=1):
+    from .recommend import build_recommendations
+    build_recommendations(
+        top_k=current_app.config['FLASKY_RECOMMENDATIONS_TOP_K'],
+        processes=processes)
+
+
+@scheduler.task('rebalance_hot', interval=3600)
+def rebalance_hot():
+    # 浏览由各个 Web 进程自己写入，这里只重新计算
+    hot.rebalance(current_app.config['FLASKY_HOT_REBALANCE_DAYS'])
+
+
+# 归档会移动数据，默认不周期执行
+@scheduler.task('archive')
+def archive(days=None):
+    from .archive import archive_older_than
+    archive_older_than(days or current_app.config['FLASKY_ARCHIVE_AFTER_DAYS'])
+
+
+@scheduler.task('warm_post_cache', interval=300)
+def warm_post_cache(limit=None):
+    """把最热的文章快照载入缓存，缓存后端为 sqlite 或 redis 时所有进程共享"""
+    from .models import Post
+    limit = limit or current_app.config['FLASKY_POSTS_PER_PAGE']
+    for id, in db.session.query(Post.id).order_by(
+            Post.hot_score.desc(), Post.id.desc()).limit(limit):
+        post_cache.get(id)
@@ -0,0 +1,63 @@
+# 延迟加载的扩展
+# 导入 flask_mail、flask_moment、flask_pagedown 需要一定时间，而 manage.py shell、db upgrade 等
+# 命令和很多请求根本用不到它们。LazyExtension 在 init_app 时只注册上下文处理器，
+# 第一次使用时才导入扩展模块，并把扩展的状态保存到 app.extensions 中。
+# 表单模块在启动时就要导入，PageDownField 的编辑器部件同样在第一次渲染时才导入 flask_pagedown
+from threading import Lock
+from flask import current_app
+from wtforms.fields import TextAreaField
+
+
+class LazyExtension(object):
+    def __init__(self, name, loader, template_global=False):
+        self.name = name    # app.extensions 中的键名，也是模板中的变量名
+        self.loader = loader    # loader(app) 导入扩展并返回扩展的状态
+        self.template_global = template_global
+        self._lock = Lock()
+
+    def init_app(self, app):
+        if self.template_global:
+            app.context_processor(self.context_processor)
+
+    def context_processor(self):
+        return {self.name: self.get()}
+
+    def get(self, app=None):
+        app = app or current_app._get_current_object()
+        state = app.extensions.get(self.name)
+        if state is None:
+            with self._lock:
+                state = app.extensions.get(self.name)
+                if state is None:
+                    state = app.extensions[self.name] = self.loader(app)
+        return state
+
+    # 其他属性转发给扩展的状态，例如 mail.send()
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def load_mail(app):
+    from flask_mail import Mail
+    return Mail().init_mail(app.config, app.debug, app.testing)
+
+
+def load_moment(app):
+    from flask_moment import _moment
+    return _moment
+
+
+def load_pagedown(app):
+    from flask_pagedown import _pagedown
+    return _pagedown()
+
+
+class LazyPageDownWidget(object):
+    def __call__(self, field, **kwargs):
+        from flask_pagedown.widgets import PageDown
+        return PageDown()(field, **kwargs)
+
+
+# 和 flask_pagedown.fields.PageDownField 相同
+class PageDownField(TextAreaField):
+    widget = LazyPageDownWidget()
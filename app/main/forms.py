@@ -2,7 +2,7 @@ from flask_wtf import Form
 from wtforms import StringField, TextAreaField, SubmitField, BooleanField, SelectField, ValidationError
 from wtforms.validators import DataRequired, Length, Email, Regexp
 from ..models import Role, User
-from flask_pagedown.fields import PageDownField
+from ..lazy import PageDownField
 
 
 class NameForm(Form):
@@ -57,4 +57,11 @@ class PostForm(Form):
 
 class CommentForm(Form):
     body = StringField('Enter your comment', validators=[DataRequired()])
-    submit = SubmitField('Submit')
\ No newline at end of file
+    submit = SubmitField('Submit')
+
+
+# 批量管理评论，选中的评论 id 由复选框 ids 提交
+class BulkModerateForm(Form):
+    all_by_author = BooleanField('Apply to every comment by the filtered author')
+    enable = SubmitField('Enable')
+    disable = SubmitField('Disable')
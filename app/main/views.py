@@ -2,19 +2,25 @@ from flask import render_template, abort, flash, redirect, url_for, request, cur
 from . import main
 from ..models import User, Role, Permission, Post, Comment
 from flask_login import login_required, current_user
-from .forms import EditProfileForm, EditProfileAdminForm, PostForm, CommentForm
+from .forms import EditProfileForm, EditProfileAdminForm, PostForm, CommentForm, \
+    BulkModerateForm
 from ..models import db
+from .. import slow_queries, broker, hot, counts, post_cache, group_commit, \
+    page_cache
 from ..decorators import admin_required, permission_required
+from ..read_models import PostSummary, CommentSummary, FollowSummary
+from ..exceptions import CommitTimeout
 
 # 蓝图为该蓝图下的全部端点添加了一个命名空间，不同蓝图可以有相同的端点
 
 
 # 文章分页显示，显示所有文章或者只显示所关注用户的文章
 @main.route('/', methods=['GET', 'POST'])
+@page_cache.cached(lambda: ['posts'])
 def index():
-    form = PostForm()
-    if current_user.can(Permission.WRITE_ARTICLES) and \
-            form.validate_on_submit():
+    # 表单在创建时就会生成 CSRF 令牌并写入会话，只为能发表文章的用户创建，匿名访客不会得到会话 cookie
+    form = PostForm() if current_user.can(Permission.WRITE_ARTICLES) else None
+    if form is not None and form.validate_on_submit():
         # _get_current_object()获取数据库中真正的用户对象
         post = Post(body=form.body.data, author=current_user._get_current_object())
         db.session.add(post)
@@ -24,35 +30,72 @@ def index():
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
+    # 全部文章的总数来自缓存，关注的用户的文章每次计数
     if show_followed:
         query = current_user.followed_posts
+        count_key = None
     else:
         query = Post.query
+        count_key = 'posts'
     # Flask - SQLAlchemy 提供的 paginate()方法。页数是 paginate()方法的第一个参数，也是唯一必需的参数。
     # 可选参数 per_page 用来指定每页显示的记录数量； 如果没有指定，则默认显示20个记录
     # 可选参数 error_out，当其设为 True 时（默认值），如果请求的页数超出了范围，则会返回 404 错误；、
     # 如果设为 False，页数超出范围时会返回一个空列表
     # 文章按时间顺序排列
     # pagination对象用于产生分页链接，将其传给模板参数
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    # 列表只读取模板用到的字段，见 app/read_models.py
+    pagination = counts.paginate(
+        query.order_by(Post.timestamp.desc()), page,
+        current_app.config['FLASKY_POSTS_PER_PAGE'], count_key,
+        load=PostSummary.load)
     posts = pagination.items   # 当前页面中的记录
+    page_cache.tag_posts(posts)
     return render_template('index.html', form=form, posts=posts,
                            show_followed=show_followed, pagination=pagination)
 
 
+# 热门文章，按热度分数倒序
+@main.route('/hot')
+@page_cache.cached(lambda: ['posts'])
+def hot_posts():
+    page = request.args.get('page', 1, type=int)
+    pagination = counts.paginate(
+        Post.query.order_by(Post.hot_score.desc(), Post.id.desc()), page,
+        current_app.config['FLASKY_POSTS_PER_PAGE'], 'posts',
+        load=PostSummary.load)
+    page_cache.tag_posts(pagination.items)
+    return render_template('index.html', form=None, posts=pagination.items,
+                           show_hot=True, pagination=pagination,
+                           endpoint='.hot_posts')
+
+
+# 新文章的实时通知（Server-Sent Events）
+@main.route('/stream')
+def stream():
+    return broker.stream(['posts'])
+
+
 # 用户资料页
 @main.route('/user/<username>')
+@page_cache.cached()
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
+    page_cache.tag('user:%d' % user.id)
     page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    pagination = counts.paginate(
+        user.posts.order_by(Post.timestamp.desc()), page,
+        current_app.config['FLASKY_POSTS_PER_PAGE'],
+        'posts:author:%d' % user.id, load=PostSummary.load)
     posts = pagination.items
+    page_cache.tag_posts(posts)
+    # 用户查看自己的资料页时显示推荐关注
+    recommendations = []
+    if current_user == user:
+        recommendations = user.recommended_users(
+            current_app.config['FLASKY_RECOMMENDATIONS_SHOWN'])
     return render_template('user.html', user=user, posts=posts,
-                           pagination=pagination)
+                           pagination=pagination,
+                           recommendations=recommendations)
 
 
 # 编辑个人资料
@@ -105,35 +148,59 @@ def edit_profile_admin(id):
 
 # 文章的固定链接，支持博客文章评论
 @main.route('/post/<int:id>', methods=['GET', 'POST'])
+@page_cache.cached(lambda id: ['post:%d' % id],
+                   on_hit=lambda id: hot.record_view(id))
 def post(id):
     # 博客文章的URL使用插入数据库时分配的唯一id字段构建
-    post = Post.query.get_or_404(id)
-    form = CommentForm()
-    if form.validate_on_submit() and post is not None:
+    # 文章快照来自缓存，归档的文章只能查看，不能评论
+    post = post_cache.get_or_404(id)
+    form = CommentForm() if not post.archived and \
+        current_user.can(Permission.COMMENT) else None
+    if form is not None and form.validate_on_submit():
         # print(form.body.data)
         comment = Comment(body=form.body.data,
-                          post=post,
-                          author=current_user._get_current_object())
-        db.session.add(comment)
-        flash('Your comment has been published.')
-        return redirect(url_for('.post', id=post.id, page=-1))    # -1用来请求评论的最后一页，
+                          post_id=post.id,
+                          author_id=current_user.id)
+        # 分组提交时等到评论所在的一组提交之后再返回，超时未写入时保留表单内容，提示用户重试
+        try:
+            if group_commit.enabled:
+                group_commit.add(comment)
+            else:
+                db.session.add(comment)
+        except CommitTimeout:
+            flash('The server is busy and your comment was not saved, '
+                  'please try again.')
+        else:
+            flash('Your comment has been published.')
+            return redirect(url_for('.post', id=post.id, page=-1))    # -1用来请求评论的最后一页，
+    if post.archived:
+        page_cache.skip_on_hit()
+    else:
+        hot.record_view(post.id)
     page = request.args.get('page', 1, type=int)
-    if page == -1:
-        page = (post.comments.count() - 1) // \
-               current_app.config['FLASKY_COMMENTS_PER_PAGE'] + 1
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    # 评论总数来自文章的 comment_count，page=-1 直接定位到最后一页
+    pagination = post.paginate_comments(
+        page, current_app.config['FLASKY_COMMENTS_PER_PAGE'],
+        load=CommentSummary.load, after=request.args.get('after'),
+        before=request.args.get('before'))
     comments = pagination.items
+    page_cache.tag('user:%s' % post.author_id,
+                   *['user:%s' % comment.author_id for comment in comments])
     return render_template('post.html', posts=[post], form=form,
                            comments=comments, pagination=pagination)
 
 
+# 文章新评论的实时通知
+@main.route('/post/<int:id>/stream')
+def post_stream(id):
+    return broker.stream(['post:%d' % id])
+
+
 # 编辑文章
 @main.route('/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit(id):
-    post = Post.query.get_or_404(id)
+    post = Post.get_or_archived_404(id)
     if current_user != post.author and \
             not current_user.can(Permission.ADMINISTER):
         abort(403)
@@ -188,11 +255,11 @@ def followers(username):
         flash('Invalid user.')
         return redirect(url_for('.index'))
     page = request.args.get('page', 1, type=int)
-    pagination = user.followers.paginate(
-        page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False)
-    follows = [{'user': item.follower, 'timestamp': item.timestamp}
-               for item in pagination.items]
+    # 总数取自关注关系缓存
+    pagination = counts.paginate(
+        user.followers, page, current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
+        total=user.followers_count(), load=FollowSummary.followers)
+    follows = pagination.items
     return render_template('followers.html', user=user, title="Followers of",
                            endpoint='.followers', pagination=pagination,
                            follows=follows)
@@ -205,11 +272,11 @@ def followed_by(username):
         flash('Invalid user.')
         return redirect(url_for('.index'))
     page = request.args.get('page', 1, type=int)
-    pagination = user.followed.paginate(
-        page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False)
-    follows = [{'user': item.followed, 'timestamp': item.timestamp}
-               for item in pagination.items]
+    # 总数取自关注关系缓存
+    pagination = counts.paginate(
+        user.followed, page, current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
+        total=user.followed_count(), load=FollowSummary.followed)
+    follows = pagination.items
     return render_template('followers.html', user=user, title="Followed by",
                            endpoint='.followed_by', pagination=pagination,
                            follows=follows)
@@ -233,19 +300,79 @@ def show_followed():
     return resp
 
 
+# 评论管理页的过滤条件：状态、作者用户名和文章 id
+def moderation_filters():
+    filters = {}
+    status = request.args.get('status')
+    if status in ('enabled', 'disabled'):
+        filters['status'] = status
+    if request.args.get('author'):
+        filters['author'] = request.args.get('author')
+    post_id = request.args.get('post', type=int)
+    if post_id is not None:
+        filters['post'] = post_id
+    return filters
+
+
+# 只按一个条件过滤时总数可以缓存，同时按多个条件过滤时每次计数
+def moderation_count_key(filters, author):
+    if 'post' in filters or (author and 'status' in filters):
+        return None
+    if author:
+        return 'comments:author:%d' % author.id
+    if 'status' in filters:
+        return 'comments:%s' % filters['status']
+    return 'comments'
+
+
 # 管理评论
 @main.route('/moderate')
 @login_required
 @permission_required(Permission.MODERATE_COMMENTS)
 def moderate():
     page = request.args.get('page',1,type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page,per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False
-    )
+    filters = moderation_filters()
+    author = None
+    if 'author' in filters:
+        author = User.query.filter_by(username=filters['author']).first()
+        if author is None:
+            flash('Invalid user.')
+            return redirect(url_for('.moderate'))
+    query = Comment.moderation_query(filters.get('status'),
+                                     author.id if author else None,
+                                     filters.get('post'))
+    pagination = counts.paginate(
+        query, page, current_app.config['FLASKY_COMMENTS_PER_PAGE'],
+        moderation_count_key(filters, author), load=CommentSummary.load)
     comments = pagination.items
     return render_template('moderate.html', comments=comments,
-                           pagination=pagination, page=page)
+                           pagination=pagination, page=page,
+                           filters=filters, form=BulkModerateForm())
+
+
+# 批量启用或禁用选中的评论，或者过滤出的作者的全部评论
+@main.route('/moderate/bulk', methods=['POST'])
+@login_required
+@permission_required(Permission.MODERATE_COMMENTS)
+def moderate_bulk():
+    form = BulkModerateForm()
+    filters = moderation_filters()
+    if form.validate_on_submit():
+        disabled = bool(form.disable.data)
+        author_id = None
+        if form.all_by_author.data and 'author' in filters:
+            author = User.query.filter_by(
+                username=filters['author']).first_or_404()
+            author_id = author.id
+            ids = None
+        else:
+            ids = [int(i) for i in request.form.getlist('ids') if i.isdigit()]
+        count = Comment.set_disabled(disabled, ids=ids, author_id=author_id)
+        flash('%d comments have been %s.' %
+              (count, 'disabled' if disabled else 'enabled'))
+    return redirect(url_for('.moderate',
+                            page=request.args.get('page', 1, type=int),
+                            **filters))
 
 
 @main.route('/moderate/enable/<int:id>')
@@ -268,3 +395,14 @@ def moderate_disable(id):
     db.session.add(comment)
     return redirect(url_for('.moderate',
                             page=request.args.get('page', 1, type=int)))
+
+
+# 慢查询和慢请求日志
+@main.route('/slow-queries')
+@login_required
+@admin_required
+def slow_queries_report():
+    return render_template('slow_queries.html',
+                           queries=slow_queries.top_offenders(kind='query'),
+                           requests=slow_queries.top_offenders(kind='request'),
+                           entries=slow_queries.entries()[-50:][::-1])
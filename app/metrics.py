@@ -0,0 +1,220 @@
+# 请求性能统计
+# 每个请求统计 SQL 语句的条数和耗时、模板渲染耗时、Markdown 渲染耗时，
+# 通过 Server-Timing 响应头返回给浏览器，同时按端点累计延迟直方图，
+# /metrics 以 Prometheus 的文本格式输出所有指标。
+# 指标中有每个端点的延迟和流量，默认不提供 /metrics；启用后只允许带 FLASKY_METRICS_TOKEN 的请求
+# （Authorization: Bearer <token>），没有设置令牌时只允许 FLASKY_METRICS_ALLOWED_IPS 中的地址直接访问，
+# 经过反向代理的请求（带 X-Forwarded-For）来自本机也会被拒绝
+from contextlib import contextmanager
+import hmac
+from threading import Lock
+import time
+from flask import g, request, has_request_context, Response, abort, \
+    before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 直方图的桶，单位为秒
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics(object):
+    def __init__(self, app=None):
+        self._lock = Lock()
+        self._types = {}        # 指标名 -> (类型, 说明)
+        self._values = {}       # (指标名, 标签) -> 数值
+        self._histograms = {}   # (指标名, 标签) -> [各个桶的计数, 总和, 次数]
+        self.token = None
+        self.allowed_ips = ('127.0.0.1', '::1')
+        self.describe('flasky_request_duration_seconds', 'histogram',
+                      'Request latency by endpoint.')
+        self.describe('flasky_db_queries_total', 'counter',
+                      'SQL statements executed by endpoint.')
+        self.describe('flasky_db_duration_seconds_total', 'counter',
+                      'Time spent in SQL statements by endpoint.')
+        self.describe('flasky_render_duration_seconds_total', 'counter',
+                      'Time spent rendering templates by endpoint.')
+        self.describe('flasky_markdown_duration_seconds_total', 'counter',
+                      'Time spent rendering Markdown by endpoint.')
+        self.describe('flasky_mail_queue_depth', 'gauge',
+                      'Emails queued but not yet sent.')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not event.contains(Engine, 'before_cursor_execute',
+                              _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                         _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         _after_cursor_execute)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        self.token = app.config.get('FLASKY_METRICS_TOKEN')
+        self.allowed_ips = tuple(app.config.get('FLASKY_METRICS_ALLOWED_IPS',
+                                                ('127.0.0.1', '::1')))
+        if app.config.get('FLASKY_METRICS_ENDPOINT', False):
+            app.add_url_rule('/metrics', 'metrics', self.view)
+
+    # 注册 SQL 语句的观察者，每条语句执行后以 (语句, 参数, executemany, 耗时) 调用，
+    # 和请求统计共用同一对游标事件，语句只计时一次
+    def on_query(self, observer):
+        if observer not in _query_observers:
+            _query_observers.append(observer)
+
+    def describe(self, name, type, help):
+        self._types[name] = (type, help)
+
+    # 计数器和仪表盘，amount 可以为负数
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    # 统计一段代码的耗时，请求中的耗时累加到该请求的 Server-Timing 中
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if has_request_context():
+                timings = g.setdefault('_timings', {})
+                timings[name] = timings.get(name, 0.0) + \
+                    time.perf_counter() - start
+
+    def _before_request(self):
+        g._request_start = time.perf_counter()
+        g._db_count = 0
+        g._timings = {}
+
+    def _before_render(self, sender, template, context, **extra):
+        g.setdefault('_render_starts', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        starts = g.get('_render_starts')
+        if starts:
+            timings = g.setdefault('_timings', {})
+            timings['render'] = timings.get('render', 0.0) + \
+                time.perf_counter() - starts.pop()
+
+    def _after_request(self, response):
+        start = g.get('_request_start')
+        if start is None:
+            return response
+        duration = time.perf_counter() - start
+        endpoint = request.endpoint or 'unknown'
+        timings = g.get('_timings', {})
+        db_count = g.get('_db_count', 0)
+        self.observe('flasky_request_duration_seconds', duration,
+                     endpoint=endpoint)
+        self.inc('flasky_db_queries_total', db_count, endpoint=endpoint)
+        for name in ('db', 'render', 'markdown'):
+            if name in timings:
+                self.inc('flasky_%s_duration_seconds_total' % name,
+                         timings[name], endpoint=endpoint)
+        entries = ['db;count=%d;dur=%.2f' % (db_count,
+                                            timings.get('db', 0.0) * 1000)]
+        for name in ('render', 'markdown'):
+            if name in timings:
+                entries.append('%s;dur=%.2f' % (name, timings[name] * 1000))
+        entries.append('total;dur=%.2f' % (duration * 1000))
+        response.headers['Server-Timing'] = ', '.join(entries)
+        return response
+
+    # Prometheus 文本格式
+    def render(self):
+        lines = []
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2]))
+                                for key, h in self._histograms.items())
+        described = set()
+
+        def header(name):
+            if name not in described and name in self._types:
+                described.add(name)
+                type, help = self._types[name]
+                lines.append('# HELP %s %s' % (name, help))
+                lines.append('# TYPE %s %s' % (name, type))
+
+        for (name, labels), value in values:
+            header(name)
+            lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+        for (name, labels), (buckets, total, count) in histograms:
+            header(name)
+            for bound, bucket_count in zip(BUCKETS, buckets):
+                lines.append('%s_bucket%s %d' % (
+                    name, _labels(labels + (('le', _number(bound)),)),
+                    bucket_count))
+            lines.append('%s_bucket%s %d' % (
+                name, _labels(labels + (('le', '+Inf'),)), count))
+            lines.append('%s_sum%s %s' % (name, _labels(labels), _number(total)))
+            lines.append('%s_count%s %d' % (name, _labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def allowed(self):
+        if self.token:
+            auth = request.headers.get('Authorization', '')
+            return hmac.compare_digest(auth.encode('utf-8'),
+                                       ('Bearer ' + self.token).encode('utf-8'))
+        return request.remote_addr in self.allowed_ips and \
+            'X-Forwarded-For' not in request.headers
+
+    def view(self):
+        if not self.allowed():
+            abort(403)
+        return Response(self.render(),
+                        mimetype='text/plain; version=0.0.4')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"'))
+                             for k, v in labels)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_query_observers = []
+
+
+# SQLAlchemy 的游标事件，对所有引擎生效，请求中执行的语句计入 Server-Timing
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    starts = conn.info.get('_query_start')
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    if has_request_context():
+        g._db_count = g.get('_db_count', 0) + 1
+        timings = g.setdefault('_timings', {})
+        timings['db'] = timings.get('db', 0.0) + duration
+    for observer in _query_observers:
+        observer(statement, parameters, executemany, duration)
@@ -1,14 +1,15 @@
 from . import db
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
-from . import login_manager
+from . import login_manager, follow_graph, metrics, broker, cache, hot, \
+    counts
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask import current_app, request, url_for
-from datetime import datetime
+from flask_sqlalchemy import Pagination
+from datetime import datetime, timedelta
 import hashlib
-import bleach
-from markdown import markdown
 from .exceptions import ValidationError
+from .signals import comments_changed
 
 
 class Permission:
@@ -48,29 +49,95 @@ class Role(db.Model):
             # 管理员
             'Administrator': (0xff, False)
         }
+        # 一次查询取出已存在的角色，已存在的更新，不存在的插入，可重复执行
+        existing = {role.name: role
+                    for role in Role.query.filter(Role.name.in_(roles))}
         for r in roles:
-            role = Role.query.filter_by(name=r).first()
+            role = existing.get(r)
             if role is None:
                 role = Role(name=r)
+                db.session.add(role)
             role.permissions = roles[r][0]
             role.default = roles[r][1]
-            db.session.add(role)
         db.session.commit()
 
-
     def __repr__(self):
         return '<Role %r>' % self.name
 
 
+# 评论分页，total 为评论总数。page 为 -1 表示最后一页，其他小于 1 的值按第一页处理。
+# 上一页和下一页的链接带有锚点（after / before，相邻页面边界上评论的时间和 id），
+# 按 (timestamp, id) 从锚点开始读取一页，不需要 OFFSET。
+# 直接跳到某一页时没有锚点：后半部分的页面按时间倒序查询再反转，最后一页只需要 LIMIT，
+# 其余页面的 OFFSET 最多为总数的一半。
+# 返回的 Pagination 带有 prev_anchor 和 next_anchor，供分页链接使用。
+# load(query) 返回本页的评论，默认为 query.all()
+def paginate_comments(query, model, total, page, per_page, load=None,
+                      after=None, before=None):
+    load = load or (lambda query: query.all())
+    total = total or 0
+    pages = max(1, (total + per_page - 1) // per_page)
+    if page == -1:
+        page = pages
+    elif page < 1:
+        page = 1
+    anchor = _parse_anchor(after or before)
+    asc = (model.timestamp.asc(), model.id.asc())
+    desc = (model.timestamp.desc(), model.id.desc())
+    if anchor is not None:
+        key = db.tuple_(model.timestamp, model.id)
+        if after:
+            items = load(query.filter(key > anchor).order_by(*asc)
+                         .limit(per_page))
+        else:
+            items = load(query.filter(key < anchor).order_by(*desc)
+                         .limit(per_page))[::-1]
+    else:
+        start = (page - 1) * per_page
+        count = max(0, min(per_page, total - start))
+        from_end = total - start - count
+        if from_end < start:
+            items = query.order_by(*desc)
+            if from_end:
+                items = items.offset(from_end)
+            items = load(items.limit(count))[::-1] if count else []
+        else:
+            items = load(query.order_by(*asc).offset(start).limit(per_page))
+    pagination = Pagination(None, page, per_page, total, items)
+    pagination.prev_anchor = comment_anchor(items[0]) if items else None
+    pagination.next_anchor = comment_anchor(items[-1]) if items else None
+    return pagination
+
+
+def comment_anchor(comment):
+    return '%s_%d' % (comment.timestamp.strftime('%Y%m%d%H%M%S%f'),
+                      comment.id)
+
+
+def _parse_anchor(value):
+    try:
+        timestamp, id = value.split('_')
+        return datetime.strptime(timestamp, '%Y%m%d%H%M%S%f'), int(id)
+    except (AttributeError, ValueError):
+        return None
+
+
 class Post(db.Model):
     __tablename__ = 'posts'
+    # 热门文章按分数倒序读取前 K 篇
+    __table_args__ = (db.Index('ix_posts_hot_score', 'hot_score', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True,default=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     body_html = db.Column(db.Text)  # Markdown文本的HTML缓存
+    comment_count = db.Column(db.Integer, default=0)    # 评论数缓存，由 Comment 的事件维护
+    hot_score = db.Column(db.Float)     # 热度（对数形式），见 app/hot.py
+    view_score = db.Column(db.Float)    # 热度中浏览的部分，rebalance 时合并回 hot_score
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
 
+    archived = False
+
     # 生成虚拟文章
     @staticmethod
     def generate_fake(count=100):
@@ -86,17 +153,49 @@ class Post(db.Model):
             db.session.add(p)
             db.session.commit()
 
-    # 处理Markdown文本
-    def on_changed_body(target, value, oldvalue, initiator):
+    # 处理Markdown文本，markdown 和 bleach 导入较慢，第一次使用时才导入
+    @staticmethod
+    def render_body(value):
+        import bleach
+        from markdown import markdown
         allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
                         'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
                         'h1', 'h2', 'h3', 'p']
         # linkify 把纯文本中的URL转换成适当的<a>链接，由 bleach 提供
         # markdown将Markdown 转为 HTML
         # clean 清除不允许的标签
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
+        with metrics.timer('markdown'):
+            return bleach.linkify(bleach.clean(
+                markdown(value, output_format='html'),
+                tags=allowed_tags, strip=True))
+
+    def on_changed_body(target, value, oldvalue, initiator):
+        target.body_html = Post.render_body(value)
+
+    # 评论分页，总数取自 comment_count，不执行 COUNT 查询
+    def paginate_comments(self, page, per_page, load=None, after=None,
+                          before=None):
+        return paginate_comments(self.comments, Comment, self.comment_count,
+                                 page, per_page, load, after, before)
+
+    # 先查找在线的文章，找不到时查找归档的文章
+    @staticmethod
+    def get_or_archived_404(id):
+        post = Post.query.get(id)
+        if post is None:
+            post = ArchivedPost.query.get_or_404(id)
+        return post
+
+    # 按 comments 表重新计算所有文章的评论数
+    @staticmethod
+    def reconcile_comment_counts():
+        comments = Comment.__table__
+        posts = Post.__table__
+        result = db.session.execute(posts.update().values(
+            comment_count=db.select([db.func.count(comments.c.id)])
+            .where(comments.c.post_id == posts.c.id).as_scalar()))
+        db.session.commit()
+        return result.rowcount
 
     # 把文章转换成JSON格式的序列化字典
     def to_json(self):
@@ -106,8 +205,8 @@ class Post(db.Model):
             'body_html': self.body_html,
             'timestamp': self.timestamp,
             'author': url_for('api.get_user', id=self.author_id, _external=True),
-            'comments': url_for('apt.get_post_comments', id=self.id, _external=True),
-            'comment_count': self.comments.count()
+            'comments': url_for('api.get_post_comments', id=self.id, _external=True),
+            'comment_count': self.comment_count or 0
         }
         return json_post
 
@@ -131,6 +230,50 @@ class Follow(db.Model):
                             primary_key=True)
     timestamp = db.Column(db.DateTime,default=datetime.utcnow)  # 关注日期
 
+    # 关注关系变化后，关注者本人和关注了他的用户的推荐都需要重新计算
+    @staticmethod
+    def on_changed(mapper, connection, target):
+        if target.follower_id == target.followed_id:
+            return
+        Follow.mark_stale(connection, target.follower_id)
+
+    @staticmethod
+    def mark_stale(connection, follower_id):
+        users = User.__table__
+        connection.execute(users.update().where(db.or_(
+            users.c.id == follower_id,
+            users.c.id.in_(db.select([Follow.follower_id]).where(
+                Follow.followed_id == follower_id))))
+            .values(recommendations_stale=True))
+
+# 关注关系变化时同步更新关注关系缓存，事务回滚时清空缓存
+db.event.listen(Follow, 'after_insert', follow_graph.on_follow_inserted)
+db.event.listen(Follow, 'after_delete', follow_graph.on_follow_deleted)
+db.event.listen(db.session, 'after_rollback', follow_graph.on_rollback)
+db.event.listen(Follow, 'after_insert', Follow.on_changed)
+db.event.listen(Follow, 'after_delete', Follow.on_changed)
+
+
+def gravatar_url(hash, size=100, default='identicon', rating='g'):
+    if request.is_secure:
+        url = 'https://secure.gravatar.com/avatar'
+    else:
+        url = 'http://www.gravatar.com/avatar'
+    return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
+            url=url, hash=hash, size=size, default=default, rating=rating)
+
+
+# 推荐关注的用户，由 app/recommend.py 离线计算
+class Recommendation(db.Model):
+    __tablename__ = 'recommendations'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+                        primary_key=True)
+    candidate_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+                             primary_key=True)
+    score = db.Column(db.Integer)   # 共同关注的人数
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    candidate = db.relationship('User', foreign_keys=[candidate_id])
+
 
 class User(UserMixin,db.Model):
     # FlaskLogin 提供了一个 UserMixin 类,实现了giant拓展要求的大部分函数
@@ -147,6 +290,7 @@ class User(UserMixin,db.Model):
     member_since = db.Column(db.DateTime(), default=datetime.utcnow)    # 注册时间，utcnow是一个函数
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)    # 最后访问时间
     avatar_hash = db.Column(db.String(32))      # 用户Gravatar头像hash值
+    recommendations_stale = db.Column(db.Boolean, default=True, index=True)  # 推荐关注是否需要重新计算
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     comments = db.relationship('Comment', backref='author', lazy='dynamic')
 
@@ -227,13 +371,33 @@ class User(UserMixin,db.Model):
             db.session.rollback()
 
     # 更新数据库使得用户自己关注自己
+    # 按 id 区间分块执行 INSERT ... SELECT，只插入缺失的自关注记录，可重复执行
+    # progress 为可选的回调函数，参数为已处理到的用户 id 和已插入的行数
     @staticmethod
-    def add_self_follows():
-        for user in User.query.all():
-            if not user.is_following(user):
-                user.follow(user)
-                db.session.add(user)
-                db.session.commit()
+    def add_self_follows(chunk_size=1000, progress=None):
+        follows = Follow.__table__
+        max_id = db.session.query(db.func.max(User.id)).scalar() or 0
+        inserted = 0
+        low = 0
+        while low < max_id:
+            high = low + chunk_size
+            missing = db.select([
+                User.id.label('follower_id'),
+                User.id.label('followed_id'),
+                db.literal(datetime.utcnow()).label('timestamp')]) \
+                .where(User.id > low).where(User.id <= high) \
+                .where(~db.exists().where(db.and_(
+                    follows.c.follower_id == User.id,
+                    follows.c.followed_id == User.id)))
+            result = db.session.execute(follows.insert().from_select(
+                ['follower_id', 'followed_id', 'timestamp'], missing))
+            db.session.commit()    # 每块单独提交，避免长时间持有锁
+            inserted += result.rowcount
+            low = high
+            if progress is not None:
+                progress(min(high, max_id), inserted)
+        follow_graph.clear()    # 批量插入不会触发 Follow 的事件
+        return inserted
 
     def __init__(self, **kwargs):
         # 赋予角色
@@ -341,24 +505,26 @@ class User(UserMixin,db.Model):
         return self.can(Permission.ADMINISTER)
 
     # 刷新用户最后的访问时间
+    # 每个请求都会调用，一分钟内只更新一次，大部分请求不需要写数据库
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
+        now = datetime.utcnow()
+        if self.last_seen is None or now - self.last_seen > timedelta(minutes=1):
+            self.last_seen = now
+            db.session.add(self)
 
     # 生成用户邮箱对应的gravatar头像地址hash值，size 为图片大小，rating 表示图片级别，可选值有 "g"、 "pg"、 "r" 和 "x"，
     def gravatar(self, size=100, default='identicon', rating='g'):
-        if request.is_secure:
-            url = 'https://secure.gravatar.com/avatar'
-        else:
-            url = 'http://www.gravatar.com/avatar'
-        # 如果数据库中没有 hash 则重新计算
-        hash = self.avatar_hash or hashlib.md5(self.email.encode('utf-8')).hexdigest()
-        return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
-                url=url, hash=hash, size=size, default=default, rating=rating)
+        return gravatar_url(self.gravatar_hash(), size, default, rating)
+
+    # 如果数据库中没有 hash 则重新计算
+    def gravatar_hash(self):
+        return self.avatar_hash or \
+            hashlib.md5(self.email.encode('utf-8')).hexdigest()
 
-    # 关注用户
+    # 关注用户，缓存可能来自其他进程的旧数据，插入前再查一次数据库
     def follow(self, user):
-        if not self.is_following(user):
+        if not self.is_following(user) and \
+                self.followed.filter_by(followed_id=user.id).first() is None:
             f = Follow(follower=self, followed=user)
             db.session.add(f)
 
@@ -368,15 +534,87 @@ class User(UserMixin,db.Model):
         if f:
             db.session.delete(f)
 
-    # 是否关注某个用户
+    # 批量关注和取消关注，follow 和 unfollow 是用户 id。已有的关注关系用一条查询取出，
+    # 插入和删除各一条语句，在当前会话的事务中执行，由调用方提交。
+    # 不触发 Follow 的映射事件，关注关系缓存、推荐的过期标记和缓存标签在这里一起更新。
+    # 返回 (新关注的 id, 取消关注的 id)
+    def update_follows(self, follow=(), unfollow=()):
+        follow = set(follow) - set([self.id])
+        unfollow = set(unfollow) - set([self.id]) - follow
+        if not follow and not unfollow:
+            return [], []
+        follows = Follow.__table__
+        existing = set(row[0] for row in db.session.execute(
+            db.select([follows.c.followed_id])
+            .where(follows.c.follower_id == self.id)
+            .where(follows.c.followed_id.in_(sorted(follow | unfollow)))))
+        added = sorted(follow - existing)
+        removed = sorted(unfollow & existing)
+        if not added and not removed:
+            return added, removed
+        if added:
+            now = datetime.utcnow()
+            db.session.execute(follows.insert(), [
+                {'follower_id': self.id, 'followed_id': id, 'timestamp': now}
+                for id in added])
+        if removed:
+            db.session.execute(follows.delete()
+                               .where(follows.c.follower_id == self.id)
+                               .where(follows.c.followed_id.in_(removed)))
+        for id in added:
+            follow_graph.add(self.id, id)
+        for id in removed:
+            follow_graph.remove(self.id, id)
+        Follow.mark_stale(db.session.connection(), self.id)
+        cache.invalidate_on_commit(db.session, ['user:%s' % id for id in
+                                                [self.id] + added + removed])
+        return added, removed
+
+    # 按用户名或 id 查找用户，一条查询，返回 ({用户名或 id: 用户 id}, 找不到的值)
+    @staticmethod
+    def resolve(values):
+        names = set(v for v in values if isinstance(v, str))
+        ids = set(v for v in values
+                  if isinstance(v, int) and not isinstance(v, bool))
+        users = User.__table__
+        found = {}
+        if names or ids:
+            for id, username in db.session.execute(
+                    db.select([users.c.id, users.c.username]).where(db.or_(
+                        users.c.username.in_(sorted(names)),
+                        users.c.id.in_(sorted(ids))))):
+                found[id] = id
+                found[username] = id
+        resolved = dict((v, found[v]) for v in values if v in found)
+        return resolved, [v for v in values if v not in found]
+
+    # 是否关注某个用户，已保存的用户从关注关系缓存中读取
     def is_following(self, user):
-        return self.followed.filter_by(
-            followed_id=user.id).first() is not None
+        if self.id is None or user.id is None:
+            return self.followed.filter_by(
+                followed_id=user.id).first() is not None
+        return follow_graph.is_following(self.id, user.id)
 
     # 是否被某个用户关注
     def is_followed_by(self, user):
-        return self.follower.filter_by(
-            follower_id=user.id).first() is not None
+        if self.id is None or user.id is None:
+            return self.followers.filter_by(
+                follower_id=user.id).first() is not None
+        return follow_graph.is_following(user.id, self.id)
+
+    # 关注的人数和关注者人数，包含自己
+    def followed_count(self):
+        return follow_graph.followed_count(self.id)
+
+    def followers_count(self):
+        return follow_graph.followers_count(self.id)
+
+    # 推荐关注的用户，跳过已经关注的
+    def recommended_users(self, limit=5):
+        recommendations = Recommendation.query.filter_by(user_id=self.id) \
+            .order_by(Recommendation.score.desc()).limit(limit * 2).all()
+        return [r.candidate for r in recommendations
+                if not self.is_following(r.candidate)][:limit]
 
     # 获取所关注用户的文章，先执行连结操作再过滤
     # @property表示将方法定义为属性，调用时不用加（）
@@ -420,21 +658,33 @@ class User(UserMixin,db.Model):
 
 class Comment(db.Model):
     __tablename__ = 'comments'
+    # 评论管理页按状态过滤并按时间排序
+    __table_args__ = (db.Index('ix_comments_disabled_timestamp',
+                               'disabled', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    disabled = db.Column(db.Boolean)
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    # 不允许为空，按状态过滤时是等值条件，可以使用 (disabled, timestamp) 索引
+    disabled = db.Column(db.Boolean, nullable=False, default=False,
+                         server_default=db.false())
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), index=True)
 
     @staticmethod
-    def on_changed_body(target, value, oldvalue, initiator):
+    def render_body(value):
+        import bleach
+        from markdown import markdown
         allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
                         'strong']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
+        with metrics.timer('markdown'):
+            return bleach.linkify(bleach.clean(
+                markdown(value, output_format='html'),
+                tags=allowed_tags, strip=True))
+
+    @staticmethod
+    def on_changed_body(target, value, oldvalue, initiator):
+        target.body_html = Comment.render_body(value)
 
     @staticmethod
     def generate_fake(count=100):
@@ -453,7 +703,209 @@ class Comment(db.Model):
             db.session.add(comment)
             db.session.commit()
 
+    def to_json(self):
+        json_comment = {
+            'url': url_for('api.get_post_comments', id=self.post_id,
+                           _external=True),
+            'post': url_for('api.get_post', id=self.post_id, _external=True),
+            'body': self.body,
+            'body_html': self.body_html,
+            'timestamp': self.timestamp,
+            'author': url_for('api.get_user', id=self.author_id,
+                              _external=True),
+        }
+        return json_comment
+
+    # 评论管理队列，status 为 'enabled'、'disabled' 或 None（全部）
+    @staticmethod
+    def moderation_query(status=None, author_id=None, post_id=None):
+        query = Comment.query
+        if status == 'disabled':
+            query = query.filter(Comment.disabled == True)
+        elif status == 'enabled':
+            query = query.filter(Comment.disabled == False)
+        if author_id is not None:
+            query = query.filter(Comment.author_id == author_id)
+        if post_id is not None:
+            query = query.filter(Comment.post_id == post_id)
+        return query.order_by(Comment.timestamp.desc())
+
+    # 旧数据库中 disabled 为空的评论改为已启用，由 deploy 命令和每天的
+    # reconcile_counts 任务执行，之后才能给该列加上 NOT NULL 约束
+    @staticmethod
+    def fill_disabled():
+        comments = Comment.__table__
+        result = db.session.execute(comments.update()
+                                    .where(comments.c.disabled == None)
+                                    .values(disabled=False))
+        db.session.commit()
+        return result.rowcount
+
+    # 用一条 UPDATE 批量启用或禁用评论，ids 和 author_id 至少指定一个
+    @staticmethod
+    def set_disabled(disabled, ids=None, author_id=None):
+        if not ids and author_id is None:
+            return 0
+        query = Comment.query
+        if ids:
+            query = query.filter(Comment.id.in_(ids))
+        if author_id is not None:
+            query = query.filter(Comment.author_id == author_id)
+        post_ids = [row[0] for row in
+                    query.with_entities(Comment.post_id).distinct()]
+        count = query.update({Comment.disabled: disabled},
+                             synchronize_session=False)
+        db.session.commit()
+        comments_changed.send(current_app._get_current_object(),
+                              post_ids=post_ids)
+        return count
+
+    # 新增或删除评论时更新文章的评论数
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        Comment._add_to_count(connection, target.post_id, 1)
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        Comment._add_to_count(connection, target.post_id, -1)
+
+    @staticmethod
+    def _add_to_count(connection, post_id, delta):
+        if post_id is None:
+            return
+        posts = Post.__table__
+        connection.execute(posts.update().where(posts.c.id == post_id).values(
+            comment_count=db.func.coalesce(posts.c.comment_count, 0) + delta))
+
 db.event.listen(Comment.body, 'set', Comment.on_changed_body)
+db.event.listen(Comment, 'after_insert', Comment.on_inserted)
+db.event.listen(Comment, 'after_delete', Comment.on_deleted)
+
+
+# 归档的文章和评论，由 app/archive.py 从 posts 和 comments 表移入。
+# 可以通过 SQLALCHEMY_BINDS['archive'] 保存在单独的数据库中，因此没有外键和关系，
+# 作者按 author_id 查询。归档的文章可以查看和编辑，不能再评论
+class ArchivedPost(db.Model):
+    __tablename__ = 'archived_posts'
+    __bind_key__ = 'archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    body = db.Column(db.Text)
+    body_html = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime)
+    author_id = db.Column(db.Integer, index=True)
+    comment_count = db.Column(db.Integer, default=0)
+
+    archived = True
+
+    @property
+    def author(self):
+        return User.query.get(self.author_id)
+
+    def paginate_comments(self, page, per_page, load=None, after=None,
+                          before=None):
+        return paginate_comments(
+            ArchivedComment.query.filter_by(post_id=self.id),
+            ArchivedComment, self.comment_count, page, per_page, load,
+            after, before)
+
+db.event.listen(ArchivedPost.body, 'set', Post.on_changed_body)
+
+
+class ArchivedComment(db.Model):
+    __tablename__ = 'archived_comments'
+    __bind_key__ = 'archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    body = db.Column(db.Text)
+    body_html = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime)
+    disabled = db.Column(db.Boolean, default=False)
+    author_id = db.Column(db.Integer)
+    post_id = db.Column(db.Integer, index=True)
+
+    @property
+    def author(self):
+        return User.query.get(self.author_id)
+
+
+# 后台任务，由 app/scheduler.py 调度。周期任务每个一行，name 和 task 相同；
+# 一次性任务的 name 为空，执行成功后删除，失败后保留（next_run_at 为空）以便查看错误。
+# locked_by 和 locked_until 是正在执行的进程和租约的到期时间
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), unique=True)
+    task = db.Column(db.String(64))
+    args = db.Column(db.Text)   # 一次性任务的参数，JSON
+    interval = db.Column(db.Integer)    # 周期，单位为秒
+    next_run_at = db.Column(db.DateTime, index=True)
+    locked_by = db.Column(db.String(128))
+    locked_until = db.Column(db.DateTime)
+    last_started_at = db.Column(db.DateTime)
+    last_duration = db.Column(db.Float)
+    last_error = db.Column(db.Text)
+    runs = db.Column(db.Integer, default=0)
+    failures = db.Column(db.Integer, default=0)
+
+# 热度分数
+db.event.listen(Post, 'before_insert', hot.on_post_before_insert)
+db.event.listen(Comment, 'after_insert', hot.on_comment_inserted)
+
+# 新文章和新评论在提交后推送给 SSE 客户端
+db.event.listen(Post, 'after_insert', broker.on_post_inserted)
+db.event.listen(Comment, 'after_insert', broker.on_comment_inserted)
+db.event.listen(db.session, 'after_commit', broker.on_commit)
+db.event.listen(db.session, 'after_rollback', broker.on_rollback)
+
+
+# 数据变化时失效缓存的标签：'post:<id>' 是单篇文章（含评论和评论数），'posts' 是文章列表，
+# 'user:<id>' 是用户资料及其文章列表。标签在提交后才失效
+def _post_tags(post):
+    return ['post:%s' % post.id, 'posts', 'user:%s' % post.author_id]
+
+
+# 添加评论时文章的 comments 集合变化也会触发 after_update，只有列的值变化时才失效
+def _post_update_tags(post):
+    if db.session.is_modified(post, include_collections=False):
+        return _post_tags(post)
+    return []
+
+
+# 只有页面上显示的资料变化时才失效，每次请求都会更新的 last_seen 不算
+_USER_PROFILE_FIELDS = ('email', 'username', 'role_id', 'name', 'location',
+                        'about_me', 'avatar_hash', 'confirmed')
+
+
+def _user_tags(user):
+    state = db.inspect(user)
+    if any(state.attrs[field].history.has_changes()
+           for field in _USER_PROFILE_FIELDS):
+        return ['user:%s' % user.id]
+    return []
+
+db.event.listen(Post, 'after_insert', cache.invalidator(_post_tags))
+db.event.listen(Post, 'after_update', cache.invalidator(_post_update_tags))
+db.event.listen(Post, 'after_delete', cache.invalidator(_post_tags))
+for event in ('after_insert', 'after_update', 'after_delete'):
+    db.event.listen(Comment, event, cache.invalidator(
+        lambda comment: ['post:%s' % comment.post_id]))
+    db.event.listen(Follow, event, cache.invalidator(
+        lambda follow: ['user:%s' % follow.follower_id,
+                        'user:%s' % follow.followed_id]))
+db.event.listen(ArchivedPost, 'after_update', cache.invalidator(_post_tags))
+db.event.listen(User, 'after_update', cache.invalidator(_user_tags))
+db.event.listen(User, 'after_delete', cache.invalidator(
+    lambda user: ['user:%s' % user.id]))
+db.event.listen(db.session, 'after_commit', cache.on_commit)
+db.event.listen(db.session, 'after_rollback', cache.on_rollback)
+
+# 分页总数的缓存
+db.event.listen(Post, 'after_insert', counts.on_post_inserted)
+db.event.listen(Post, 'after_delete', counts.on_post_deleted)
+db.event.listen(Comment, 'after_insert', counts.on_comment_inserted)
+db.event.listen(Comment, 'after_delete', counts.on_comment_deleted)
+db.event.listen(Comment, 'after_update', counts.on_comment_updated)
+db.event.listen(db.session, 'after_commit', counts.on_commit)
+db.event.listen(db.session, 'after_rollback', counts.on_rollback)
 
 
 # 匿名用户，用户未登录时 current_user 的值，这样用户未登录的时候也可以调用 can 和 is_administrator
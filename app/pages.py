@@ -0,0 +1,108 @@
+# 匿名访客的整页缓存
+# 未登录的访客看到的首页、热门、用户资料页和文章页对所有人都一样，
+# 用 @page_cache.cached() 装饰的视图按路径和查询字符串缓存整个响应，命中时不执行视图，
+# 不加载用户和会话。请求带会话或“记住我”的 cookie、或者带 Authorization 头时不使用缓存，
+# 这样闪现消息和表单的 CSRF 令牌不会被缓存；响应设置了 cookie 或修改了会话时也不缓存。
+# 页面带有和其他缓存相同的标签（'posts'、'post:<id>'、'user:<id>'），由模型事件在提交后失效。
+# 标签的版本号在读取数据之前取得：URL 中能确定的标签由 cached(tags) 给出，
+# 其余的由视图在查询之后调用 page_cache.tag() 加上。最后访问时间、热度等不触发失效的内容
+# 最多缓存 FLASKY_PAGE_CACHE_TIMEOUT 秒。
+# 命中时调用的 on_hit 只应做进程内的累计（如 hot.record_view），不访问数据库；
+# 视图调用 page_cache.skip_on_hit() 时，这个页面命中时不调用 on_hit（如归档的文章）
+from functools import wraps
+from flask import current_app, request, session, g
+
+# 不缓存的响应头，命中时由当前请求重新生成
+_SKIPPED_HEADERS = ('Set-Cookie', 'Server-Timing', 'Content-Length', 'X-Cache')
+
+
+class PageCache(object):
+    def __init__(self, app=None):
+        self.enabled = True
+        self.timeout = 60
+        self.cache = None
+        self.metrics = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # 和 counts 一样，缓存和指标的实例只能在创建之后导入
+        from . import cache, metrics
+        self.cache = cache
+        self.metrics = metrics
+        self.enabled = app.config.get('FLASKY_PAGE_CACHE', True)
+        self.timeout = app.config.get('FLASKY_PAGE_CACHE_TIMEOUT', 60)
+        metrics.describe('flasky_page_cache_requests_total', 'counter',
+                         'Page cache lookups by result.')
+
+    def _cacheable(self):
+        if not self.enabled or request.method != 'GET' or \
+                'Authorization' in request.headers:
+            return False
+        cookies = (current_app.session_cookie_name,
+                   current_app.config.get('REMEMBER_COOKIE_NAME',
+                                          'remember_token'))
+        return not any(name in request.cookies for name in cookies)
+
+    @staticmethod
+    def _storable(response):
+        return response.status_code == 200 and not response.is_streamed and \
+            'Set-Cookie' not in response.headers and not session.modified
+
+    def tag(self, *tags):
+        """给正在生成的页面加上标签，不在缓存页面时什么也不做"""
+        page_tags = g.get('_page_tags')
+        if page_tags is not None:
+            page_tags.update(self.cache.versions(
+                [tag for tag in tags if tag not in page_tags]))
+
+    def skip_on_hit(self):
+        """正在生成的页面命中缓存时不调用 on_hit"""
+        if g.get('_page_tags') is not None:
+            g._page_on_hit = False
+
+    def cached(self, tags=None, on_hit=None):
+        """缓存视图的响应。tags(**view_args) 返回 URL 能确定的标签，
+        on_hit(**view_args) 在命中时调用，用于统计浏览次数等"""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not self._cacheable():
+                    return f(*args, **kwargs)
+                key = 'page:' + request.full_path
+                entry = self.cache.get(key)
+                if entry is not None:
+                    self.metrics.inc('flasky_page_cache_requests_total',
+                                     result='hit')
+                    # 旧版本缓存的页面没有第四项
+                    status, headers, body = entry[:3]
+                    if on_hit is not None and entry[3:] != (False,):
+                        on_hit(**kwargs)
+                    response = current_app.response_class(body, status, headers)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+                self.metrics.inc('flasky_page_cache_requests_total',
+                                 result='miss')
+                g._page_tags = {}
+                g._page_on_hit = True
+                self.tag(*(tags(**kwargs) if tags is not None else ()))
+                response = current_app.make_response(f(*args, **kwargs))
+                page_tags = g.pop('_page_tags')
+                count_hits = g.pop('_page_on_hit')
+                if self._storable(response):
+                    headers = [(name, value) for name, value in response.headers
+                               if name not in _SKIPPED_HEADERS]
+                    self.cache.set(key, (response.status_code, headers,
+                                         response.get_data(),
+                                         count_hits),
+                                   self.timeout, tags=sorted(page_tags),
+                                   versions=page_tags)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return decorated_function
+        return decorator
+
+    def tag_posts(self, posts):
+        """文章列表的标签：每篇文章（评论数）和作者（用户名、头像）"""
+        self.tag(*['post:%s' % post.id for post in posts] +
+                 ['user:%s' % post.author_id for post in posts])
@@ -0,0 +1,137 @@
+# 按需性能剖析
+# FLASKY_PROFILER_ENABLED 为 True 时，管理员可以在请求中加上 X-Profile 请求头或 _profile 查询参数
+# （取值 cprofile 或 sample）对单个请求进行剖析：cprofile 输出 pstats 文件，
+# sample 用后台线程定时采样请求线程的调用栈，输出火焰图工具使用的 collapsed stack 文件。
+# 功能关闭时不注册任何请求钩子，没有额外开销。
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request
+from flask_login import current_user
+
+
+class StackSampler(object):
+    """每隔 interval 秒记录一次指定线程的调用栈"""
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s:%d' % (os.path.basename(code.co_filename),
+                                           code.co_name, code.co_firstlineno))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+
+
+class SamplingProfilerMiddleware(object):
+    """WSGI 中间件，对每个请求采样并写入 profile_dir"""
+
+    def __init__(self, app, profile_dir, interval=0.005):
+        self.app = app
+        self.profile_dir = profile_dir
+        self.interval = interval
+
+    def __call__(self, environ, start_response):
+        sampler = StackSampler(interval=self.interval)
+        sampler.start()
+        try:
+            return list(self.app(environ, start_response))
+        finally:
+            sampler.stop()
+            sampler.write(profile_path(self.profile_dir,
+                                       environ.get('PATH_INFO', '/'),
+                                       'collapsed'))
+
+
+def profile_path(profile_dir, name, extension):
+    if not os.path.exists(profile_dir):
+        os.makedirs(profile_dir)
+    name = name.strip('/').replace('/', '.') or 'root'
+    return os.path.join(profile_dir, '%s.%d.%s' % (
+        name, int(time.time() * 1000), extension))
+
+
+class RequestProfiler(object):
+    def __init__(self, app=None):
+        self.profile_dir = None
+        self.interval = 0.005
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('FLASKY_PROFILER_ENABLED'):
+            return
+        self.profile_dir = app.config['FLASKY_PROFILE_DIR']
+        self.interval = app.config.get('FLASKY_PROFILER_INTERVAL', 0.005)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        # 视图抛出异常时不会调用 after_request，在 teardown_request 中确保停止剖析
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        mode = request.headers.get('X-Profile') or request.args.get('_profile')
+        if mode not in ('cprofile', 'sample') or \
+                not current_user.is_administrator():
+            return
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler(interval=self.interval)
+            profiler.start()
+        g._profiler = (mode, profiler)
+
+    # 停止剖析并写入文件，返回文件路径，没有在剖析时返回 None
+    def _finish(self):
+        if g.get('_profiler') is None:
+            return None
+        mode, profiler = g._profiler
+        g._profiler = None
+        endpoint = request.endpoint or 'unknown'
+        if mode == 'cprofile':
+            profiler.disable()
+            path = profile_path(self.profile_dir, endpoint, 'prof')
+            profiler.dump_stats(path)
+        else:
+            profiler.stop()
+            path = profile_path(self.profile_dir, endpoint, 'collapsed')
+            profiler.write(path)
+        return path
+
+    def _after_request(self, response):
+        path = self._finish()
+        if path is not None:
+            response.headers['X-Profile-File'] = os.path.basename(path)
+        return response
+
+    def _teardown_request(self, exc):
+        self._finish()
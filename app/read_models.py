@@ -0,0 +1,125 @@
+# 列表页面使用的只读模型
+# 文章列表、评论列表和关注者列表只读取每行的几个字段，ORM 实例却带着实例状态、
+# 标识映射中的条目和动态关系对象。这里的类用 __slots__ 保存字段，由查询返回的行直接构造，
+# 不进入会话；一页中的作者按 id 批量查询一次，同一个作者共享一个对象。
+# 属性名和模型相同，模板可以同时接受模型和只读模型。
+# load() 接受模型的查询（可以带过滤、排序和 LIMIT/OFFSET），可以传给 counts.paginate(load=...)
+import hashlib
+from . import db
+
+
+class AuthorSummary(object):
+    __slots__ = ('id', 'username', 'gravatar_hash')
+
+    def __init__(self, id, username, gravatar_hash):
+        self.id = id
+        self.username = username
+        self.gravatar_hash = gravatar_hash
+
+    def gravatar(self, size=100, default='identicon', rating='g'):
+        from .models import gravatar_url
+        return gravatar_url(self.gravatar_hash, size, default, rating)
+
+
+def load_authors(ids):
+    """按 id 批量查询用户，返回 {id: AuthorSummary}"""
+    from .models import User
+    ids = sorted(set(id for id in ids if id is not None))
+    if not ids:
+        return {}
+    users = User.__table__
+    rows = db.session.execute(
+        db.select([users.c.id, users.c.username, users.c.email,
+                   users.c.avatar_hash]).where(users.c.id.in_(ids)))
+    return dict((id, AuthorSummary(id, username, avatar_hash or hashlib.md5(
+        email.encode('utf-8')).hexdigest()))
+        for id, username, email, avatar_hash in rows)
+
+
+# 查询的模型，归档的评论和评论使用同一个只读模型
+def _model(query):
+    return query.column_descriptions[0]['entity']
+
+
+class PostSummary(object):
+    __slots__ = ('id', 'body', 'body_html', 'timestamp', 'author_id',
+                 'author', 'comment_count')
+
+    def __init__(self, id, body, body_html, timestamp, author_id, author,
+                 comment_count):
+        self.id = id
+        self.body = body
+        self.body_html = body_html
+        self.timestamp = timestamp
+        self.author_id = author_id
+        self.author = author
+        self.comment_count = comment_count
+
+    @staticmethod
+    def load(query):
+        model = _model(query)
+        rows = query.with_entities(
+            model.id, model.body, model.body_html, model.timestamp,
+            model.author_id, model.comment_count).all()
+        authors = load_authors(row.author_id for row in rows)
+        return [PostSummary(id, body, body_html, timestamp, author_id,
+                            authors.get(author_id), comment_count)
+                for id, body, body_html, timestamp, author_id, comment_count
+                in rows]
+
+
+class CommentSummary(object):
+    __slots__ = ('id', 'body', 'body_html', 'timestamp', 'disabled',
+                 'author_id', 'author', 'post_id')
+
+    def __init__(self, id, body, body_html, timestamp, disabled, author_id,
+                 author, post_id):
+        self.id = id
+        self.body = body
+        self.body_html = body_html
+        self.timestamp = timestamp
+        self.disabled = disabled
+        self.author_id = author_id
+        self.author = author
+        self.post_id = post_id
+
+    @staticmethod
+    def load(query):
+        model = _model(query)
+        rows = query.with_entities(
+            model.id, model.body, model.body_html, model.timestamp,
+            model.disabled, model.author_id, model.post_id).all()
+        authors = load_authors(row.author_id for row in rows)
+        return [CommentSummary(id, body, body_html, timestamp, disabled,
+                               author_id, authors.get(author_id), post_id)
+                for id, body, body_html, timestamp, disabled, author_id,
+                post_id in rows]
+
+
+# 关注者列表的一行，user 是列表中显示的一方
+class FollowSummary(object):
+    __slots__ = ('user', 'timestamp')
+
+    def __init__(self, user, timestamp):
+        self.user = user
+        self.timestamp = timestamp
+
+    @staticmethod
+    def _load(query, column):
+        from .models import Follow
+        rows = query.with_entities(column, Follow.timestamp).all()
+        users = load_authors(row[0] for row in rows)
+        return [FollowSummary(users.get(user_id), timestamp)
+                for user_id, timestamp in rows]
+
+    @staticmethod
+    def followers(query):
+        """user.followers 的查询，返回关注者"""
+        from .models import Follow
+        return FollowSummary._load(query, Follow.follower_id)
+
+    @staticmethod
+    def followed(query):
+        """user.followed 的查询，返回被关注的用户"""
+        from .models import Follow
+        return FollowSummary._load(query, Follow.followed_id)
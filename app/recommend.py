@@ -0,0 +1,116 @@
+# “推荐关注”：基于关注关系的朋友的朋友推荐
+# 候选人是用户关注的人所关注的人，分数为用户关注的人中有多少人关注了该候选人。
+# 全量计算一次把 follows 表读入邻接表（user_id -> 关注的人 id 集合），可以用进程池分块计算；
+# 关注关系变化时只把受影响的用户标记为过期，refresh_recommendations 只重新计算这些用户。
+from concurrent.futures import ProcessPoolExecutor
+from heapq import nsmallest
+from datetime import datetime
+from . import db
+from .models import Follow, User, Recommendation
+
+_adjacency = {}     # 进程池中每个进程持有一份邻接表
+
+
+def top_candidates(user_id, adjacency, top_k):
+    followed = adjacency.get(user_id, ())
+    scores = {}
+    for friend in followed:
+        for candidate in adjacency.get(friend, ()):
+            scores[candidate] = scores.get(candidate, 0) + 1
+    scores.pop(user_id, None)
+    for friend in followed:
+        scores.pop(friend, None)
+    # 分数从高到低，分数相同时 id 小的在前
+    return nsmallest(top_k, scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def _init_worker(adjacency):
+    global _adjacency
+    _adjacency = adjacency
+
+
+def _compute_chunk(args):
+    user_ids, top_k = args
+    return [(user_id, top_candidates(user_id, _adjacency, top_k))
+            for user_id in user_ids]
+
+
+def load_adjacency(user_ids=None, chunk_size=500):
+    query = db.session.query(Follow.follower_id, Follow.followed_id) \
+        .filter(Follow.follower_id != Follow.followed_id)
+    if user_ids is None:
+        queries = [query]
+    else:
+        user_ids = list(user_ids)
+        queries = [query.filter(Follow.follower_id.in_(
+            user_ids[i:i + chunk_size]))
+            for i in range(0, len(user_ids), chunk_size)]
+    adjacency = {}
+    for q in queries:
+        for follower_id, followed_id in q:
+            adjacency.setdefault(follower_id, set()).add(followed_id)
+    return adjacency
+
+
+def _save(results):
+    user_ids = [user_id for user_id, candidates in results]
+    if not user_ids:
+        return
+    now = datetime.utcnow()
+    table = Recommendation.__table__
+    db.session.execute(table.delete().where(table.c.user_id.in_(user_ids)))
+    rows = [{'user_id': user_id, 'candidate_id': candidate_id,
+             'score': score, 'timestamp': now}
+            for user_id, candidates in results
+            for candidate_id, score in candidates]
+    if rows:
+        db.session.execute(table.insert(), rows)
+    db.session.query(User).filter(User.id.in_(user_ids)) \
+        .update({User.recommendations_stale: False}, synchronize_session=False)
+    db.session.commit()
+
+
+# 全量重新计算所有用户的推荐，processes 大于 1 时使用进程池
+def build_recommendations(top_k=10, processes=None, chunk_size=500,
+                          progress=None):
+    adjacency = load_adjacency()
+    user_ids = [row[0] for row in db.session.query(User.id).order_by(User.id)]
+    chunks = [(user_ids[i:i + chunk_size], top_k)
+              for i in range(0, len(user_ids), chunk_size)]
+    done = 0
+    if processes and processes > 1:
+        with ProcessPoolExecutor(max_workers=processes,
+                                 initializer=_init_worker,
+                                 initargs=(adjacency,)) as executor:
+            for results in executor.map(_compute_chunk, chunks):
+                _save(results)
+                done += len(results)
+                if progress is not None:
+                    progress(done, len(user_ids))
+    else:
+        _init_worker(adjacency)
+        for chunk in chunks:
+            results = _compute_chunk(chunk)
+            _save(results)
+            done += len(results)
+            if progress is not None:
+                progress(done, len(user_ids))
+    return done
+
+
+# 只重新计算被标记为过期的用户，每次最多处理 limit 个
+def refresh_recommendations(top_k=10, limit=1000):
+    user_ids = [row[0] for row in db.session.query(User.id)
+                .filter(User.recommendations_stale == True)
+                .order_by(User.id).limit(limit)]
+    if not user_ids:
+        return 0
+    # 只需要这些用户的两层关注关系
+    adjacency = load_adjacency(user_ids)
+    friends = set()
+    for followed in adjacency.values():
+        friends.update(followed)
+    adjacency.update(load_adjacency(friends - set(adjacency)))
+    _save([(user_id, top_candidates(user_id, adjacency, top_k))
+           for user_id in user_ids])
+    return len(user_ids)
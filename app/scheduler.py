@@ -0,0 +1,231 @@
+# 后台任务调度
+# 周期任务和一次性任务保存在 jobs 表中。调度器可以在每个 Web 进程中运行（FLASKY_SCHEDULER），
+# 也可以在单独的 manage.py worker 进程中运行，多个进程同时运行时任务不会重复执行：
+# 到期的任务用带条件的 UPDATE 加锁（locked_by、locked_until），只有更新成功的进程执行，
+# 租约 FLASKY_SCHEDULER_LEASE 秒后过期，进程中途退出时任务由其他进程接手。
+# 任务在 FLASKY_SCHEDULER_WORKERS 个线程中执行，线程都在忙时不再领取新任务。
+# 任务用 @scheduler.task(name, interval) 注册（见 app/jobs.py），interval 为默认周期，
+# FLASKY_SCHEDULER_INTERVALS 可以修改周期，为 None 时不周期执行，只能用 schedule() 加入一次性任务
+import json
+import os
+import socket
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Thread, Event, Lock
+from sqlalchemy.exc import IntegrityError
+from . import db
+
+
+class Scheduler(object):
+    def __init__(self, app=None):
+        self.tasks = {}     # 任务名 -> (函数, 默认周期)
+        self.intervals = {}
+        self.workers = 2
+        self.poll_interval = 1
+        self.lease = 3600
+        self.metrics = None
+        self._app = None
+        self._thread = None
+        self._stop = Event()
+        self._lock = Lock()
+        self._running = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from . import metrics
+        from . import jobs  # 注册任务
+        self.metrics = metrics
+        self.workers = app.config.get('FLASKY_SCHEDULER_WORKERS', 2)
+        self.poll_interval = app.config.get('FLASKY_SCHEDULER_POLL_INTERVAL', 1)
+        self.lease = app.config.get('FLASKY_SCHEDULER_LEASE', 3600)
+        self.intervals = dict((name, interval)
+                              for name, (func, interval) in self.tasks.items())
+        self.intervals.update(app.config.get('FLASKY_SCHEDULER_INTERVALS') or {})
+        self._app = app
+        metrics.describe('flasky_job_runs_total', 'counter',
+                         'Scheduled job runs by job and result.')
+        metrics.describe('flasky_job_duration_seconds', 'histogram',
+                         'Scheduled job run time by job.')
+        metrics.describe('flasky_jobs_running', 'gauge',
+                         'Scheduled jobs running in this process.')
+        if app.config.get('FLASKY_SCHEDULER', False):
+            self.start(app)
+
+    def task(self, name, interval=None):
+        """注册任务的装饰器"""
+        def decorator(f):
+            self.tasks[name] = (f, interval)
+            return f
+        return decorator
+
+    # 进程的标识，fork 之后会变化
+    @property
+    def worker_id(self):
+        return '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def schedule(self, task, delay=0, **kwargs):
+        """加入一次性任务，delay 秒后执行。任务随当前会话一起提交，参数必须可以转换为 JSON"""
+        from .models import Job
+        if task not in self.tasks:
+            raise ValueError('Unknown task %r' % task)
+        job = Job(task=task, args=json.dumps(kwargs, sort_keys=True),
+                  next_run_at=datetime.utcnow() + timedelta(seconds=delay))
+        db.session.add(job)
+        return job
+
+    def sync(self):
+        """按注册的任务和配置的周期创建、更新或删除周期任务的行"""
+        from .models import Job
+        table = Job.__table__
+        existing = dict(db.session.execute(
+            db.select([table.c.name, table.c.interval])
+            .where(table.c.name.in_(list(self.tasks)))).fetchall())
+        now = datetime.utcnow()
+        for name in sorted(self.tasks):
+            interval = self.intervals.get(name)
+            if interval is None:
+                if name in existing:
+                    db.session.execute(table.delete()
+                                       .where(table.c.name == name))
+            elif name not in existing:
+                db.session.execute(table.insert().values(
+                    name=name, task=name, interval=interval,
+                    next_run_at=now))
+            elif existing[name] != interval:
+                db.session.execute(table.update().where(table.c.name == name)
+                                   .values(interval=interval))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # 其他进程同时插入了同一个任务
+            db.session.rollback()
+
+    def claim(self, limit=None):
+        """领取最多 limit 个到期的任务，返回任务的 id"""
+        from .models import Job
+        table = Job.__table__
+        now = datetime.utcnow()
+        due = db.and_(table.c.next_run_at <= now,
+                      table.c.task.in_(list(self.tasks)),
+                      db.or_(table.c.locked_until.is_(None),
+                             table.c.locked_until < now))
+        ids = [row[0] for row in db.session.execute(
+            db.select([table.c.id]).where(due)
+            .order_by(table.c.next_run_at).limit(limit))]
+        claimed = []
+        for id in ids:
+            # 其他进程先领取了这个任务时条件不成立，更新的行数为 0
+            result = db.session.execute(
+                table.update().where(table.c.id == id).where(due)
+                .values(locked_by=self.worker_id,
+                        locked_until=now + timedelta(seconds=self.lease)))
+            if result.rowcount == 1:
+                claimed.append(id)
+        db.session.commit()
+        return claimed
+
+    def run(self, id):
+        """执行已经领取的任务，成功时返回 True"""
+        from .models import Job
+        job = Job.query.get(id)
+        if job is None or job.locked_by != self.worker_id:
+            return False
+        task, interval = job.task, job.interval
+        func = self.tasks[task][0]
+        args = json.loads(job.args) if job.args else {}
+        started = datetime.utcnow()
+        start = time.perf_counter()
+        error = None
+        try:
+            func(**args)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            error = traceback.format_exc()
+            self._app.logger.exception('Job %s failed', task)
+        duration = time.perf_counter() - start
+        self.metrics.observe('flasky_job_duration_seconds', duration, job=task)
+        self.metrics.inc('flasky_job_runs_total', job=task,
+                         result='error' if error else 'ok')
+        self._finish(id, interval, started, duration, error)
+        return error is None
+
+    def _finish(self, id, interval, started, duration, error):
+        from .models import Job
+        table = Job.__table__
+        # 租约过期后任务可能已经被其他进程领取，只修改自己持有的任务
+        mine = db.and_(table.c.id == id, table.c.locked_by == self.worker_id)
+        if interval is None and error is None:
+            db.session.execute(table.delete().where(mine))
+        else:
+            db.session.execute(table.update().where(mine).values(
+                locked_by=None, locked_until=None,
+                next_run_at=started + timedelta(seconds=interval)
+                if interval is not None else None,
+                last_started_at=started, last_duration=duration,
+                last_error=error, runs=table.c.runs + 1,
+                failures=table.c.failures + (1 if error else 0)))
+        db.session.commit()
+
+    def run_pending(self):
+        """在当前线程中执行所有到期的任务，返回执行的任务数"""
+        ids = self.claim()
+        for id in ids:
+            self.run(id)
+        return len(ids)
+
+    def start(self, app=None):
+        """在后台线程中运行调度器"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = Thread(target=self.run_forever,
+                                  args=(app or self._app,), name='scheduler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self, app=None):
+        """领取到期的任务交给线程池执行，直到 stop() 被调用"""
+        app = app or self._app
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            with app.app_context():
+                self.sync()
+                while not self._stop.is_set():
+                    with self._lock:
+                        free = self.workers - self._running
+                    if free > 0:
+                        try:
+                            ids = self.claim(free)
+                        except Exception:
+                            db.session.rollback()
+                            app.logger.exception('Claiming jobs failed')
+                            ids = []
+                        for id in ids:
+                            self._set_running(1)
+                            pool.submit(self._execute, app, id)
+                    self._stop.wait(self.poll_interval)
+        finally:
+            pool.shutdown(wait=True)
+
+    def _set_running(self, delta):
+        with self._lock:
+            self._running += delta
+            self.metrics.set('flasky_jobs_running', self._running)
+
+    def _execute(self, app, id):
+        try:
+            with app.app_context():
+                try:
+                    self.run(id)
+                finally:
+                    db.session.remove()
+        finally:
+            self._set_running(-1)
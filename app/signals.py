@@ -0,0 +1,8 @@
+# 程序自定义的信号，批量 UPDATE/INSERT 不会触发 SQLAlchemy 的模型事件，
+# 批量操作提交之后发送这些信号，缓存等组件订阅它们来失效受影响的数据
+from blinker import Namespace
+
+signals = Namespace()
+
+# 评论被批量修改，参数 post_ids 为受影响的文章 id
+comments_changed = signals.signal('comments-changed')
@@ -0,0 +1,116 @@
+# 慢查询和慢请求日志
+# 超过阈值的 SQL 语句按采样率记录语句、参数结构（只记录类型，不记录参数值）、耗时、端点和用户 id，
+# 保存在固定大小的环形缓冲区中，同时可以追加写入 JSON lines 文件。管理员在 /slow-queries 页面查看。
+# 语句的耗时来自 app/metrics.py 的游标事件，不再单独计时
+import json
+import random
+import time
+from collections import deque
+from datetime import datetime
+from threading import Lock
+from flask import g, request, has_request_context, _request_ctx_stack
+
+
+class SlowQueryLog(object):
+    def __init__(self, app=None):
+        self.query_time = 0.5
+        self.request_time = 1.0
+        self.sample_rate = 1.0
+        self.path = None
+        self._entries = deque(maxlen=1000)
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.query_time = app.config.get('FLASKY_SLOW_DB_QUERY_TIME', 0.5)
+        self.request_time = app.config.get('FLASKY_SLOW_REQUEST_TIME', 1.0)
+        self.sample_rate = app.config.get('FLASKY_SLOW_QUERY_SAMPLE_RATE', 1.0)
+        self.path = app.config.get('FLASKY_SLOW_QUERY_LOG_FILE')
+        with self._lock:
+            self._entries = deque(
+                maxlen=app.config.get('FLASKY_SLOW_QUERY_LOG_SIZE', 1000))
+        from . import metrics
+        metrics.on_query(self._on_query)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    # 按语句汇总，总耗时最多的排在前面
+    def top_offenders(self, limit=20, kind='query'):
+        summary = {}
+        for entry in self.entries():
+            if entry['type'] != kind:
+                continue
+            key = entry['statement'] if kind == 'query' else entry['endpoint']
+            item = summary.setdefault(key, {'key': key, 'count': 0,
+                                            'total': 0.0, 'max': 0.0,
+                                            'endpoints': set()})
+            item['count'] += 1
+            item['total'] += entry['duration']
+            item['max'] = max(item['max'], entry['duration'])
+            item['endpoints'].add(entry['endpoint'])
+        items = sorted(summary.values(), key=lambda item: item['total'],
+                       reverse=True)[:limit]
+        for item in items:
+            item['mean'] = item['total'] / item['count']
+            item['endpoints'] = sorted(e for e in item['endpoints'] if e)
+        return items
+
+    def record(self, entry):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        entry['timestamp'] = datetime.utcnow().isoformat()
+        with self._lock:
+            self._entries.append(entry)
+        # 在锁外写文件，追加模式下一次 write 写入整行，慢的磁盘不会阻塞其他语句
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def _on_query(self, statement, parameters, executemany, duration):
+        if duration < self.query_time:
+            return
+        endpoint, user_id = _request_info()
+        self.record({'type': 'query', 'statement': statement,
+                     'parameters': _parameters_shape(parameters, executemany),
+                     'duration': duration, 'endpoint': endpoint,
+                     'user_id': user_id})
+
+    def _before_request(self):
+        g._slow_request_start = time.perf_counter()
+
+    def _after_request(self, response):
+        start = g.get('_slow_request_start')
+        if start is not None:
+            duration = time.perf_counter() - start
+            if duration >= self.request_time:
+                endpoint, user_id = _request_info()
+                self.record({'type': 'request', 'statement': request.full_path,
+                             'parameters': None, 'duration': duration,
+                             'endpoint': endpoint, 'user_id': user_id})
+        return response
+
+
+# 不通过 current_user 读取用户，避免在加载用户的查询中再次触发加载
+def _request_info():
+    if not has_request_context():
+        return None, None
+    user = getattr(_request_ctx_stack.top, 'user', None) or \
+        g.get('current_user')
+    return request.endpoint, getattr(user, 'id', None)
+
+
+def _parameters_shape(parameters, executemany):
+    if executemany:
+        return {'rows': len(parameters),
+                'shape': _parameters_shape(parameters[0], False)
+                if parameters else None}
+    if isinstance(parameters, dict):
+        return dict((k, type(v).__name__) for k, v in parameters.items())
+    if isinstance(parameters, (list, tuple)):
+        return [type(v).__name__ for v in parameters]
+    return type(parameters).__name__
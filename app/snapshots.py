@@ -0,0 +1,144 @@
+# 文章快照缓存
+# /post/<id> 和 API 的 GET /posts/<id> 读取文章快照：正文 HTML、作者摘要和评论数，
+# 快照不在缓存中时才查询数据库（read-through）。快照带 'post:<id>' 和 'user:<author_id>' 标签，
+# 文章修改或删除、新评论、作者资料修改时失效。
+# 防止缓存击穿：快照到期（FLASKY_POST_CACHE_TIMEOUT）后由一个请求刷新，
+# 其他请求继续使用旧快照；快照被失效或不存在时只有一个请求查询数据库，其他请求等待它的结果
+import time
+from flask import abort, url_for
+from .read_models import AuthorSummary
+
+# 快照结构变化时修改版本号，旧版本的缓存自然失效
+VERSION = 2
+
+
+class PostSnapshot(object):
+    __slots__ = ('id', 'body', 'body_html', 'timestamp', 'author_id', 'author',
+                 'comment_count', 'archived')
+
+    def __init__(self, id, body, body_html, timestamp, author_id, author,
+                 comment_count, archived):
+        self.id = id
+        self.body = body
+        self.body_html = body_html
+        self.timestamp = timestamp
+        self.author_id = author_id
+        self.author = author
+        self.comment_count = comment_count
+        self.archived = archived
+
+    @staticmethod
+    def from_post(post):
+        author = post.author
+        return PostSnapshot(
+            post.id, post.body, post.body_html, post.timestamp,
+            post.author_id,
+            AuthorSummary(author.id, author.username, author.gravatar_hash())
+            if author is not None else None,
+            post.comment_count or 0, post.archived)
+
+    def tags(self):
+        return ['post:%d' % self.id, 'user:%s' % self.author_id]
+
+    def paginate_comments(self, page, per_page, load=None, after=None,
+                          before=None):
+        from .models import paginate_comments, Comment, ArchivedComment
+        model = ArchivedComment if self.archived else Comment
+        return paginate_comments(model.query.filter_by(post_id=self.id),
+                                 model, self.comment_count, page, per_page,
+                                 load, after, before)
+
+    # 和 Post.to_json() 相同
+    def to_json(self):
+        return {
+            'url': url_for('api.get_post', id=self.id, _external=True),
+            'body': self.body,
+            'body_html': self.body_html,
+            'timestamp': self.timestamp,
+            'author': url_for('api.get_user', id=self.author_id,
+                              _external=True),
+            'comments': url_for('api.get_post_comments', id=self.id,
+                                _external=True),
+            'comment_count': self.comment_count
+        }
+
+
+class PostCache(object):
+    def __init__(self, app=None):
+        self.cache = None
+        self.metrics = None
+        self.timeout = 300
+        self.lock_timeout = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # 和 counts 一样，缓存和指标的实例只能在创建之后导入
+        from . import cache, metrics
+        self.cache = cache
+        self.metrics = metrics
+        self.timeout = app.config.get('FLASKY_POST_CACHE_TIMEOUT', 300)
+        self.lock_timeout = app.config.get('FLASKY_POST_CACHE_LOCK_TIMEOUT', 5)
+        metrics.describe('flasky_post_cache_requests_total', 'counter',
+                         'Post snapshot lookups by result.')
+
+    @staticmethod
+    def _key(id):
+        return 'post-snapshot:%d:%d' % (VERSION, id)
+
+    def _count(self, result):
+        self.metrics.inc('flasky_post_cache_requests_total', result=result)
+
+    def get(self, id):
+        """返回文章的快照，文章不存在时返回 None"""
+        key = self._key(id)
+        entry = self.cache.get(key)
+        if entry is not None:
+            fresh_until, snapshot = entry
+            if fresh_until > time.time() or not self.cache.add(key + ':lock', 1,
+                                                              self.lock_timeout):
+                # 没有到期，或者其他请求正在刷新
+                self._count('hit' if fresh_until > time.time() else 'stale')
+                return snapshot
+            self._count('refresh')
+            return self._refresh(id)
+        if self.cache.add(key + ':lock', 1, self.lock_timeout):
+            self._count('miss')
+            return self._refresh(id)
+        # 其他请求正在查询，等待它写入缓存；它结束（锁释放）后仍然没有结果时自己查询
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.01)
+            entry = self.cache.get(key)
+            if entry is not None:
+                self._count('wait')
+                return entry[1]
+            if self.cache.get(key + ':lock') is None:
+                break
+        self._count('miss')
+        return self._load(id)
+
+    def get_or_404(self, id):
+        snapshot = self.get(id)
+        if snapshot is None:
+            abort(404)
+        return snapshot
+
+    def _load(self, id):
+        from .models import Post, ArchivedPost
+        post = Post.query.get(id) or ArchivedPost.query.get(id)
+        return PostSnapshot.from_post(post) if post is not None else None
+
+    def _refresh(self, id):
+        key = self._key(id)
+        try:
+            # 先取标签的版本号，查询数据库期间发生的修改会让这次写入的快照失效
+            versions = self.cache.versions(['post:%d' % id])
+            snapshot = self._load(id)
+            if snapshot is not None:
+                self.cache.set(key, (time.time() + self.timeout, snapshot),
+                               self.timeout * 2, tags=snapshot.tags(),
+                               versions=versions)
+            return snapshot
+        finally:
+            self.cache.delete(key + ':lock')
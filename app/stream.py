@@ -0,0 +1,128 @@
+# Server-Sent Events 实时推送
+# 进程内的发布/订阅：新文章和新评论提交（commit）之后发布到对应的频道，
+# 'posts' 频道推送新文章，'post:<id>' 频道推送该文章的新评论。每个连接有一个固定大小的队列，
+# 客户端处理不过来、队列满时给它发送 resync 事件并关闭连接，客户端重新加载页面即可；
+# 同时打开的连接数有上限，超过时返回 503。队列和锁在 gevent 的 monkey patch 下同样可用。
+# 只能收到本进程内的事件，多进程部署时需要让同一个客户端固定访问一个进程或改用共享的消息通道。
+# 每个连接在打开期间占用一个工作线程，同步工作进程很快就会被占满，
+# 因此默认关闭（FLASKY_LIVE_UPDATES），只在使用 gevent 等异步工作进程时启用。
+import json
+from queue import Queue, Empty, Full
+from threading import Lock
+from flask import Response
+from sqlalchemy.orm import object_session
+
+_CLOSE = object()
+
+
+class Subscription(object):
+    def __init__(self, channels, queue_size):
+        self.channels = set(channels)
+        self.queue = Queue(maxsize=queue_size)
+        self.closed = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except Full:
+            # 客户端太慢，清空队列后只留下关闭标记
+            self.closed = True
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except Empty:
+                    break
+            self.queue.put_nowait(_CLOSE)
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+
+class Broker(object):
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_streams = 100
+        self.queue_size = 50
+        self.heartbeat = 15
+        self._subscriptions = set()
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('FLASKY_LIVE_UPDATES', False)
+        self.max_streams = app.config.get('FLASKY_STREAM_MAX_CONNECTIONS', 100)
+        self.queue_size = app.config.get('FLASKY_STREAM_QUEUE_SIZE', 50)
+        self.heartbeat = app.config.get('FLASKY_STREAM_HEARTBEAT', 15)
+
+    def subscribe(self, channels):
+        with self._lock:
+            if len(self._subscriptions) >= self.max_streams:
+                return None
+            subscription = Subscription(channels, self.queue_size)
+            self._subscriptions.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, channel, event, data):
+        message = (event, json.dumps(data))
+        with self._lock:
+            subscriptions = [s for s in self._subscriptions
+                             if channel in s.channels and not s.closed]
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def stream(self, channels):
+        """返回 text/event-stream 响应，未启用时返回 404，连接数已满时返回 503"""
+        if not self.enabled:
+            return Response('Live updates are disabled\n', status=404)
+        subscription = self.subscribe(channels)
+        if subscription is None:
+            return Response('Too many open streams\n', status=503,
+                            headers={'Retry-After': '30'})
+
+        def generate():
+            yield 'retry: 5000\n\n'
+            while True:
+                message = subscription.get(self.heartbeat)
+                if message is None:
+                    yield ': keepalive\n\n'     # 注释行，保持连接
+                elif message is _CLOSE:
+                    yield 'event: resync\ndata: {}\n\n'
+                    break
+                else:
+                    yield 'event: %s\ndata: %s\n\n' % message
+
+        response = Response(generate(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache',
+                                     'X-Accel-Buffering': 'no'})
+        # 服务器关闭响应时取消订阅，生成器还没有开始执行（例如客户端已经断开）时也会调用
+        response.call_on_close(lambda: self.unsubscribe(subscription))
+        return response
+
+    # SQLAlchemy 事件：插入时先记在会话中，提交后再发布，回滚时丢弃
+    def on_post_inserted(self, mapper, connection, target):
+        self._pending(target).append(('posts', 'post', {
+            'id': target.id, 'author_id': target.author_id}))
+
+    def on_comment_inserted(self, mapper, connection, target):
+        self._pending(target).append(('post:%s' % target.post_id, 'comment', {
+            'id': target.id, 'post_id': target.post_id,
+            'author_id': target.author_id}))
+
+    @staticmethod
+    def _pending(target):
+        return object_session(target).info.setdefault('stream_events', [])
+
+    def on_commit(self, session):
+        for channel, event, data in session.info.pop('stream_events', ()):
+            self.publish(channel, event, data)
+
+    def on_rollback(self, session):
+        session.info.pop('stream_events', None)
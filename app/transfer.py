@@ -0,0 +1,150 @@
+# 站点数据的导出和导入（NDJSON）
+# 每行一个 JSON 对象：{"table": "users", "row": {...}}，按 roles、users、follows、posts、comments
+# 的顺序导出，导入时外键引用的行总是已经存在；之后是归档库（archive 绑定）中的
+# archived_posts、archived_comments。导出用流式游标每次取 chunk_size 行，
+# 导入每 chunk_size 行执行一次批量 INSERT，内存占用和数据量无关。
+# body_html 由 body 生成，不导出；导入时不触发模型事件，插入完成后再分块生成 HTML。
+# 文件名以 .gz 结尾时使用 gzip 压缩
+import gzip
+import json
+from datetime import datetime
+from . import db, cache, follow_graph
+from .models import Post, Comment, ArchivedPost, ArchivedComment
+
+TABLES = ('roles', 'users', 'follows', 'posts', 'comments',
+          'archived_posts', 'archived_comments')
+DERIVED = ('body_html',)
+
+
+def _bind(name):
+    """表所在的数据库，主库为 None"""
+    return db.metadata.tables[name].info.get('bind_key')
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def _parse_datetime(value):
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('Invalid datetime %r' % value)
+
+
+def export_data(path, chunk_size=1000, progress=None):
+    """导出到 path，返回每个表导出的行数"""
+    exported = {}
+    with _open(path, 'w') as f:
+        for name in TABLES:
+            table = db.metadata.tables[name]
+            columns = [c for c in table.c if c.name not in DERIVED]
+            connection = db.get_engine(bind=_bind(name)).connect() \
+                .execution_options(stream_results=True)
+            result = connection.execute(db.select(columns).order_by(
+                *table.primary_key.columns))
+            count = 0
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    data = dict((c.name, row[c.name].isoformat()
+                                 if isinstance(row[c.name], datetime)
+                                 else row[c.name]) for c in columns)
+                    f.write(json.dumps({'table': name, 'row': data},
+                                       sort_keys=True) + '\n')
+                count += len(rows)
+            result.close()
+            connection.close()
+            exported[name] = count
+            if progress is not None:
+                progress(name, count)
+    return exported
+
+
+def import_data(path, chunk_size=1000, progress=None):
+    """从 path 导入到空的数据库，返回每个表导入的行数。表中已有数据时抛出 ValueError"""
+    tables = dict((name, db.metadata.tables[name]) for name in TABLES)
+    dates = dict((name, [c.name for c in table.c
+                         if isinstance(c.type, db.DateTime)])
+                 for name, table in tables.items())
+    imported = dict((name, 0) for name in TABLES)
+    # 主库和归档库各用一个事务，任何一行出错时两边都回滚
+    with _open(path, 'r') as f, db.engine.begin() as connection, \
+            db.get_engine(bind='archive').begin() as archive:
+        connections = dict((name, archive if _bind(name) == 'archive'
+                            else connection) for name in TABLES)
+        occupied = [name for name in TABLES if connections[name].execute(
+            db.select([tables[name]]).limit(1)).first() is not None]
+        if occupied:
+            raise ValueError('Tables are not empty: %s' % ', '.join(occupied))
+
+        def insert(name, rows):
+            connections[name].execute(tables[name].insert(), rows)
+            imported[name] += len(rows)
+            if progress is not None:
+                progress(name, imported[name])
+
+        current, rows = None, []
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            name, row = record['table'], record['row']
+            if name not in tables:
+                raise ValueError('Unknown table %r' % name)
+            if rows and (name != current or len(rows) >= chunk_size):
+                insert(current, rows)
+                rows = []
+            current = name
+            for column in dates[name]:
+                if row.get(column):
+                    row[column] = _parse_datetime(row[column])
+            # 旧版本导出的评论 disabled 可能为空
+            if name in ('comments', 'archived_comments') and \
+                    row.get('disabled') is None:
+                row['disabled'] = False
+            rows.append(row)
+        if rows:
+            insert(current, rows)
+    render_html(chunk_size)
+    # 导入绕过了模型事件，清空缓存
+    follow_graph.clear()
+    cache.clear()
+    return imported
+
+
+def render_html(chunk_size=1000):
+    """为 body_html 为空的文章和评论（包括归档的）生成 HTML，返回处理的行数"""
+    rendered = 0
+    for model, render in ((Post, Post.render_body),
+                          (Comment, Comment.render_body),
+                          (ArchivedPost, Post.render_body),
+                          (ArchivedComment, Comment.render_body)):
+        table = model.__table__
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select([table.c.id, table.c.body])
+                .where(table.c.body_html.is_(None))
+                .where(table.c.id > last_id)
+                .order_by(table.c.id).limit(chunk_size),
+                mapper=model.__mapper__).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            values = [{'_id': id, '_html': render(body)}
+                      for id, body in rows if body is not None]
+            if values:
+                db.session.execute(
+                    table.update().where(table.c.id == db.bindparam('_id'))
+                    .values(body_html=db.bindparam('_html')), values,
+                    mapper=model.__mapper__)
+                db.session.commit()
+            rendered += len(rows)
+    return rendered
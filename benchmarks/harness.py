@@ -0,0 +1,258 @@
+# 端点基准测试
+# 在单独的 SQLite 数据库中生成固定的测试数据（同一个 seed 每次生成的数据相同），
+# 用 Flask 测试客户端（或本地 WSGI 服务器加并发客户端）请求各个端点，
+# 统计吞吐量、p50/p95/p99 延迟和每个请求的 SQL 语句数（取自 Server-Timing 响应头），
+# 结果写入 JSON 文件，并可以与保存的基准结果比较
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.cookiejar import CookieJar
+from urllib.parse import urlencode
+from urllib.request import build_opener, HTTPCookieProcessor
+from urllib.error import HTTPError
+from werkzeug.security import generate_password_hash
+from app import create_app, db, page_cache
+from app.models import User, Role, Post, Comment, Follow
+
+# (名称, 路径, 是否需要以管理员身份登录)
+SCENARIOS = [
+    ('index', '/', False),
+    ('user', '/user/user1', False),
+    ('post', '/post/1', False),
+    ('post_last_page', '/post/1?page=-1', False),
+    ('followers', '/followers/user1', False),
+    ('moderate', '/moderate', True),
+    ('api_posts', '/api/V1.0/posts/', False),
+    ('api_post', '/api/V1.0/posts/1', False),
+    ('api_user_posts', '/api/V1.0/users/2/posts/', False),
+    ('api_timeline', '/api/V1.0/users/2/timeline/', False),
+    ('api_post_comments', '/api/V1.0/posts/1/comments/', False),
+]
+
+ADMIN_PASSWORD = 'admin'
+
+
+def create_bench_app(database_url=None):
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url or \
+        'sqlite:///' + os.path.join(tempfile.gettempdir(), 'flasky-bench.sqlite')
+    app.config['SQLALCHEMY_BINDS'] = {'archive': 'sqlite:///' + os.path.join(
+        tempfile.gettempdir(), 'flasky-bench-archive.sqlite')}
+    app.config['WTF_CSRF_ENABLED'] = False
+    # 测量视图本身，不使用匿名访客的整页缓存：通过配置关闭后重新初始化扩展
+    app.config['FLASKY_PAGE_CACHE'] = False
+    page_cache.init_app(app)
+    return app
+
+
+def seed(users=50, posts=500, comments=2000, follows_per_user=10, seed=42):
+    """生成测试数据，user1 是管理员，1 号文章的评论最多"""
+    rng = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+    Role.insert_roles()
+    password_hash = generate_password_hash(ADMIN_PASSWORD)
+    roles = dict((r.name, r.id) for r in Role.query)
+    start = datetime(2017, 1, 1)
+    db.session.execute(User.__table__.insert(), [
+        {'email': 'user%d@example.com' % i, 'username': 'user%d' % i,
+         'password_hash': password_hash, 'confirmed': True,
+         'role_id': roles['Administrator' if i == 1 else 'User'],
+         'member_since': start, 'last_seen': start}
+        for i in range(1, users + 1)])
+    db.session.commit()
+    User.add_self_follows()
+    pairs = set()
+    for follower in range(1, users + 1):
+        for followed in rng.sample(range(1, users + 1),
+                                   min(follows_per_user, users)):
+            if followed != follower:
+                pairs.add((follower, followed))
+    db.session.execute(Follow.__table__.insert(), [
+        {'follower_id': a, 'followed_id': b, 'timestamp': start}
+        for a, b in sorted(pairs)])
+    db.session.commit()
+    for i in range(posts):
+        db.session.add(Post(body='Post **%d** %s' % (i, 'lorem ipsum ' * rng.randint(1, 20)),
+                            timestamp=start + timedelta(minutes=i),
+                            author_id=rng.randint(1, users)))
+    db.session.commit()
+    for i in range(comments):
+        # 一半的评论集中在 1 号文章上
+        post_id = 1 if i % 2 == 0 else rng.randint(1, posts)
+        db.session.add(Comment(body='Comment *%d*' % i,
+                               timestamp=start + timedelta(minutes=i),
+                               post_id=post_id,
+                               author_id=rng.randint(1, users)))
+    db.session.commit()
+    Post.reconcile_comment_counts()
+    User.query.update({User.recommendations_stale: False})
+    db.session.commit()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100.0
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def db_count(headers):
+    for entry in (headers.get('Server-Timing') or '').split(','):
+        params = entry.strip().split(';')
+        if params[0] == 'db':
+            for param in params[1:]:
+                if param.startswith('count='):
+                    return int(param[6:])
+    return 0
+
+
+def summarize(latencies, queries, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'queries_per_request': sum(queries) / float(len(queries))
+        if queries else 0.0,
+    }
+
+
+def run_client(app, requests, warmup=5):
+    """用 Flask 测试客户端顺序请求"""
+    anonymous = app.test_client()
+    admin = app.test_client()
+    admin.post('/auth/login', data={'email': 'user1@example.com',
+                                    'password': ADMIN_PASSWORD})
+    results = {}
+    for name, path, login in SCENARIOS:
+        client = admin if login else anonymous
+        for i in range(warmup):
+            client.get(path)
+        latencies, queries, errors = [], [], 0
+        begin = time.perf_counter()
+        for i in range(requests):
+            start = time.perf_counter()
+            response = client.get(path)
+            latencies.append(time.perf_counter() - start)
+            queries.append(db_count(response.headers))
+            if response.status_code >= 400:
+                errors += 1
+        results[name] = summarize(latencies, queries, errors,
+                                  time.perf_counter() - begin)
+    return results
+
+
+def run_server(app, requests, concurrency, warmup=5):
+    """启动本地多线程 WSGI 服务器，用 concurrency 个客户端并发请求"""
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base = 'http://127.0.0.1:%d' % server.server_port
+    local = threading.local()
+
+    def opener(login):
+        key = 'admin' if login else 'anonymous'
+        if not hasattr(local, key):
+            o = build_opener(HTTPCookieProcessor(CookieJar()))
+            if login:
+                o.open(base + '/auth/login', urlencode({
+                    'email': 'user1@example.com',
+                    'password': ADMIN_PASSWORD}).encode()).read()
+            setattr(local, key, o)
+        return getattr(local, key)
+
+    def fetch(path, login):
+        start = time.perf_counter()
+        try:
+            response = opener(login).open(base + path)
+            response.read()
+            status, headers = response.status, response.headers
+        except HTTPError as e:
+            status, headers = e.code, e.headers
+        return time.perf_counter() - start, db_count(headers), status
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for name, path, login in SCENARIOS:
+                list(executor.map(lambda i: fetch(path, login), range(warmup)))
+                begin = time.perf_counter()
+                samples = list(executor.map(lambda i: fetch(path, login),
+                                            range(requests)))
+                results[name] = summarize(
+                    [s[0] for s in samples], [s[1] for s in samples],
+                    sum(1 for s in samples if s[2] >= 400),
+                    time.perf_counter() - begin)
+    finally:
+        server.shutdown()
+    return results
+
+
+def compare(results, baseline, threshold=0.1):
+    """和基准结果比较，返回 (场景, 指标, 基准值, 当前值, 变化比例) 的列表，只包含变差超过阈值的项"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'queries_per_request'):
+            if previous[metric] and \
+                    current[metric] > previous[metric] * (1 + threshold):
+                regressions.append((name, metric, previous[metric],
+                                    current[metric],
+                                    current[metric] / previous[metric] - 1))
+        if previous['throughput'] and \
+                current['throughput'] < previous['throughput'] * (1 - threshold):
+            regressions.append((name, 'throughput', previous['throughput'],
+                                current['throughput'],
+                                current['throughput'] / previous['throughput'] - 1))
+    return regressions
+
+
+def run(requests=100, concurrency=0, database_url=None, seed_options=None):
+    app = create_bench_app(database_url)
+    with app.app_context():
+        seed(**(seed_options or {}))
+        if concurrency:
+            results = run_server(app, requests, concurrency)
+        else:
+            results = run_client(app, requests)
+    return {'timestamp': datetime.utcnow().isoformat(),
+            'requests': requests, 'concurrency': concurrency,
+            'results': results}
+
+
+def format_report(report, regressions=()):
+    lines = ['%-20s %10s %9s %9s %9s %8s %7s' % (
+        'scenario', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'errors')]
+    for name, r in sorted(report['results'].items()):
+        lines.append('%-20s %10.1f %9.2f %9.2f %9.2f %8.1f %7d' % (
+            name, r['throughput'], r['p50_ms'], r['p95_ms'], r['p99_ms'],
+            r['queries_per_request'], r['errors']))
+    for name, metric, before, after, change in regressions:
+        lines.append('REGRESSION %s %s: %.2f -> %.2f (%+.0f%%)' % (
+            name, metric, before, after, change * 100))
+    return '\n'.join(lines)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
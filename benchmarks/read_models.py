@@ -0,0 +1,95 @@
+# 列表页面的只读模型和 ORM 实例的比较
+# 在基准测试的数据库中分别用 ORM 实例和 app/read_models.py 的只读模型读取 100 行的
+# 文章、评论和关注者列表，并读取模板用到的字段（包括作者），统计每页的 CPU 时间、
+# 页面数据仍然存活时的内存占用和内存峰值（tracemalloc）
+import gc
+import time
+import tracemalloc
+from app import db
+from app.models import Post, Comment, Follow
+from app.read_models import PostSummary, CommentSummary, FollowSummary
+from .harness import create_bench_app, seed
+
+ROWS = 100
+
+
+def _touch_posts(posts):
+    for post in posts:
+        (post.id, post.body_html, post.timestamp, post.comment_count,
+         post.author_id, post.author.username, post.author.gravatar(size=40))
+
+
+def _touch_comments(comments):
+    for comment in comments:
+        (comment.id, comment.body_html, comment.timestamp, comment.disabled,
+         comment.author.username, comment.author.gravatar(size=40))
+
+
+def _touch_follows(follows):
+    for follow in follows:
+        (follow['user'] if isinstance(follow, dict) else follow.user).gravatar(
+            size=32)
+
+
+# (名称, 查询, ORM 的读取方式, 只读模型的读取方式, 模板读取的字段)
+CASES = [
+    ('posts', lambda: Post.query.order_by(Post.timestamp.desc()).limit(ROWS),
+     lambda query: query.all(), PostSummary.load, _touch_posts),
+    ('comments', lambda: Comment.query.filter_by(post_id=1)
+     .order_by(Comment.timestamp.asc()).limit(ROWS),
+     lambda query: query.all(), CommentSummary.load, _touch_comments),
+    # 修改前的关注者页面把每行转换成 {'user': ..., 'timestamp': ...}
+    ('followers', lambda: Follow.query.limit(ROWS),
+     lambda query: [{'user': item.follower, 'timestamp': item.timestamp}
+                    for item in query],
+     FollowSummary.followers, _touch_follows),
+]
+
+
+def measure(query, load, touch, runs):
+    """返回每页的 CPU 时间（毫秒）、存活的内存和内存峰值（KB）"""
+    cpu = 0.0
+    for i in range(runs):
+        db.session.remove()
+        start = time.process_time()
+        touch(load(query()))
+        cpu += time.process_time() - start
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    items = load(query())
+    touch(items)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    db.session.remove()
+    return {'cpu_ms': cpu / runs * 1000, 'retained_kb': current / 1024.0,
+            'peak_kb': peak / 1024.0}
+
+
+def run(runs=20, database_url=None):
+    app = create_bench_app(database_url)
+    results = {}
+    with app.app_context():
+        seed()
+        for name, query, orm, summary, touch in CASES:
+            results[name] = {'orm': measure(query, orm, touch, runs),
+                             'read_model': measure(query, summary, touch, runs)}
+    return results
+
+
+def format_report(results):
+    lines = ['%-10s %-10s %8s %12s %9s' % (
+        'list', 'loader', 'cpu ms', 'retained KB', 'peak KB')]
+    for name in sorted(results):
+        for loader in ('orm', 'read_model'):
+            r = results[name][loader]
+            lines.append('%-10s %-10s %8.2f %12.1f %9.1f' % (
+                name, loader, r['cpu_ms'], r['retained_kb'], r['peak_kb']))
+        orm, summary = results[name]['orm'], results[name]['read_model']
+        lines.append('%-10s %-10s %7.0f%% %11.0f%% %8.0f%%' % (
+            name, 'saving',
+            (1 - summary['cpu_ms'] / orm['cpu_ms']) * 100,
+            (1 - summary['retained_kb'] / orm['retained_kb']) * 100,
+            (1 - summary['peak_kb'] / orm['peak_kb']) * 100))
+    return '\n'.join(lines)
@@ -0,0 +1,66 @@
+# 启动耗时分析
+# 在新的解释器中用 -X importtime 导入程序并调用 create_app，汇总各模块的导入耗时；
+# 多次启动新进程测量工作进程的启动时间（导入加 create_app），
+# 并列出启动时仍被导入的延迟加载模块（app/lazy.py），它们出现时说明某处又在启动时导入了它们
+import os
+import subprocess
+import sys
+
+BOOT_CODE = '''
+import time
+start = time.perf_counter()
+from app import create_app
+create_app(%r)
+print(time.perf_counter() - start)
+'''
+
+# 应该在第一次使用时才导入的模块
+DEFERRED = ('flask_mail', 'flask_moment', 'flask_pagedown', 'markdown',
+            'bleach')
+
+
+def _run(args, config_name):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run([sys.executable] + args + ['-c', BOOT_CODE % config_name],
+                          cwd=root, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True,
+                          check=True)
+
+
+def import_times(config_name='default'):
+    """返回 [(模块名, 自身耗时 us, 累计耗时 us, 层级)]，按累计耗时从大到小排序"""
+    result = _run(['-X', 'importtime'], config_name)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        level = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), level))
+    return sorted(modules, key=lambda m: m[2], reverse=True)
+
+
+def boot_times(config_name='default', runs=5):
+    return sorted(float(_run([], config_name).stdout.strip().splitlines()[-1])
+                  for i in range(runs))
+
+
+def report(config_name='default', top=20, runs=5):
+    modules = import_times(config_name)
+    lines = ['Top-level imports by cumulative time:']
+    for name, self_us, cumulative_us, level in \
+            [m for m in modules if m[3] == 0][:top]:
+        lines.append('  %-40s %8.1f ms' % (name, cumulative_us / 1000.0))
+    lines.append('Modules by self time:')
+    for name, self_us, cumulative_us, level in \
+            sorted(modules, key=lambda m: m[1], reverse=True)[:top]:
+        lines.append('  %-40s %8.1f ms' % (name, self_us / 1000.0))
+    loaded = sorted(set(name.split('.')[0] for name, self_us, cumulative_us,
+                        level in modules
+                        if name.split('.')[0] in DEFERRED))
+    lines.append('Deferred modules imported at boot: %s' %
+                 (', '.join(loaded) or 'none'))
+    times = boot_times(config_name, runs)
+    lines.append('Boot time over %d runs: min %.1f ms, median %.1f ms' % (
+        runs, times[0] * 1000, times[len(times) // 2] * 1000))
+    return '\n'.join(lines)
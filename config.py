@@ -19,6 +19,71 @@ class Config:
     FLASKY_POSTS_PER_PAGE = 15  # 每一页显示的文章数量
     FLASKY_FOLLOWERS_PER_PAGE = 10  # 每一页显示的关注者数量
     FLASKY_COMMENTS_PER_PAGE = 10   # 枚一页显示的评论
+    FLASKY_FOLLOW_CACHE_SIZE = 10000    # 关注关系缓存最多保存的用户数
+    FLASKY_FOLLOW_CACHE_TTL = 60    # 关注关系缓存的过期时间，单位为秒
+    FLASKY_RECOMMENDATIONS_TOP_K = 10   # 每个用户保存的推荐关注人数
+    FLASKY_RECOMMENDATIONS_SHOWN = 5    # 页面上显示的推荐关注人数
+    FLASKY_METRICS_ENDPOINT = bool(os.environ.get('FLASKY_METRICS_ENDPOINT'))  # 是否提供 /metrics 端点
+    FLASKY_METRICS_TOKEN = os.environ.get('FLASKY_METRICS_TOKEN')   # 设置后 /metrics 只接受 Authorization: Bearer <token>
+    FLASKY_METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')   # 没有令牌时允许直接访问 /metrics 的地址
+    FLASKY_SLOW_DB_QUERY_TIME = 0.5     # 慢查询阈值，单位为秒
+    FLASKY_SLOW_REQUEST_TIME = 1.0      # 慢请求阈值，单位为秒
+    FLASKY_SLOW_QUERY_SAMPLE_RATE = 1.0     # 慢查询的采样率，1.0 表示全部记录
+    FLASKY_SLOW_QUERY_LOG_SIZE = 1000   # 内存中保存的慢查询条数
+    FLASKY_SLOW_QUERY_LOG_FILE = os.environ.get('FLASKY_SLOW_QUERY_LOG_FILE')   # JSON lines 日志文件，为空时不写文件
+    FLASKY_PROFILER_ENABLED = bool(os.environ.get('FLASKY_PROFILER_ENABLED'))   # 是否允许管理员按请求剖析
+    FLASKY_PROFILE_DIR = os.environ.get('FLASKY_PROFILE_DIR') or \
+        os.path.join(basedir, 'profiles')   # 剖析结果的保存目录
+    FLASKY_PROFILER_INTERVAL = 0.005    # 采样间隔，单位为秒
+    FLASKY_TEMPLATE_CACHE_DIR = os.environ.get('FLASKY_TEMPLATE_CACHE_DIR')     # Jinja 字节码缓存目录，为空时不缓存
+    FLASKY_LIVE_UPDATES = bool(os.environ.get('FLASKY_LIVE_UPDATES'))     # 是否提供 SSE 实时通知，每个连接占用一个工作线程，只在异步工作进程中启用
+    FLASKY_STREAM_MAX_CONNECTIONS = 100     # 每个进程同时打开的 SSE 连接数上限
+    FLASKY_STREAM_QUEUE_SIZE = 50   # 每个 SSE 连接最多缓存的消息数
+    FLASKY_STREAM_HEARTBEAT = 15    # SSE 心跳间隔，单位为秒
+    FLASKY_FINGERPRINT_ASSETS = True    # 存在 manage.py build_assets 生成的 manifest 时使用带指纹的静态文件
+    FLASKY_CACHE_TYPE = os.environ.get('FLASKY_CACHE_TYPE') or 'simple'     # simple（进程内）、sqlite（本机进程共享）或 redis
+    FLASKY_CACHE_SQLITE_PATH = os.environ.get('FLASKY_CACHE_SQLITE_PATH') or \
+        os.path.join(basedir, 'cache', 'cache.sqlite')    # sqlite 后端的数据库文件
+    FLASKY_CACHE_REDIS_URL = os.environ.get('FLASKY_CACHE_REDIS_URL') or \
+        'redis://localhost:6379/0'  # redis 后端的地址
+    FLASKY_CACHE_KEY_PREFIX = 'flasky:'     # redis 后端的键名前缀
+    FLASKY_CACHE_MAX_ENTRIES = 10000    # simple 后端最多保存的缓存项
+    FLASKY_CACHE_DEFAULT_TIMEOUT = 300  # 缓存默认过期时间，单位为秒
+    FLASKY_HOT_HALF_LIFE = 12 * 3600    # 热度的半衰期，单位为秒
+    FLASKY_HOT_POST_WEIGHT = 1.0    # 发表文章、每条评论、每次浏览在热度中的权重
+    FLASKY_HOT_COMMENT_WEIGHT = 1.0
+    FLASKY_HOT_VIEW_WEIGHT = 0.1
+    FLASKY_HOT_VIEW_FLUSH_INTERVAL = 30     # 浏览次数在进程内累计，每隔多少秒写入数据库
+    FLASKY_HOT_REBALANCE_DAYS = 7   # manage.py hot 重新计算最近多少天内活跃的文章
+    FLASKY_ARCHIVE_AFTER_DAYS = 365     # manage.py archive 归档多少天前的文章
+    FLASKY_COUNT_CACHE_TIMEOUT = 3600   # 分页总数的缓存时间，单位为秒
+    FLASKY_EXACT_COUNTS = False     # 为 True 时分页总数每次都执行 COUNT 查询
+    FLASKY_APPROXIMATE_PAGES = False    # 为 True 时总数来自缓存的分页控件显示“约 N 页”
+    FLASKY_POST_CACHE_TIMEOUT = 300     # 文章快照多少秒后刷新，失效由模型事件触发
+    FLASKY_POST_CACHE_LOCK_TIMEOUT = 5  # 快照缺失时其他请求等待查询结果的最长时间，单位为秒
+    FLASKY_GROUP_COMMIT = bool(os.environ.get('FLASKY_GROUP_COMMIT'))     # 新评论和 API 新文章是否分组提交
+    FLASKY_GROUP_COMMIT_INTERVAL = 0.005    # 每组最多等待多少秒
+    FLASKY_GROUP_COMMIT_MAX_BATCH = 100     # 每组最多多少行
+    FLASKY_GROUP_COMMIT_TIMEOUT = 5     # 请求等待提交的最长时间，单位为秒
+    FLASKY_SCHEDULER = bool(os.environ.get('FLASKY_SCHEDULER'))     # 是否在程序进程中运行后台任务调度器
+    FLASKY_SCHEDULER_WORKERS = 2    # 同时执行的任务数
+    FLASKY_SCHEDULER_POLL_INTERVAL = 1  # 检查到期任务的间隔，单位为秒
+    FLASKY_SCHEDULER_LEASE = 3600   # 任务锁的租约，超过后其他进程可以重新执行，单位为秒
+    FLASKY_SCHEDULER_INTERVALS = {}     # 任务名 -> 周期（秒），覆盖 app/jobs.py 中的默认值，None 表示不周期执行
+    FLASKY_PAGE_CACHE = True    # 是否缓存匿名访客的页面
+    FLASKY_PAGE_CACHE_TIMEOUT = 60  # 页面的缓存时间，单位为秒，数据修改时由模型事件失效
+    FLASKY_ADMISSION = bool(os.environ.get('FLASKY_ADMISSION'))     # 是否启用并发数和速率限制
+    FLASKY_ADMISSION_SHARED = False     # 为 True 时速率限制保存在应用缓存中，多个进程共享
+    FLASKY_ADMISSION_QUEUE_TIMEOUT = 0.05   # 并发数已满时最多等待多少秒，超过后返回 503
+    FLASKY_ADMISSION_MAX_CLIENTS = 10000    # 进程内最多保存的令牌桶数，超过时删除已经补满的
+    # 端点或蓝图 -> 限制，见 app/admission.py。获取全部文章和关注的人的文章是 API 中最慢的请求，单独限制并发数
+    FLASKY_ADMISSION_LIMITS = {
+        'api': {'concurrency': 16, 'client_concurrency': 4,
+                'rate': 10, 'burst': 20},
+        'api.get_posts': {'concurrency': 4},
+        'api.get_user_followed_posts': {'concurrency': 4},
+    }
+    FLASKY_BULK_FOLLOW_MAX = 1000   # 批量关注接口一次最多处理的用户数
 
     @staticmethod
     # 执行对当前环境的初始化
@@ -29,19 +94,32 @@ class Config:
 # 定义不同的开发环境
 class DevelopmentConfig(Config):
     DEBUG = True
+    FLASKY_METRICS_ENDPOINT = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
+    # 归档的文章和评论保存在单独的数据库中
+    SQLALCHEMY_BINDS = {'archive': os.environ.get('DEV_ARCHIVE_DATABASE_URL') or
+                        'sqlite:///' + os.path.join(basedir, 'data-dev-archive.sqlite')}
 
 
 class TestingConfig(Config):
     TESTING = True
+    FLASKY_METRICS_ENDPOINT = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
+    SQLALCHEMY_BINDS = {'archive': os.environ.get('TEST_ARCHIVE_DATABASE_URL') or
+                        'sqlite:///' + os.path.join(basedir, 'data-test-archive.sqlite')}
 
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data.sqlite')
+    SQLALCHEMY_BINDS = {'archive': os.environ.get('ARCHIVE_DATABASE_URL') or
+                        'sqlite:///' + os.path.join(basedir, 'data-archive.sqlite')}
+    # 生产环境中模板不会修改，不再检查模板文件是否更新；编译结果缓存在文件中，工作进程重启后直接加载
+    TEMPLATES_AUTO_RELOAD = False
+    FLASKY_TEMPLATE_CACHE_DIR = os.environ.get('FLASKY_TEMPLATE_CACHE_DIR') or \
+        os.path.join(basedir, 'jinja_cache')
 
 
 # 注册不同的开发环境
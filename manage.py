@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 # 用于启动程序
 import os
+import time
 from app import create_app, db
 from app.models import User, Role, Post, Comment
-from flask_script import Manager, Shell
+from flask_script import Manager, Shell, Command, Option
 from flask_migrate import Migrate, MigrateCommand
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
@@ -30,5 +31,271 @@ def test():
     unittest.TextTestRunner(verbosity=2).run(tests)
 
 
+@manager.command
+def insert_roles():
+    """Insert or update the user roles."""
+    Role.insert_roles()
+    print('Roles: %d' % Role.query.count())
+
+
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int,
+                default=1000, help='Number of user ids per batch')
+def add_self_follows(chunk_size):
+    """Add the missing self-follows in batches."""
+    def progress(user_id, inserted):
+        print('users <= %d: %d self-follows added' % (user_id, inserted))
+    inserted = User.add_self_follows(chunk_size=chunk_size, progress=progress)
+    print('Done, %d self-follows added.' % inserted)
+
+
+@manager.command
+def reconcile_counts():
+    """Recompute the cached comment counts of every post."""
+    print('Comment counts updated for %d posts.' %
+          Post.reconcile_comment_counts())
+
+
+@manager.command
+def fill_comment_status():
+    """Mark comments without a status as enabled."""
+    print('%d comments updated.' % Comment.fill_disabled())
+
+
+@manager.command
+def deploy():
+    """Run deployment tasks."""
+    db.create_all()
+    Role.insert_roles()
+    # 按状态过滤评论时不再匹配 NULL，升级旧数据库时先补上状态
+    print('%d comments updated.' % Comment.fill_disabled())
+
+
+@manager.option('-f', '--full', dest='full', action='store_true',
+                help='Rebuild the recommendations of every user')
+@manager.option('-p', '--processes', dest='processes', type=int, default=1,
+                help='Number of worker processes for a full rebuild')
+def recommend(full, processes):
+    """Rebuild the "who to follow" recommendations."""
+    from app.recommend import build_recommendations, refresh_recommendations
+    top_k = app.config['FLASKY_RECOMMENDATIONS_TOP_K']
+    if full:
+        def progress(done, total):
+            print('%d/%d users' % (done, total))
+        count = build_recommendations(top_k=top_k, processes=processes,
+                                      progress=progress)
+    else:
+        count = refresh_recommendations(top_k=top_k)
+    print('Recommendations updated for %d users.' % count)
+
+
+@manager.option('-d', '--days', dest='days', type=int, default=None,
+                help='Recompute posts active in the last DAYS days')
+def hot(days):
+    """Recompute recent hot scores, keeping the recorded views."""
+    from app import hot as hot_scores
+    start = time.time()
+    count = hot_scores.rebalance(
+        days or app.config['FLASKY_HOT_REBALANCE_DAYS'])
+    print('Hot scores updated for %d posts in %.2fs.' %
+          (count, time.time() - start))
+
+
+@manager.option('-d', '--days', dest='days', type=int, default=None,
+                help='Archive posts older than DAYS days')
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int,
+                default=500, help='Number of posts moved per transaction')
+def archive(days, chunk_size):
+    """Move old posts and their comments into the archive tables."""
+    from app.archive import archive_older_than
+
+    def progress(posts, comments):
+        print('%d posts, %d comments' % (posts, comments))
+    posts, comments, elapsed = archive_older_than(
+        days or app.config['FLASKY_ARCHIVE_AFTER_DAYS'], chunk_size, progress)
+    print('Archived %d posts and %d comments in %.2fs.' %
+          (posts, comments, elapsed))
+
+
+@manager.option('-o', '--once', dest='once', action='store_true',
+                help='Run the jobs that are due and exit')
+@manager.option('-l', '--list', dest='list_jobs', action='store_true',
+                help='List the scheduled jobs and exit')
+def worker(once, list_jobs):
+    """Run scheduled background jobs."""
+    from app import scheduler
+    from app.models import Job
+    if list_jobs:
+        for job in Job.query.order_by(Job.next_run_at):
+            print('%-24s next=%s runs=%d failures=%d last=%s%s' % (
+                job.name or '%s#%d' % (job.task, job.id), job.next_run_at,
+                job.runs or 0, job.failures or 0,
+                '%.2fs' % job.last_duration
+                if job.last_duration is not None else '-',
+                ' locked by %s' % job.locked_by if job.locked_by else ''))
+        return
+    scheduler.sync()
+    if once:
+        print('Ran %d jobs.' % scheduler.run_pending())
+        return
+    print('Worker %s running %d jobs at a time.' %
+          (scheduler.worker_id, scheduler.workers))
+    try:
+        scheduler.run_forever(app)
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int,
+                default=1000, help='Number of rows fetched at a time')
+@manager.option('path', help='Output file, gzip compressed if it ends in .gz')
+def export(path, chunk_size):
+    """Export roles, users, follows, posts and comments as NDJSON."""
+    from app.transfer import export_data
+    start = time.time()
+    exported = export_data(path, chunk_size)
+    for name in sorted(exported):
+        print('%s: %d rows' % (name, exported[name]))
+    print('Exported to %s in %.2fs.' % (path, time.time() - start))
+
+
+# import 是关键字，不能作为函数名
+class ImportData(Command):
+    """Import an NDJSON export into an empty database."""
+
+    option_list = (
+        Option('path', help='Input file, gzip compressed if it ends in .gz'),
+        Option('-c', '--chunk-size', dest='chunk_size', type=int,
+               default=1000, help='Number of rows inserted at a time'),
+    )
+
+    def run(self, path, chunk_size):
+        import sys
+        from app.transfer import import_data
+        start = time.time()
+        try:
+            imported = import_data(path, chunk_size)
+        except ValueError as e:
+            print('Import failed: %s' % e)
+            sys.exit(1)
+        for name in sorted(imported):
+            print('%s: %d rows' % (name, imported[name]))
+        print('Imported from %s in %.2fs.' % (path, time.time() - start))
+
+manager.add_command('import', ImportData())
+
+
+@manager.option('-l', '--length', dest='length', type=int, default=25,
+                help='Number of functions to include in the profiler report')
+@manager.option('-d', '--profile-dir', dest='profile_dir', default=None,
+                help='Directory where profiler data files are saved')
+@manager.option('-s', '--sample', dest='sample', action='store_true',
+                help='Write sampled collapsed stacks instead of cProfile data')
+def profile(length, profile_dir, sample):
+    """Start the application under the code profiler."""
+    if sample:
+        from app.profiler import SamplingProfilerMiddleware
+        app.wsgi_app = SamplingProfilerMiddleware(
+            app.wsgi_app, profile_dir or app.config['FLASKY_PROFILE_DIR'],
+            interval=app.config['FLASKY_PROFILER_INTERVAL'])
+    else:
+        from werkzeug.middleware.profiler import ProfilerMiddleware
+        app.wsgi_app = ProfilerMiddleware(app.wsgi_app, restrictions=[length],
+                                          profile_dir=profile_dir)
+    app.run()
+
+
+@manager.option('-n', '--requests', dest='requests', type=int, default=100,
+                help='Requests per endpoint')
+@manager.option('-c', '--concurrency', dest='concurrency', type=int, default=0,
+                help='Concurrent clients against a local WSGI server '
+                     '(0 uses the Flask test client)')
+@manager.option('-o', '--output', dest='output', default='bench.json',
+                help='File the JSON report is written to')
+@manager.option('-b', '--baseline', dest='baseline', default=None,
+                help='Baseline report to compare against')
+@manager.option('-t', '--threshold', dest='threshold', type=float,
+                default=0.1, help='Relative change reported as a regression')
+@manager.option('--database-url', dest='database_url', default=None,
+                help='Scratch database, it is dropped and re-seeded')
+def bench(requests, concurrency, output, baseline, threshold, database_url):
+    """Benchmark the main endpoints against a seeded database."""
+    import sys
+    from benchmarks import harness
+    report = harness.run(requests=requests, concurrency=concurrency,
+                         database_url=database_url)
+    harness.save(report, output)
+    regressions = []
+    if baseline:
+        previous = harness.load(baseline)
+        if previous.get('concurrency') != concurrency:
+            print('Warning: the baseline was run with concurrency %s.' %
+                  previous.get('concurrency'))
+        regressions = harness.compare(report['results'], previous, threshold)
+    print(harness.format_report(report, regressions))
+    if regressions:
+        sys.exit(1)
+
+
+@manager.option('-r', '--runs', dest='runs', type=int, default=20,
+                help='Pages loaded per list and loader')
+@manager.option('--database-url', dest='database_url', default=None,
+                help='Scratch database, it is dropped and re-seeded')
+def bench_lists(runs, database_url):
+    """Compare ORM instances and read models on 100-row lists."""
+    from benchmarks import read_models
+    print(read_models.format_report(
+        read_models.run(runs=runs, database_url=database_url)))
+
+
+@manager.option('-n', '--top', dest='top', type=int, default=20,
+                help='Number of modules to list')
+@manager.option('-r', '--runs', dest='runs', type=int, default=5,
+                help='Number of fresh interpreters used to time the boot')
+def importtime(top, runs):
+    """Report module import times and worker boot time."""
+    from benchmarks.startup import report
+    print(report(os.getenv('FLASK_CONFIG') or 'default', top=top, runs=runs))
+
+
+def compile_templates():
+    """Compile every template into the bytecode cache."""
+    from jinja2 import TemplateSyntaxError
+    if app.jinja_env.bytecode_cache is None:
+        print('FLASKY_TEMPLATE_CACHE_DIR is not set, nothing to do.')
+        return
+    compiled = 0
+    for name in app.jinja_env.list_templates():
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except TemplateSyntaxError as e:
+            print('%s: %s' % (name, e))
+    print('%d templates compiled into %s.' % (
+        compiled, app.config['FLASKY_TEMPLATE_CACHE_DIR']))
+
+manager.add_command('compile-templates', Command(compile_templates))
+
+
+@manager.command
+def build_assets():
+    """Fingerprint and precompress the static files."""
+    from app.assets import build
+    manifest = build(app.static_folder)
+    for filename in sorted(manifest):
+        print('%s -> %s' % (filename, manifest[filename]))
+    print('Restart the application to serve the new files.')
+
+
+@manager.option('-d', '--days', dest='days', type=int, default=7,
+                help='Keep old files generated in the last DAYS days')
+def prune_assets(days):
+    """Delete fingerprinted files that are no longer in the manifest."""
+    from app.assets import prune
+    removed = prune(app.static_folder, days)
+    for filename in removed:
+        print(filename)
+    print('%d files removed.' % len(removed))
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,84 @@
+import unittest
+from base64 import b64encode
+from app import create_app, db, admission, metrics
+from app.models import Role, User
+
+
+class AdmissionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_ADMISSION'] = True
+        self.app.config['FLASKY_ADMISSION_LIMITS'] = {
+            'api': {'rate': 1, 'burst': 2},
+            'api.get_posts': {'concurrency': 1, 'queue_timeout': 0},
+        }
+        admission.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, url, addr='10.0.0.1', username=None, password=''):
+        headers = {'Accept': 'application/json'}
+        if username is not None:
+            headers['Authorization'] = 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8')
+        return self.client.get(url, headers=headers,
+                               environ_base={'REMOTE_ADDR': addr})
+
+    def test_rate_limit(self):
+        self.assertTrue(self.get('/api/V1.0/posts/hot/').status_code == 200)
+        self.assertTrue(self.get('/api/V1.0/posts/hot/').status_code == 200)
+        response = self.get('/api/V1.0/posts/hot/')
+        self.assertTrue(response.status_code == 429)
+        self.assertTrue(response.headers['Retry-After'] == '1')
+        # 其他客户端和不受限制的端点不受影响
+        self.assertTrue(self.get('/api/V1.0/posts/hot/',
+                                 addr='10.0.0.2').status_code == 200)
+        self.assertTrue(self.get('/hot').status_code == 200)
+        self.assertTrue('flasky_admission_shed_total{endpoint="api.get_hot_posts",'
+                        'reason="rate"} 1' in metrics.render())
+
+    def test_rate_limit_ignores_unverified_username(self):
+        # 每次换一个用户名也不能得到新的令牌桶
+        for i in range(2):
+            response = self.get('/api/V1.0/posts/hot/',
+                                username='user%d@example.com' % i)
+            self.assertTrue(response.status_code == 401)
+        response = self.get('/api/V1.0/posts/hot/',
+                            username='user2@example.com')
+        self.assertTrue(response.status_code == 429)
+
+    def test_rate_limit_per_user(self):
+        u = User(email='john@example.com', password='cat', confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        for addr in ('10.0.0.3', '10.0.0.4'):
+            response = self.get('/api/V1.0/posts/hot/', addr=addr,
+                                username='john@example.com', password='cat')
+            self.assertTrue(response.status_code == 200)
+        # 验证过的用户换 IP 地址仍然受限制
+        response = self.get('/api/V1.0/posts/hot/', addr='10.0.0.5',
+                            username='john@example.com', password='cat')
+        self.assertTrue(response.status_code == 429)
+
+    def test_concurrency_limit(self):
+        rule = admission.rules['api.get_posts']
+        rule.semaphore.acquire()
+        try:
+            response = self.get('/api/V1.0/posts/')
+            self.assertTrue(response.status_code == 503)
+            self.assertTrue('Retry-After' in response.headers)
+        finally:
+            rule.semaphore.release()
+        # 拒绝的请求归还了已经取得的名额
+        self.assertTrue(self.get('/api/V1.0/posts/',
+                                 addr='10.0.0.2').status_code == 200)
+        rule.semaphore.acquire()
+        rule.semaphore.release()
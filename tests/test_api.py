@@ -0,0 +1,96 @@
+import json
+import unittest
+from base64 import b64encode
+from unittest import mock
+from sqlalchemy.exc import IntegrityError
+from app import create_app, db, cache
+from app.models import User, Role, Follow
+
+
+class APITestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        cache.clear()
+        self.client = self.app.test_client()
+        self.john = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        self.susan = User(email='susan@example.com', username='susan',
+                          password='dog', confirmed=True)
+        self.david = User(email='david@example.com', username='david',
+                          password='dog', confirmed=True)
+        db.session.add_all([self.john, self.susan, self.david])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_api_headers(self, username, password):
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def update_follows(self, data):
+        response = self.client.post(
+            '/api/V1.0/follows/',
+            headers=self.get_api_headers('john@example.com', 'cat'),
+            data=json.dumps(data))
+        return response, json.loads(response.get_data(as_text=True))
+
+    def test_update_follows(self):
+        response, json_response = self.update_follows(
+            {'follow': ['susan', self.david.id, 'nobody']})
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(json_response['followed']) == 2)
+        self.assertTrue(json_response['not_found'] == ['nobody'])
+        self.assertTrue(json_response['followed_count'] == 2)
+        response, json_response = self.update_follows(
+            {'follow': ['susan'], 'unfollow': ['david']})
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(json_response['followed'] == [])
+        self.assertTrue(json_response['unfollowed'] ==
+                        ['http://localhost/api/V1.0/users/%d' % self.david.id])
+        db.session.expire_all()
+        self.assertTrue(self.john.is_following(self.susan))
+        self.assertFalse(self.john.is_following(self.david))
+
+    def test_update_follows_validation(self):
+        for data in ({'follow': 'susan'}, {'unfollow': [1.5]},
+                     {'follow': [True]}, ['susan'],
+                     {'follow': ['susan'], 'unfollow': [self.susan.id]}):
+            response, json_response = self.update_follows(data)
+            self.assertTrue(response.status_code == 400)
+            self.assertTrue(json_response['error'] == 'bad request')
+        self.app.config['FLASKY_BULK_FOLLOW_MAX'] = 2
+        response, json_response = self.update_follows(
+            {'follow': ['susan', 'david'], 'unfollow': ['nobody']})
+        self.assertTrue(response.status_code == 400)
+        self.assertTrue(Follow.query.count() == 3)  # 只有关注自己
+
+    def test_update_follows_conflict(self):
+        error = IntegrityError('INSERT INTO follows', {}, Exception())
+        with mock.patch.object(User, 'update_follows', side_effect=error):
+            response, json_response = self.update_follows(
+                {'follow': ['susan']})
+        self.assertTrue(response.status_code == 409)
+        self.assertTrue(json_response['error'] == 'conflict')
+        self.assertFalse(self.john.is_following(self.susan))
+
+    def test_update_follows_invalidates_pages(self):
+        url = '/user/susan'
+        self.assertTrue(self.client.get(url).headers['X-Cache'] == 'MISS')
+        self.assertTrue(self.client.get(url).headers['X-Cache'] == 'HIT')
+        cache.set('profile', 'cached', tags=['user:%d' % self.susan.id])
+        cache.set('other', 'cached', tags=['user:%d' % self.david.id])
+        self.update_follows({'follow': ['susan']})
+        self.assertTrue(cache.get('profile') is None)
+        self.assertTrue(cache.get('other') == 'cached')
+        self.assertTrue(self.client.get(url).headers['X-Cache'] == 'MISS')
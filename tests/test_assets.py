@@ -0,0 +1,68 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from flask import Flask, url_for
+from app.assets import build, prune, StaticAssets
+
+
+class AssetsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        with open(os.path.join(self.static, 'styles.css'), 'w') as f:
+            f.write('body { color: red; }')
+
+    def tearDown(self):
+        shutil.rmtree(self.static)
+
+    def test_build_fingerprints_and_compresses(self):
+        manifest = build(self.static)
+        fingerprinted = manifest['styles.css']
+        self.assertTrue(fingerprinted.startswith('dist/styles.'))
+        self.assertTrue(os.path.exists(os.path.join(self.static, fingerprinted)))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.static, fingerprinted + '.gz')))
+        # 内容不变时指纹不变，并且不会把 dist 目录再次加入 manifest
+        self.assertTrue(build(self.static) == manifest)
+
+    def test_rebuild_keeps_old_files(self):
+        old = build(self.static)['styles.css']
+        with open(os.path.join(self.static, 'styles.css'), 'w') as f:
+            f.write('body { color: blue; }')
+        new = build(self.static)['styles.css']
+        self.assertTrue(new != old)
+        self.assertTrue(os.path.exists(os.path.join(self.static, old)))
+        # 刚生成过的旧文件不会被删除
+        self.assertTrue(prune(self.static, days=1) == [])
+        self.assertTrue(prune(self.static, days=0) == [old, old + '.gz'])
+        self.assertTrue(os.path.exists(os.path.join(self.static, new)))
+
+    def test_fingerprinted_urls_and_headers(self):
+        old = build(self.static)['styles.css']
+        with open(os.path.join(self.static, 'styles.css'), 'w') as f:
+            f.write('body { color: blue; }')
+        manifest = build(self.static)
+        app = Flask(__name__, static_folder=self.static,
+                    static_url_path='/static')
+        StaticAssets(app)
+        with app.test_request_context():
+            url = url_for('static', filename='styles.css')
+        self.assertTrue(url == '/static/' + manifest['styles.css'])
+        client = app.test_client()
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.headers['Content-Encoding'] == 'gzip')
+        self.assertTrue(response.headers['Cache-Control'] ==
+                        'public, max-age=31536000, immutable')
+        self.assertTrue(gzip.decompress(response.data) ==
+                        b'body { color: blue; }')
+        # 旧页面引用的文件仍然可以访问并长期缓存
+        response = client.get('/static/' + old)
+        self.assertTrue(response.data == b'body { color: red; }')
+        self.assertTrue('immutable' in response.headers['Cache-Control'])
+        # 没有指纹的地址使用默认的缓存设置
+        response = client.get('/static/styles.css')
+        self.assertTrue('immutable' not in
+                        response.headers.get('Cache-Control', ''))
+        response.close()
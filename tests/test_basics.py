@@ -22,3 +22,32 @@ class BasicsTestCase(unittest.TestCase):
 
     def test_app_is_testing(self):
         self.assertTrue(current_app.config['TESTING'])
+
+    def test_server_timing_and_metrics(self):
+        client = self.app.test_client()
+        response = client.get('/')
+        self.assertTrue('db;count=' in response.headers['Server-Timing'])
+        response = client.get('/metrics')
+        self.assertTrue(b'flasky_request_duration_seconds_bucket'
+                        b'{endpoint="main.index",le="+Inf"} 1' in response.data)
+
+    def test_metrics_access(self):
+        from app import metrics
+        client = self.app.test_client()
+        remote = {'REMOTE_ADDR': '203.0.113.5'}
+        self.assertTrue(client.get('/metrics', environ_base=remote)
+                        .status_code == 403)
+        # 经过反向代理的请求来自本机，也不允许
+        self.assertTrue(client.get('/metrics', headers={
+            'X-Forwarded-For': '203.0.113.5'}).status_code == 403)
+        metrics.token = 'secret'
+        try:
+            self.assertTrue(client.get('/metrics').status_code == 403)
+            self.assertTrue(client.get('/metrics', environ_base=remote, headers={
+                'Authorization': 'Bearer secret'}).status_code == 200)
+        finally:
+            metrics.token = None
+
+    def test_metrics_disabled_by_default(self):
+        from config import Config
+        self.assertFalse(Config.FLASKY_METRICS_ENDPOINT)
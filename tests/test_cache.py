@@ -0,0 +1,226 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db, cache, hot
+from app.archive import archive_posts
+from app.cache import Cache, LRUBackend, SQLiteBackend, RedisBackend
+from app.models import User, Role, Post, Comment
+
+
+# 代替 Redis 的本地对象，只实现缓存用到的命令
+class FakeRedis(object):
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        if not isinstance(value, bytes):
+            value = str(value).encode()
+        self.data[key] = value
+        return True
+
+    def exists(self, key):
+        return key in self.data
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def incrby(self, key, delta):
+        value = int(self.data.get(key, b'0')) + delta
+        self.data[key] = str(value).encode()
+        return value
+
+    def scan_iter(self, pattern):
+        return [key for key in self.data if key.startswith(pattern[:-1])]
+
+
+class CacheBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def backends(self):
+        return [LRUBackend(), RedisBackend(FakeRedis()),
+                SQLiteBackend(os.path.join(self.directory, 'cache.sqlite'))]
+
+    def test_backends(self):
+        for backend in self.backends():
+            c = Cache()
+            c.backend = backend
+            c.set('a', {'x': 1}, tags=['post:1'])
+            c.set('b', [1, 2], tags=['post:2'])
+            self.assertTrue(c.get('a') == {'x': 1})
+            c.invalidate('post:1')
+            self.assertTrue(c.get('a') is None)
+            self.assertTrue(c.get('b') == [1, 2])
+            self.assertTrue(c.add('lock', 1))
+            self.assertFalse(c.add('lock', 1))
+            self.assertTrue(c.incr('hits') == 1 and c.incr('hits', 2) == 3)
+            self.assertTrue(c.get_counter('hits') == 3)
+            self.assertTrue(c.incr('missing', create=False) is None)
+            self.assertTrue(c.incr('window', timeout=60) == 1 and
+                            c.incr('window', timeout=60) == 2)
+            c.set_counter('total', 10, timeout=60)
+            self.assertTrue(c.incr('total', -1, create=False) == 9)
+            c.clear()
+            self.assertTrue(c.get('b') is None)
+
+    def test_lru_eviction(self):
+        backend = LRUBackend(max_entries=2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertTrue(backend.get('a') == 1 and backend.get('b') is None)
+
+    def test_evicted_tag_does_not_revive_entries(self):
+        c = Cache()
+        c.backend = LRUBackend(max_entries=3)
+        c.invalidate('post:1')
+        c.set('snap', 'v1', tags=['post:1'])
+        c.set('x', 1)
+        c.set('y', 2)
+        # tag:post:1 已被淘汰，重新创建的版本号和 snap 记录的不同
+        self.assertTrue(c.backend.get('tag:post:1') is None)
+        c.invalidate('post:1')
+        self.assertTrue(c.get('snap') is None)
+        # 从未失效过的标签被淘汰后同样不会让旧缓存项重新有效
+        for backend in self.backends():
+            c.backend = backend
+            c.set('page', 'old', tags=['posts'])
+            c.invalidate('posts')
+            c.set('page', 'older', tags=['posts'], versions={'posts': 0})
+            backend.delete('tag:posts')
+            self.assertTrue(c.get('page') is None)
+
+    def test_lru_add_and_incr_respect_limit(self):
+        backend = LRUBackend(max_entries=2)
+        backend.add('a', 1)
+        backend.add('b', 2)
+        backend.add('c', 3)
+        self.assertTrue(len(backend._data) == 2)
+        backend.incr('b')
+        backend.set('d', 4)
+        # incr 把 b 移到最近使用的一端
+        self.assertTrue(backend.get('b') == 3 and backend.get('c') is None)
+
+    def test_sqlite_shared_between_instances(self):
+        path = os.path.join(self.directory, 'cache.sqlite')
+        first, second = Cache(), Cache()
+        first.backend, second.backend = SQLiteBackend(path), SQLiteBackend(path)
+        first.set('page', 'html', tags=['posts'])
+        self.assertTrue(second.get('page') == 'html')
+        second.invalidate('posts')
+        self.assertTrue(first.get('page') is None)
+
+    def test_sqlite_prune(self):
+        backend = SQLiteBackend(os.path.join(self.directory, 'cache.sqlite'),
+                                max_entries=10, prune_every=5)
+        for i in range(100):
+            backend.set('key%d' % i, i, timeout=60 + i)
+        count = backend._connection().execute(
+            'SELECT count(*) FROM cache').fetchone()[0]
+        self.assertTrue(count <= 10 + 5)
+        # 留下的是最晚过期的
+        self.assertTrue(backend.get('key99') == 99)
+        self.assertTrue(backend.get('key0') is None)
+
+
+class CacheInvalidationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_model_events(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        p = Post(body='post', author=u)
+        db.session.add(p)
+        db.session.commit()
+        cache.set('post', 'cached', tags=['post:%s' % p.id])
+        cache.set('index', 'cached', tags=['posts'])
+        cache.set('profile', 'cached', tags=['user:%s' % u.id])
+        u.ping()
+        db.session.commit()
+        self.assertTrue(cache.get('profile') == 'cached')
+        # 回滚的修改不失效缓存
+        db.session.add(Comment(body='comment', post=p, author=u))
+        db.session.flush()
+        db.session.rollback()
+        self.assertTrue(cache.get('post') == 'cached')
+        db.session.add(Comment(body='comment', post=p, author=u))
+        db.session.commit()
+        self.assertTrue(cache.get('post') is None)
+        self.assertTrue(cache.get('index') == 'cached')
+        u.about_me = 'hello'
+        db.session.add(u)
+        db.session.commit()
+        self.assertTrue(cache.get('profile') is None)
+        db.session.add(Post(body='another', author=u))
+        db.session.commit()
+        self.assertTrue(cache.get('index') is None)
+
+    def test_page_cache(self):
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True)
+        p = Post(body='post', author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+        client = self.app.test_client()
+        url = '/post/%d' % p.id
+        self.assertTrue(client.get(url).headers['X-Cache'] == 'MISS')
+        response = client.get(url)
+        self.assertTrue(response.headers['X-Cache'] == 'HIT')
+        self.assertTrue('Set-Cookie' not in response.headers)
+        # 新评论在提交后失效文章页
+        db.session.add(Comment(body='new comment', post=p, author=u))
+        db.session.commit()
+        response = client.get(url)
+        self.assertTrue(response.headers['X-Cache'] == 'MISS')
+        self.assertTrue(b'new comment' in response.data)
+        # 带会话 cookie 的请求不使用缓存
+        client.post('/auth/login', data={'email': 'john@example.com',
+                                         'password': 'cat'})
+        self.assertTrue('X-Cache' not in client.get(url).headers)
+
+    def test_page_cache_views(self):
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True)
+        old = Post(body='old', author=u,
+                   timestamp=datetime.utcnow() - timedelta(days=30))
+        db.session.add_all([u, old, Post(body='new', author=u)])
+        db.session.commit()
+        live_id = Post.query.filter_by(body='new').one().id
+        old_id = old.id
+        archive_posts(datetime.utcnow() - timedelta(days=7))
+        hot.flush()
+        client = self.app.test_client()
+        for i in range(2):
+            client.get('/post/%d' % live_id)
+            response = client.get('/post/%d' % old_id)
+        self.assertTrue(response.headers['X-Cache'] == 'HIT')
+        # 命中时只在进程内累计浏览，归档的文章不统计
+        self.assertTrue(hot._views == {live_id: 2})
+        hot.flush()
@@ -0,0 +1,99 @@
+import unittest
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+
+
+class ModerationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        moderator = Role.query.filter_by(name='Moderator').first()
+        self.moderator = User(email='mod@example.com', username='mod',
+                              password='cat', confirmed=True, role=moderator)
+        self.john = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        self.susan = User(email='susan@example.com', username='susan',
+                          password='dog', confirmed=True)
+        self.post = Post(body='post', author=self.john)
+        self.other = Post(body='other', author=self.susan)
+        db.session.add_all([self.moderator, self.john, self.susan, self.post,
+                            self.other])
+        db.session.commit()
+        self.comments = [
+            Comment(body='by john', post=self.post, author=self.john),
+            Comment(body='by susan', post=self.post, author=self.susan),
+            Comment(body='by john elsewhere', post=self.other,
+                    author=self.john, disabled=True)]
+        db.session.add_all(self.comments)
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, email, password):
+        self.client.post('/auth/login', data={'email': email,
+                                              'password': password})
+
+    def listed(self, **args):
+        response = self.client.get('/moderate', query_string=args)
+        self.assertEqual(response.status_code, 200)
+        return set(c.body for c in self.comments
+                   if ('name="ids" value="%d"' % c.id).encode()
+                   in response.data)
+
+    def test_disabled_is_not_nullable(self):
+        c = Comment(body='new', post=self.post, author=self.john)
+        db.session.add(c)
+        db.session.commit()
+        self.assertTrue(c.disabled is False)
+        self.assertFalse(Comment.__table__.c.disabled.nullable)
+
+    def test_filters(self):
+        self.login('mod@example.com', 'cat')
+        self.assertEqual(self.listed(), set(
+            ['by john', 'by susan', 'by john elsewhere']))
+        self.assertEqual(self.listed(status='enabled'),
+                         set(['by john', 'by susan']))
+        self.assertEqual(self.listed(status='disabled'),
+                         set(['by john elsewhere']))
+        self.assertEqual(self.listed(author='john'),
+                         set(['by john', 'by john elsewhere']))
+        self.assertEqual(self.listed(post=self.post.id),
+                         set(['by john', 'by susan']))
+        self.assertEqual(self.listed(author='john', status='enabled'),
+                         set(['by john']))
+        response = self.client.get('/moderate?author=nobody')
+        self.assertEqual(response.status_code, 302)
+
+    def test_bulk_disable_and_enable(self):
+        self.login('mod@example.com', 'cat')
+        ids = [str(self.comments[0].id), str(self.comments[1].id)]
+        response = self.client.post('/moderate/bulk',
+                                    data={'ids': ids, 'disable': 'Disable'})
+        self.assertEqual(response.status_code, 302)
+        db.session.expire_all()
+        self.assertEqual([c.disabled for c in self.comments],
+                         [True, True, True])
+        # 过滤出的作者的全部评论
+        self.client.post('/moderate/bulk?author=john',
+                         data={'all_by_author': 'y', 'enable': 'Enable'})
+        db.session.expire_all()
+        self.assertEqual([c.disabled for c in self.comments],
+                         [False, True, False])
+
+    def test_bulk_requires_permission(self):
+        self.login('john@example.com', 'cat')
+        response = self.client.post(
+            '/moderate/bulk', data={'ids': [str(self.comments[0].id)],
+                                    'disable': 'Disable'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get('/moderate').status_code, 403)
+        db.session.expire_all()
+        self.assertFalse(self.comments[0].disabled)
@@ -0,0 +1,348 @@
+from datetime import datetime, timedelta
+import time
+import unittest
+from app import create_app, db, hot, cache, counts, post_cache
+from app.models import User, Role, Post, Comment, ArchivedPost, \
+    ArchivedComment
+from app.archive import archive_posts
+from app.group_commit import GroupCommitter
+from app.exceptions import CommitTimeout
+from app.read_models import PostSummary, CommentSummary
+
+
+class PostModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', password='cat')
+        self.post = Post(body='post', author=self.user)
+        db.session.add_all([self.user, self.post])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_comments(self, count):
+        for i in range(count):
+            db.session.add(Comment(body=str(i), post=self.post,
+                                   author=self.user))
+        db.session.commit()
+
+    def test_comment_count(self):
+        self.add_comments(3)
+        self.assertTrue(self.post.comment_count == 3)
+        db.session.delete(self.post.comments.first())
+        db.session.commit()
+        self.assertTrue(self.post.comment_count == 2)
+        Post.query.update({Post.comment_count: 0})
+        Post.reconcile_comment_counts()
+        self.assertTrue(self.post.comment_count == 2)
+
+    def test_paginate_comments(self):
+        self.add_comments(23)
+        for page in (1, 2, 3):
+            pagination = self.post.paginate_comments(page, 10)
+            self.assertTrue(pagination.pages == 3)
+            self.assertTrue([c.body for c in pagination.items] ==
+                            [str(i) for i in range((page - 1) * 10,
+                                                   min(page * 10, 23))])
+        last = self.post.paginate_comments(-1, 10)
+        self.assertTrue(last.page == 3)
+        self.assertTrue([c.body for c in last.items] == ['20', '21', '22'])
+        self.assertTrue(self.post.paginate_comments(4, 10).items == [])
+        for page in (0, -2):
+            pagination = self.post.paginate_comments(page, 10)
+            self.assertTrue(pagination.page == 1)
+            self.assertTrue([c.body for c in pagination.items] ==
+                            [str(i) for i in range(10)])
+
+    def test_paginate_comments_anchor(self):
+        self.add_comments(35)
+        first = self.post.paginate_comments(1, 10)
+        # 下一页从第一页最后一条评论之后读取，不使用 OFFSET
+        middle = self.post.paginate_comments(2, 10,
+                                             after=first.next_anchor)
+        self.assertTrue(middle.page == 2)
+        self.assertTrue([c.body for c in middle.items] ==
+                        [str(i) for i in range(10, 20)])
+        # 上一页从第三页第一条评论之前倒序读取
+        third = self.post.paginate_comments(3, 10)
+        previous = self.post.paginate_comments(2, 10,
+                                               before=third.prev_anchor)
+        self.assertTrue([c.body for c in previous.items] ==
+                        [c.body for c in middle.items])
+        # 无效的锚点按页码读取
+        self.assertTrue([c.body for c in self.post.paginate_comments(
+            2, 10, after='garbage').items] == [c.body for c in middle.items])
+        # 翻页之间删除了前面的评论，下一页仍然从上一页的最后一条之后开始
+        db.session.delete(first.items[0])
+        db.session.commit()
+        following = self.post.paginate_comments(3, 10,
+                                                after=middle.next_anchor)
+        self.assertTrue([c.body for c in following.items] ==
+                        [str(i) for i in range(20, 30)])
+
+    def test_read_models(self):
+        self.add_comments(3)
+        db.session.add(Post(body='another', author=self.user))
+        db.session.commit()
+        posts = PostSummary.load(Post.query.order_by(Post.id))
+        self.assertTrue([p.body for p in posts] == ['post', 'another'])
+        self.assertTrue(posts[0].comment_count == 3)
+        # 同一个作者共享一个对象
+        self.assertTrue(posts[0].author is posts[1].author)
+        self.assertTrue(posts[0].author.gravatar_hash == self.user.gravatar_hash())
+        last = self.post.paginate_comments(-1, 2, load=CommentSummary.load)
+        self.assertTrue([c.body for c in last.items] == ['2'])
+        self.assertFalse(hasattr(last.items[0], '__dict__'))
+
+    def test_paginate_no_comments(self):
+        pagination = self.post.paginate_comments(-1, 10)
+        self.assertTrue(pagination.page == 1)
+        self.assertTrue(pagination.items == [])
+
+    def test_hot_score(self):
+        old = Post(body='old', author=self.user,
+                   timestamp=datetime.utcnow() - timedelta(days=2))
+        db.session.add(old)
+        db.session.commit()
+        self.assertTrue(self.post.hot_score > old.hot_score)
+        # 评论让旧文章的分数超过没有评论的新文章
+        for i in range(10):
+            db.session.add(Comment(body=str(i), post=old, author=self.user))
+        db.session.commit()
+        db.session.refresh(old)
+        self.assertTrue(old.hot_score > self.post.hot_score)
+        incremental = old.hot_score
+        Post.query.update({Post.hot_score: None})
+        self.assertTrue(hot.rebalance(days=7) == 2)
+        db.session.refresh(old)
+        self.assertAlmostEqual(old.hot_score, incremental, 6)
+        hot.record_view(self.post.id)
+        before = self.post.hot_score
+        self.assertTrue(hot.flush() == 1)
+        db.session.refresh(self.post)
+        self.assertTrue(self.post.hot_score > before)
+        # 重新计算时保留浏览的部分
+        viewed = self.post.hot_score
+        Post.query.update({Post.hot_score: None})
+        hot.rebalance(days=7)
+        db.session.refresh(self.post)
+        self.assertAlmostEqual(self.post.hot_score, viewed, 6)
+        hot_ids = [p.id for p in
+                   Post.query.order_by(Post.hot_score.desc()).limit(1)]
+        self.assertTrue(hot_ids == [old.id])
+
+    def test_archive(self):
+        old = Post(body='old', author=self.user,
+                   timestamp=datetime.utcnow() - timedelta(days=30))
+        active = Post(body='active', author=self.user,
+                      timestamp=datetime.utcnow() - timedelta(days=30))
+        db.session.add_all([old, active])
+        db.session.commit()
+        for i in range(3):
+            db.session.add(Comment(body=str(i), post=old, author=self.user,
+                                   timestamp=old.timestamp))
+        db.session.add(Comment(body='new', post=active, author=self.user))
+        db.session.commit()
+        old_id = old.id
+        # self.post 是新文章，active 有新评论，都不归档
+        self.assertTrue(archive_posts(datetime.utcnow() - timedelta(days=7),
+                                      chunk_size=1) == (1, 3))
+        db.session.remove()
+        self.assertTrue(Post.query.count() == 2)
+        self.assertTrue(Post.query.get(old_id) is None)
+        archived = Post.get_or_archived_404(old_id)
+        self.assertTrue(archived.archived and archived.body == 'old')
+        self.assertTrue(archived.author.email == 'john@example.com')
+        pagination = archived.paginate_comments(-1, 2)
+        self.assertTrue([c.body for c in pagination.items] == ['2'])
+        self.assertTrue(archive_posts(datetime.utcnow() - timedelta(days=7)) ==
+                        (0, 0))
+
+    def test_archive_comment_during_copy(self):
+        from unittest import mock
+        from app import archive
+        old = Post(body='old', author=self.user,
+                   timestamp=datetime.utcnow() - timedelta(days=30))
+        other = Post(body='other', author=self.user,
+                     timestamp=datetime.utcnow() - timedelta(days=30))
+        # id 最大的文章不归档
+        db.session.add_all([old, other, Post(body='new', author=self.user)])
+        db.session.commit()
+        db.session.add(Comment(body='old comment', post=old, author=self.user,
+                               timestamp=old.timestamp))
+        db.session.commit()
+        old_id, other_id = old.id, other.id
+        copy = archive._copy
+
+        # 读取之后、删除之前 old 收到一条新评论
+        def copy_and_comment(rows, table):
+            if table.name == 'archived_posts':
+                db.session.add(Comment(body='late', post_id=old_id,
+                                       author_id=self.user.id))
+                db.session.commit()
+            return copy(rows, table)
+
+        with mock.patch.object(archive, '_copy', copy_and_comment):
+            self.assertTrue(archive_posts(
+                datetime.utcnow() - timedelta(days=7)) == (1, 0))
+        db.session.remove()
+        self.assertTrue(Post.query.get(other_id) is None)
+        # old 和它的两条评论都留在在线的表中，归档库中没有它的副本
+        self.assertTrue(sorted(c.body for c in Post.query.get(old_id).comments)
+                        == ['late', 'old comment'])
+        self.assertTrue(ArchivedPost.query.get(old_id) is None)
+        self.assertTrue(ArchivedComment.query.filter_by(
+            post_id=old_id).count() == 0)
+
+    def test_cached_counts(self):
+        cache.clear()
+        for i in range(4):
+            db.session.add(Post(body=str(i), author=self.user))
+        db.session.commit()
+        query = Post.query.order_by(Post.timestamp.desc())
+        pagination = counts.paginate(query, 1, 2, 'posts')
+        self.assertTrue(pagination.total == 5 and pagination.pages == 3)
+        # 提交后增减缓存的总数，回滚时不变
+        db.session.add(Post(body='new', author=self.user))
+        db.session.commit()
+        db.session.add(Post(body='rolled back', author=self.user))
+        db.session.flush()
+        db.session.rollback()
+        self.assertTrue(cache.get_counter('count:posts') == 6)
+        db.session.delete(Post.query.filter_by(body='new').first())
+        db.session.commit()
+        self.assertTrue(cache.get_counter('count:posts') == 5)
+        c = Comment(body='c', post=self.post, author=self.user)
+        db.session.add(c)
+        db.session.commit()
+        self.assertTrue(counts.paginate(Comment.query, 1, 1,
+                                        'comments:enabled').total == 1)
+        c.disabled = True
+        db.session.add(c)
+        db.session.commit()
+        self.assertTrue(cache.get_counter('count:comments:enabled') == 0)
+
+    def test_post_snapshot_cache(self):
+        cache.clear()
+        snapshot = post_cache.get(self.post.id)
+        self.assertTrue(snapshot.body_html == self.post.body_html)
+        self.assertTrue(snapshot.author.username == self.user.username)
+        self.assertTrue(post_cache.get(self.post.id) is not None)
+        self.assertTrue(post_cache.get(12345) is None)
+        # 新评论让快照失效
+        db.session.add(Comment(body='c', post=self.post, author=self.user))
+        db.session.commit()
+        self.assertTrue(post_cache.get(self.post.id).comment_count == 1)
+        # 快照到期时，其他请求正在刷新则返回旧快照
+        key = post_cache._key(self.post.id)
+        fresh_until, snapshot = cache.get(key)
+        cache.set(key, (0, snapshot), tags=snapshot.tags())
+        cache.add(key + ':lock', 1)
+        self.post.body = 'changed'
+        self.assertTrue(post_cache.get(self.post.id) is snapshot)
+        cache.delete(key + ':lock')
+        db.session.add(self.post)
+        db.session.commit()
+        self.assertTrue(post_cache.get(self.post.id).body == 'changed')
+
+    def test_group_commit(self):
+        committer = GroupCommitter()
+        self.app.config['FLASKY_GROUP_COMMIT_INTERVAL'] = 0.05
+        committer.init_app(self.app)
+        futures = [committer.submit(Comment(body=str(i), post_id=self.post.id,
+                                            author_id=self.user.id))
+                   for i in range(5)]
+        # 主键重复，只有这一行失败
+        futures.append(committer.submit(Comment(id=1, body='duplicate')))
+        ids = [f.result(5) for f in futures[:5]]
+        self.assertTrue(len(set(ids)) == 5)
+        self.assertTrue(futures[-1].exception(5) is not None)
+        db.session.expire_all()
+        self.assertTrue(self.post.comments.count() == 5)
+        self.assertTrue(self.post.comment_count == 5)
+
+    def test_group_commit_timeout(self):
+        from threading import Event
+        committer = GroupCommitter()
+        committer.init_app(self.app)
+        committer.timeout = 0.05
+        release = Event()
+        commit = committer._commit
+
+        # 第一组卡住，后面的对象在队列中等待超时
+        def slow_commit(batch):
+            release.wait(5)
+            commit(batch)
+
+        committer._commit = slow_commit
+        first = committer.submit(Comment(body='first', post_id=self.post.id,
+                                         author_id=self.user.id))
+        time.sleep(0.05)
+        with self.assertRaises(CommitTimeout):
+            committer.add(Comment(body='late', post_id=self.post.id,
+                                  author_id=self.user.id))
+        release.set()
+        first.result(5)
+        # 取消的对象不会在之后写入
+        committer._commit = commit
+        committer.add(Comment(body='after', post_id=self.post.id,
+                              author_id=self.user.id))
+        db.session.expire_all()
+        self.assertTrue(sorted(c.body for c in self.post.comments) ==
+                        ['after', 'first'])
+
+    def test_group_commit_timeout_while_writing(self):
+        from threading import Event
+        committer = GroupCommitter()
+        committer.init_app(self.app)
+        committer.timeout = 0.05
+        release = Event()
+        commit = committer._commit
+
+        def slow_commit(batch):
+            release.wait(5)
+            commit(batch)
+
+        committer._commit = slow_commit
+        committer.timeout = 0.2
+        # 对象已经在写入的一组中，超时后再等待一个超时时间
+        from threading import Timer
+        Timer(0.3, release.set).start()
+        id = committer.add(Comment(body='slow', post_id=self.post.id,
+                                   author_id=self.user.id))
+        self.assertTrue(Comment.query.get(id).body == 'slow')
+        # 第二次等待仍然超时，对象之后仍会写入
+        release.clear()
+        with self.assertRaises(CommitTimeout):
+            committer.add(Comment(body='slower', post_id=self.post.id,
+                                  author_id=self.user.id))
+        release.set()
+        committer.add(Comment(body='after', post_id=self.post.id,
+                              author_id=self.user.id))
+        db.session.expire_all()
+        self.assertTrue(sorted(c.body for c in self.post.comments) ==
+                        ['after', 'slow', 'slower'])
+
+    def test_group_commit_unexpected_error(self):
+        committer = GroupCommitter()
+        committer.init_app(self.app)
+
+        def broken_commit(batch):
+            raise RuntimeError('broken')
+
+        committer._commit = broken_commit
+        with self.assertRaises(RuntimeError):
+            committer.add(Comment(body='lost', post_id=self.post.id,
+                                  author_id=self.user.id))
+        # 写线程没有退出
+        committer._commit = GroupCommitter._commit.__get__(committer)
+        id = committer.add(Comment(body='saved', post_id=self.post.id,
+                                   author_id=self.user.id))
+        self.assertTrue(Comment.query.get(id).body == 'saved')
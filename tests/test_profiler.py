@@ -0,0 +1,54 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from app import create_app, db, profiler
+from app.models import User, Role
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.profile_dir = tempfile.mkdtemp()
+        self.app.config.update(WTF_CSRF_ENABLED=False,
+                               FLASKY_PROFILER_ENABLED=True,
+                               FLASKY_PROFILE_DIR=self.profile_dir)
+        profiler.init_app(self.app)
+
+        @self.app.route('/_fail')
+        def fail():
+            raise RuntimeError('failed')
+
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(User(email=self.app.config['FLASKY_ADMIN'],
+                            username='admin', password='cat', confirmed=True))
+        db.session.commit()
+        self.client = self.app.test_client()
+        self.client.post('/auth/login', data={
+            'email': self.app.config['FLASKY_ADMIN'], 'password': 'cat'})
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_profile_output(self):
+        response = self.client.get('/hot', headers={'X-Profile': 'cprofile'})
+        name = response.headers['X-Profile-File']
+        self.assertTrue(name.startswith('main.hot_posts.'))
+        self.assertTrue(name.endswith('.prof'))
+        self.assertTrue(os.listdir(self.profile_dir) == [name])
+        response = self.client.get('/hot?_profile=sample')
+        self.assertTrue(response.headers['X-Profile-File'].endswith(
+            '.collapsed'))
+
+    def test_profiler_stopped_after_error(self):
+        with self.assertRaises(RuntimeError):
+            self.client.get('/_fail', headers={'X-Profile': 'cprofile'})
+        self.assertTrue(sys.getprofile() is None)
+        self.assertTrue(len(os.listdir(self.profile_dir)) == 1)
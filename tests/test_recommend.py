@@ -0,0 +1,43 @@
+import unittest
+from app import create_app, db
+from app.models import User, Role
+from app.recommend import build_recommendations, refresh_recommendations
+
+
+class RecommendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.u1 = User(email='john@example.com', password='cat')
+        self.u2 = User(email='susan@example.org', password='dog')
+        self.u3 = User(email='david@example.net', password='dog')
+        db.session.add_all([self.u1, self.u2, self.u3])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_friends_of_friends(self):
+        self.u1.follow(self.u2)
+        self.u2.follow(self.u3)
+        db.session.commit()
+        self.assertTrue(build_recommendations() == 3)
+        self.assertTrue(self.u1.recommended_users() == [self.u3])
+        self.assertTrue(self.u3.recommended_users() == [])
+
+    def test_refresh_stale_users(self):
+        build_recommendations()
+        self.assertTrue(refresh_recommendations() == 0)
+        self.u1.follow(self.u2)
+        self.u2.follow(self.u3)
+        db.session.commit()
+        self.assertTrue(refresh_recommendations() == 2)
+        self.assertTrue(self.u1.recommended_users() == [self.u3])
+        self.u1.follow(self.u3)
+        db.session.commit()
+        self.assertTrue(self.u1.recommended_users() == [])
@@ -0,0 +1,80 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db, scheduler
+from app.scheduler import Scheduler
+from app.models import Role, Job
+
+
+class OtherScheduler(Scheduler):
+    worker_id = 'other:1'
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.calls = []
+        scheduler.task('record')(self.record)
+        scheduler.task('fail')(self.fail)
+
+    def tearDown(self):
+        scheduler.tasks.pop('record')
+        scheduler.tasks.pop('fail')
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def record(self, value=None):
+        self.calls.append(value)
+
+    def fail(self):
+        raise RuntimeError('failed')
+
+    def test_one_shot_jobs(self):
+        scheduler.schedule('record', value=1)
+        scheduler.schedule('record', delay=3600, value=2)
+        scheduler.schedule('fail')
+        db.session.commit()
+        self.assertTrue(scheduler.run_pending() == 2)
+        self.assertTrue(self.calls == [1])
+        # 成功的任务被删除，失败的任务保留错误信息并不再执行
+        jobs = Job.query.order_by(Job.id).all()
+        self.assertTrue(len(jobs) == 2)
+        self.assertTrue(jobs[1].failures == 1 and jobs[1].next_run_at is None)
+        self.assertTrue('RuntimeError' in jobs[1].last_error)
+        self.assertTrue(scheduler.run_pending() == 0)
+        with self.assertRaises(ValueError):
+            scheduler.schedule('missing')
+
+    def test_periodic_jobs(self):
+        scheduler.intervals['record'] = 60
+        try:
+            scheduler.sync()
+            scheduler.sync()
+            job = Job.query.filter_by(name='record').one()
+            self.assertTrue(scheduler.run_pending() >= 1)
+            self.assertTrue(self.calls == [None])
+            db.session.refresh(job)
+            self.assertTrue(job.runs == 1 and job.locked_by is None)
+            self.assertTrue(job.next_run_at > datetime.utcnow())
+            self.assertTrue(scheduler.run_pending() == 0)
+        finally:
+            scheduler.intervals.pop('record')
+
+    def test_claim_is_exclusive(self):
+        scheduler.schedule('record')
+        db.session.commit()
+        # 另一个进程领取了任务
+        other = OtherScheduler()
+        other.tasks = scheduler.tasks
+        self.assertTrue(len(other.claim()) == 1)
+        self.assertTrue(scheduler.claim() == [])
+        # 租约过期后可以重新领取
+        job = Job.query.one()
+        job.locked_until = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        self.assertTrue(len(scheduler.claim()) == 1)
+        self.assertTrue(scheduler.run(job.id) and self.calls == [None])
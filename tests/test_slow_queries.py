@@ -0,0 +1,48 @@
+import json
+import os
+import tempfile
+import unittest
+from app import create_app, db, slow_queries
+from app.models import User
+
+
+class SlowQueryLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        slow_queries.init_app(self.app)
+        os.remove(self.path)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_query_over_threshold(self):
+        slow_queries.query_time = 0
+        slow_queries.path = self.path
+        User.query.filter_by(username='john').first()
+        entries = [e for e in slow_queries.entries()
+                   if e['type'] == 'query' and 'FROM users' in e['statement']]
+        self.assertTrue(len(entries) == 1)
+        # 只记录参数的类型
+        self.assertTrue('john' not in json.dumps(entries[0]['parameters']))
+        with open(self.path) as f:
+            logged = [json.loads(line) for line in f]
+        self.assertTrue(entries[0] in logged)
+
+    def test_query_under_threshold(self):
+        slow_queries.query_time = 60
+        User.query.filter_by(username='john').first()
+        self.assertTrue(slow_queries.entries() == [])
+
+    def test_slow_request(self):
+        slow_queries.query_time = 60
+        slow_queries.request_time = 0
+        self.app.test_client().get('/hot')
+        entries = slow_queries.entries()
+        self.assertTrue([e['endpoint'] for e in entries] == ['main.hot_posts'])
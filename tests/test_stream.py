@@ -0,0 +1,53 @@
+import json
+import unittest
+from app import create_app, db
+from app.stream import Broker
+
+
+class StreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.broker = Broker()
+        self.broker.max_streams = 2
+        self.broker.queue_size = 2
+
+    def test_publish_to_channel(self):
+        posts = self.broker.subscribe(['posts'])
+        comments = self.broker.subscribe(['post:1'])
+        self.broker.publish('posts', 'post', {'id': 1})
+        event, data = posts.get(0)
+        self.assertTrue(event == 'post' and json.loads(data) == {'id': 1})
+        self.assertTrue(comments.get(0) is None)
+
+    def test_connection_limit(self):
+        first = self.broker.subscribe(['posts'])
+        self.assertTrue(self.broker.subscribe(['posts']) is not None)
+        self.assertTrue(self.broker.subscribe(['posts']) is None)
+        self.broker.unsubscribe(first)
+        self.assertTrue(self.broker.subscribe(['posts']) is not None)
+
+    def test_slow_client_is_closed(self):
+        subscription = self.broker.subscribe(['posts'])
+        for i in range(3):
+            self.broker.publish('posts', 'post', {'id': i})
+        self.assertTrue(subscription.closed)
+        self.assertTrue(subscription.get(0) is not None)
+        self.assertTrue(subscription.get(0) is None)
+
+    def test_unsubscribe_when_closed_before_start(self):
+        self.broker.enabled = True
+        response = self.broker.stream(['posts'])
+        self.assertTrue(len(self.broker._subscriptions) == 1)
+        # 生成器没有开始执行时关闭响应
+        response.close()
+        self.assertTrue(len(self.broker._subscriptions) == 0)
+
+    def test_disabled_by_default(self):
+        self.assertTrue(self.broker.stream(['posts']).status_code == 404)
+        app = create_app('testing')
+        with app.app_context():
+            db.create_all()
+            client = app.test_client()
+            self.assertTrue(b'EventSource' not in client.get('/').data)
+            self.assertTrue(client.get('/stream').status_code == 404)
+            db.session.remove()
+            db.drop_all()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.archive import archive_posts
+from app.models import User, Role, Post, Comment, Follow, ArchivedPost, \
+    ArchivedComment
+from app.transfer import export_data, import_data
+
+
+class TransferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def test_export_import(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.com', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1.follow(u2)
+        post = Post(body='**hello**', author=u1)
+        db.session.add(post)
+        db.session.add_all([Comment(body='*%d*' % i, post=post, author=u2)
+                            for i in range(5)])
+        db.session.commit()
+        user_id = u1.id
+        path = os.path.join(self.directory, 'export.ndjson.gz')
+        exported = export_data(path, chunk_size=2)
+        self.assertTrue(exported['comments'] == 5 and exported['users'] == 2)
+        self.assertRaises(ValueError, import_data, path)
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        self.assertTrue(import_data(path, chunk_size=2) == exported)
+        self.assertTrue(User.query.get(user_id).verify_password('cat'))
+        self.assertTrue(Follow.query.count() == 3)     # 包括两个用户关注自己
+        post = Post.query.one()
+        self.assertTrue(post.body_html == '<p><strong>hello</strong></p>')
+        self.assertTrue(post.comment_count == 5)
+        self.assertTrue(Comment.query.order_by(Comment.id).first().body_html ==
+                        '<em>0</em>')
+
+    def test_export_import_archive(self):
+        u = User(email='john@example.com', password='cat')
+        old = Post(body='*old*', author=u,
+                   timestamp=datetime.utcnow() - timedelta(days=30))
+        db.session.add_all([u, old, Post(body='new', author=u)])
+        db.session.commit()
+        db.session.add(Comment(body='**c**', post=old, author=u,
+                               timestamp=datetime.utcnow() - timedelta(days=30)))
+        db.session.commit()
+        post_id = old.id
+        self.assertTrue(archive_posts(datetime.utcnow() - timedelta(days=7)) ==
+                        (1, 1))
+        path = os.path.join(self.directory, 'export.ndjson')
+        exported = export_data(path)
+        self.assertTrue(exported['archived_posts'] == 1 and
+                        exported['archived_comments'] == 1)
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        # 归档表不为空时同样拒绝导入
+        db.session.add(ArchivedPost(id=1000, body='x'))
+        db.session.commit()
+        self.assertRaises(ValueError, import_data, path)
+        self.assertTrue(User.query.count() == 0)
+        ArchivedPost.query.delete()
+        db.session.commit()
+        self.assertTrue(import_data(path) == exported)
+        self.assertTrue(Post.query.get(post_id) is None)
+        archived = ArchivedPost.query.get(post_id)
+        self.assertTrue(archived.body_html == '<p><em>old</em></p>')
+        self.assertTrue(ArchivedComment.query.one().body_html ==
+                        '<strong>c</strong>')
@@ -1,7 +1,7 @@
 import unittest
 import time
 from app import create_app, db
-from app.models import User, AnonymousUser, Role, Permission
+from app.models import User, AnonymousUser, Role, Permission, Follow
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -113,4 +113,79 @@ class UserModelTestCase(unittest.TestCase):
 
     def test_anonymous_user(self):
         u = AnonymousUser()
-        self.assertFalse(u.can(Permission.FOLLOW))
\ No newline at end of file
+        self.assertFalse(u.can(Permission.FOLLOW))
+
+    def test_insert_roles_is_idempotent(self):
+        Role.insert_roles()
+        self.assertTrue(Role.query.count() == 3)
+        self.assertTrue(
+            Role.query.filter_by(default=True).first().name == 'User')
+
+    def test_add_self_follows(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        Follow.query.delete()
+        db.session.commit()
+        self.assertTrue(User.add_self_follows(chunk_size=1) == 2)
+        self.assertTrue(u1.is_following(u1))
+        self.assertTrue(u2.is_following(u2))
+        self.assertTrue(User.add_self_follows(chunk_size=1) == 0)
+        self.assertTrue(Follow.query.count() == 2)
+
+    def test_follows(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertFalse(u1.is_following(u2))
+        self.assertFalse(u2.is_followed_by(u1))
+        u1.follow(u2)
+        db.session.commit()
+        self.assertTrue(u1.is_following(u2))
+        self.assertTrue(u2.is_followed_by(u1))
+        self.assertFalse(u2.is_following(u1))
+        self.assertTrue(u1.followed_count() == 2)
+        self.assertTrue(u2.followers_count() == 2)
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertFalse(u1.is_following(u2))
+        self.assertTrue(u2.followers_count() == 1)
+
+    def test_follow_cache_rollback(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertFalse(u1.is_following(u2))
+        u1.follow(u2)
+        db.session.flush()
+        self.assertTrue(u1.is_following(u2))
+        db.session.rollback()
+        self.assertFalse(u1.is_following(u2))
+
+    def test_update_follows(self):
+        u1 = User(email='john@example.com', username='john', password='cat')
+        u2 = User(email='susan@example.org', username='susan', password='dog')
+        u3 = User(email='david@example.net', username='david', password='dog')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        u1.follow(u2)
+        db.session.commit()
+        resolved, not_found = User.resolve(['susan', u3.id, 'nobody'])
+        self.assertTrue(resolved == {'susan': u2.id, u3.id: u3.id})
+        self.assertTrue(not_found == ['nobody'])
+        added, removed = u1.update_follows(follow=[u2.id, u3.id, u1.id],
+                                           unfollow=[])
+        db.session.commit()
+        self.assertTrue((added, removed) == ([u3.id], []))
+        self.assertTrue(u1.is_following(u3))
+        self.assertTrue(u3.is_followed_by(u1))
+        self.assertTrue(u1.recommendations_stale)
+        added, removed = u1.update_follows(unfollow=[u2.id, u3.id])
+        db.session.commit()
+        self.assertTrue((added, removed) == ([], [u2.id, u3.id]))
+        self.assertFalse(u1.is_following(u2))
+        self.assertTrue(u1.followed_count() == 1)
+        self.assertTrue(u3.followers_count() == 1)